@@ -0,0 +1,81 @@
+"""
+Records/sec of the record-at-a-time vs columnar analytics paths.
+
+Replays the broker partition logs (logs_800x/partition_0/*.jsonl, or the
+pre-segmentation logs_800x/partition_0.jsonl) through the same window and
+aggregations twice, in /consume-sized batches, and checks that both paths
+produce the same window results. Timing covers folding the batches into
+window buckets; emitting windows is shared code and is left out. Nothing is
+treated as late (the logs mix several runs, so event times jump around) and
+all windows are flushed at the end, so both paths fold every record.
+Top-k is approximate and order dependent, so it is left out of the comparison.
+
+Usage: python -m analytics.bench_columnar [BATCH_SIZE] [REPEAT]
+"""
+import glob
+import json
+import math
+import sys
+import time
+
+from analytics.aggregations import build_aggregations
+from analytics.stream_analytics import StreamJob
+from analytics.windows import SlidingWindow, WatermarkTracker
+
+LOG_GLOBS = ("logs_800*/partition_0.jsonl", "logs_800*/partition_0/*.jsonl")
+AGGREGATIONS = "count,count_by_key,topk:5,sum:client_ts,distinct"
+
+
+def load_messages():
+    msgs = []
+    for path in sorted(p for pattern in LOG_GLOBS for p in glob.glob(pattern)):
+        with open(path) as f:
+            msgs.extend(json.loads(ln) for ln in f if ln.strip())
+    # records without any event time fall back to the wall clock, which differs between the two runs
+    return [m for m in msgs if any(m.get(k) is not None for k in ("timestamp", "client_ts", "ts"))]
+
+
+def run(messages, batch_size: int, vectorized: bool):
+    job = StreamJob(SlidingWindow(60, 5, build_aggregations(AGGREGATIONS)),
+                    WatermarkTracker(allowed_lateness=0), vectorized)
+    t0 = time.perf_counter()
+    for i in range(0, len(messages), batch_size):
+        job.process(0, messages[i:i + batch_size], i + batch_size)
+    elapsed = time.perf_counter() - t0  # ingest only; the final flush is shared by both paths
+    results = job.window.advance(max(job.watermarks.max_ts.values()) + job.window.size)
+    for r in results:
+        r["results"].pop("topk:5", None)
+    return elapsed, results
+
+
+def same_results(a, b) -> bool:
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        xs, ys = dict(x["results"]), dict(y["results"])
+        # float sums depend on summation order
+        if not math.isclose(xs.pop("sum:client_ts"), ys.pop("sum:client_ts"), rel_tol=1e-9):
+            return False
+        if (x["window_start"], x["window_end"], xs) != (y["window_start"], y["window_end"], ys):
+            return False
+    return True
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    messages = load_messages() * repeat
+    print(f"{len(messages)} records from {' + '.join(LOG_GLOBS)} (x{repeat}), batch size {batch_size}")
+    base = None
+    for vectorized in (False, True):
+        elapsed, results = run(messages, batch_size, vectorized)
+        label = "columnar" if vectorized else "per-record"
+        print(f"  {label:<10} {len(messages) / elapsed:>12,.0f} records/sec  ({elapsed:.3f}s)")
+        if base is None:
+            base = results
+        elif not same_results(base, results):
+            print("  WARNING: columnar results differ from the per-record path")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,306 @@
+"""
+Windowed stream analytics over the broker partitions.
+
+Every poll fetches all partitions concurrently (partition list and in-sync
+replicas come from the live /metadata endpoint; each read goes to the replica
+client/replica_selector.py picks), folds the records into event-time
+windows keyed by the message `timestamp`, and prints each window once the
+watermark has passed its end.
+
+Run from the repository root: python -m analytics.stream_analytics
+
+Configuration (environment):
+  WINDOW_TYPE       tumbling | sliding | session        (default sliding)
+  WINDOW_SIZE       window length in seconds             (default 60)
+  WINDOW_SLIDE      slide for sliding windows            (default 5)
+  SESSION_GAP       inactivity gap for session windows   (default 30)
+  ALLOWED_LATENESS  watermark delay in seconds           (default 5)
+  AGGREGATIONS      e.g. "count,count_by_key,topk:5,sum:value,distinct"
+  CHECKPOINT_INTERVAL_SEC / CHECKPOINT_INTERVAL_RECORDS
+                    checkpoint every N seconds or N records (default 10 / 5000)
+  FULL_CHECKPOINT_EVERY
+                    write a full snapshot every N checkpoints, deltas otherwise (default 10)
+  ANALYTICS_GROUP   consumer group the job commits its offsets under (default analytics)
+  VECTORIZED        1 to fold tumbling/sliding windows through the numpy batch
+                    path in analytics/columnar.py (default 1)
+  START_TIME        epoch seconds or ISO 8601 time; partitions without a
+                    checkpointed offset start at the first record at or after
+                    it (broker /offsets_for_time) instead of offset 0
+
+State and offsets are checkpointed together (see analytics/checkpoint.py), and
+offsets are only committed to the brokers once the matching checkpoint is on
+disk, so a restart resumes exactly where the durable state left off.
+"""
 import requests
 import time
 import json
 import os
-from collections import defaultdict, deque
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from analytics.aggregations import build_aggregations
+from analytics.checkpoint import Checkpointer
+from analytics.columnar import ColumnarBatch, add_batch
+from analytics.windows import WatermarkTracker, build_window
+from client.replica_selector import ReplicaSelector, read_replicas
+from client.throttle import throttle_hint
 
-METADATA_FILE = "broker/metadata.json"
+BOOTSTRAP_BROKERS = [
+    "http://localhost:8000",
+    "http://localhost:8001",
+    "http://localhost:8002",
+    "http://localhost:8003",
+]
 SNAPSHOT_FILE = "analytics_snapshot.json"
-NUM_PARTITIONS = 3
 POLL_INTERVAL = 2.0  # seconds
-WINDOW_SIZE = 60  # seconds, sliding window
+METADATA_REFRESH_SEC = 5.0
+
+WINDOW_TYPE = os.environ.get("WINDOW_TYPE", "sliding")
+WINDOW_SIZE = float(os.environ.get("WINDOW_SIZE", 60))
+WINDOW_SLIDE = float(os.environ.get("WINDOW_SLIDE", 5))
+SESSION_GAP = float(os.environ.get("SESSION_GAP", 30))
+ALLOWED_LATENESS = float(os.environ.get("ALLOWED_LATENESS", 5))
+AGGREGATIONS = os.environ.get("AGGREGATIONS", "count,count_by_key,topk:5,distinct")
+CHECKPOINT_INTERVAL_SEC = float(os.environ.get("CHECKPOINT_INTERVAL_SEC", 10))
+CHECKPOINT_INTERVAL_RECORDS = int(os.environ.get("CHECKPOINT_INTERVAL_RECORDS", 5000))
+FULL_CHECKPOINT_EVERY = int(os.environ.get("FULL_CHECKPOINT_EVERY", 10))
+ANALYTICS_GROUP = os.environ.get("ANALYTICS_GROUP", "analytics")
+VECTORIZED = os.environ.get("VECTORIZED", "1") == "1"
+START_TIME = os.environ.get("START_TIME")
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # one pooled keep-alive session per fetch thread
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        _local.session = s
+    return s
+
+
+def load_metadata() -> Dict:
+    for b in BOOTSTRAP_BROKERS:
+        try:
+            r = _session().get(f"{b}/metadata", timeout=1.0)
+            r.raise_for_status()
+            return r.json()
+        except requests.exceptions.RequestException:
+            continue
+    raise RuntimeError("No brokers available to fetch metadata from")
 
-def load_metadata():
-    with open(METADATA_FILE, "r") as f:
-        return json.load(f)
 
 def get_leader(partition: int, metadata: dict):
     return metadata["leaders"][str(partition)]
 
-def load_snapshot():
-    if os.path.exists(SNAPSHOT_FILE):
-        with open(SNAPSHOT_FILE) as f:
-            snapshot = json.load(f)
-            counts = defaultdict(int, snapshot.get("counts", {}))
-            offsets = snapshot.get("offsets", {str(p): 0 for p in range(NUM_PARTITIONS)})
-            return counts, {int(k): v for k, v in offsets.items()}
-    else:
-        return defaultdict(int), {p: 0 for p in range(NUM_PARTITIONS)}
-
-def save_snapshot(counts, offsets):
-    snapshot = {
-        "counts": counts,
-        "offsets": offsets
-    }
-    with open(SNAPSHOT_FILE, "w") as f:
-        json.dump(snapshot, f)
-
-def consume_and_update(counts, offsets, poll_interval=POLL_INTERVAL):
-    window_messages = deque()  # (timestamp, key)
-    while True:
-        metadata = load_metadata()
-        for partition in range(NUM_PARTITIONS):
-            broker_url = get_leader(partition, metadata)
-            offset = offsets.get(partition, 0)
+
+def event_time(msg: Dict) -> float:
+    for field in ("timestamp", "client_ts", "ts"):
+        v = msg.get(field)
+        if v is not None:
             try:
-                resp = requests.get(f"{broker_url}/consume",
-                                    params={"partition": partition, "offset": offset}, timeout=2)
-                resp.raise_for_status()
-                data = resp.json()
-                messages = data.get("messages", [])
-                for msg in messages:
-                    ts = msg.get("timestamp", time.time())
-                    key = msg.get("key")
-                    window_messages.append((ts, key))
-                    counts[key] += 1
-                    offset += 1
-                offsets[partition] = offset
-            except requests.exceptions.RequestException:
-                print(f"[Partition {partition}] Leader unreachable at {broker_url}, skipping...")
-        
-        # Remove old messages outside the window
-        cutoff = time.time() - WINDOW_SIZE
-        while window_messages and window_messages[0][0] < cutoff:
-            _, key = window_messages.popleft()
-            counts[key] -= 1
-            if counts[key] <= 0:
-                del counts[key]
-
-        # Print current windowed counts
-        if counts:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Windowed counts: {dict(counts)}")
-        
-        # Save snapshot every loop
-        save_snapshot(counts, offsets)
-
-        time.sleep(poll_interval)
+                return float(v)
+            except (TypeError, ValueError):
+                pass
+    return time.time()
+
+
+class StreamJob:
+    """Window + watermark + per-partition offsets for one analytics job."""
+
+    def __init__(self, window, watermarks: WatermarkTracker, vectorized: bool = False):
+        self.window = window
+        self.watermarks = watermarks
+        self.offsets: Dict[int, int] = {}
+        self.late_records = 0
+        # session windows are per key and stay on the record-at-a-time path
+        self.vectorized = vectorized and hasattr(window, "add_columns")
+
+    def process(self, partition: int, messages: List[Dict], next_offset: int):
+        if self.vectorized and messages:
+            batch = ColumnarBatch(messages, time.time())
+            self.watermarks.observe(partition, float(batch.ts.max()))
+            self.late_records += add_batch(self.window, batch)
+            self.offsets[partition] = next_offset
+            return
+        for msg in messages:
+            ts = event_time(msg)
+            self.watermarks.observe(partition, ts)
+            if self.window.is_late(ts):
+                self.late_records += 1
+                continue
+            self.window.add(ts, msg)
+        self.offsets[partition] = next_offset
+
+    def advance(self) -> List[Dict]:
+        return self.window.advance(self.watermarks.watermark())
+
+    def state(self) -> Dict:
+        return {
+            "offsets": {str(k): v for k, v in self.offsets.items()},
+            "window": self.window.state(),
+            "watermark": self.watermarks.state(),
+            "late_records": self.late_records,
+        }
+
+    def restore(self, state: Dict):
+        self.offsets = {int(k): int(v) for k, v in state.get("offsets", {}).items()}
+        if "window" in state:
+            self.window.restore(state["window"])
+        if "watermark" in state:
+            self.watermarks.restore(state["watermark"])
+        self.late_records = int(state.get("late_records", 0))
+
+    def delta_state(self) -> Dict:
+        # offsets and watermarks are small, so deltas carry them in full
+        state = self.state()
+        state.pop("window")
+        state["window_delta"] = self.window.delta()
+        return state
+
+    def apply_delta(self, delta: Dict):
+        self.window.apply_delta(delta["window_delta"])
+        self.offsets = {int(k): int(v) for k, v in delta.get("offsets", {}).items()}
+        self.watermarks.restore(delta.get("watermark", {}))
+        self.late_records = int(delta.get("late_records", 0))
+
+    def clear_dirty(self):
+        self.window.clear_dirty()
+
+
+def build_job() -> StreamJob:
+    aggs = build_aggregations(AGGREGATIONS)
+    window = build_window(WINDOW_TYPE, WINDOW_SIZE, WINDOW_SLIDE, SESSION_GAP, aggs)
+    return StreamJob(window, WatermarkTracker(ALLOWED_LATENESS), VECTORIZED)
+
+
+def build_checkpointer() -> Checkpointer:
+    return Checkpointer(SNAPSHOT_FILE, CHECKPOINT_INTERVAL_SEC, CHECKPOINT_INTERVAL_RECORDS,
+                        FULL_CHECKPOINT_EVERY)
+
+
+def commit_offsets(metadata: Dict, offsets: Dict[str, int]):
+    """Report durable offsets to the partition leaders (best effort)."""
+    for pid, offset in offsets.items():
+        leader = metadata["leaders"].get(str(pid))
+        if leader is None:
+            continue
+        try:
+            _session().post(f"{leader}/commit_offset",
+                            json={"group_id": ANALYTICS_GROUP, "partition": int(pid), "offset": offset},
+                            timeout=1.0)
+        except requests.exceptions.RequestException:
+            pass
+
+
+def parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def seek_to_time(job: StreamJob, metadata: Dict, ts: float) -> bool:
+    """Set the offset of every partition the job has not read yet from the leaders'
+    time index. Returns False if some leader could not be asked (retry next poll)."""
+    ok = True
+    for pid_str in metadata["partitions"]:
+        partition = int(pid_str)
+        if partition in job.offsets:
+            continue
+        try:
+            resp = _session().get(f"{get_leader(partition, metadata)}/offsets_for_time",
+                                  params={"partition": partition, "timestamp": ts}, timeout=2)
+            resp.raise_for_status()
+            job.offsets[partition] = int(resp.json()["offset"])
+        except requests.exceptions.RequestException:
+            ok = False
+    return ok
+
+
+# shared by the fetch threads; offsets are still committed to the leaders
+selector = ReplicaSelector()
+# partition -> no fetch before this time (broker throttle hint)
+throttled_until: Dict[int, float] = {}
+
+
+def _throttle(partition: int, throttle_ms: float):
+    if throttle_ms > 0:
+        throttled_until[partition] = time.time() + throttle_ms / 1000.0
+
+
+def fetch_partition(broker_url: str, partition: int, offset: int) -> Optional[Tuple[List[Dict], int]]:
+    try:
+        with selector.request(broker_url):
+            resp = _session().get(f"{broker_url}/consume", params={"partition": partition, "offset": offset},
+                                  headers={"X-Client-Id": ANALYTICS_GROUP}, timeout=2)
+        if resp.status_code == 429:
+            # over the consume quota: skip this partition until the hinted time
+            _throttle(partition, throttle_hint(resp))
+            print(f"[Partition {partition}] Throttled by {broker_url}")
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        # served, but the next fetch has to wait until the quota has recovered
+        _throttle(partition, data.get("throttle_time_ms", 0))
+        return data.get("messages", []), int(data.get("next_offset", offset))
+    except requests.exceptions.RequestException:
+        print(f"[Partition {partition}] Replica unreachable at {broker_url}, skipping...")
+        return None
+
+
+def poll_once(job: StreamJob, metadata: Dict, pool: ThreadPoolExecutor):
+    futures = {}
+    now = time.time()
+    for pid_str in metadata["partitions"]:
+        partition = int(pid_str)
+        if throttled_until.get(partition, 0.0) > now:
+            continue
+        broker_url = selector.choose(read_replicas(metadata, partition))
+        futures[partition] = pool.submit(fetch_partition, broker_url, partition, job.offsets.get(partition, 0))
+    records = 0
+    for partition, fut in futures.items():
+        res = fut.result()
+        if res is not None:
+            job.process(partition, *res)
+            records += len(res[0])
+    return records
+
+
+def consume_and_update(job: StreamJob, checkpointer: Checkpointer, poll_interval=POLL_INTERVAL,
+                       start_time: Optional[float] = None):
+    metadata, md_at = None, 0.0
+    seeked = start_time is None
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        while True:
+            if metadata is None or time.time() - md_at > METADATA_REFRESH_SEC:
+                try:
+                    metadata, md_at = load_metadata(), time.time()
+                except RuntimeError as e:
+                    print(f"[analytics] {e}")
+            if metadata is not None and not seeked:
+                seeked = seek_to_time(job, metadata, start_time)
+            if metadata is not None and seeked:
+                checkpointer.records_since += poll_once(job, metadata, pool)
+
+            for res in job.advance():
+                start = datetime.fromtimestamp(res["window_start"]).strftime('%H:%M:%S')
+                end = datetime.fromtimestamp(res["window_end"]).strftime('%H:%M:%S')
+                prefix = f"key={res['key']} " if "key" in res else ""
+                print(f"[{start}-{end}] {prefix}{json.dumps(res['results'])}")
+
+            if checkpointer.due():
+                durable = checkpointer.write(job)
+                if metadata is not None:
+                    commit_offsets(metadata, durable)
+            time.sleep(poll_interval)
+
 
 if __name__ == "__main__":
-    counts, offsets = load_snapshot()
-    consume_and_update(counts, offsets)
+    job = build_job()
+    checkpointer = build_checkpointer()
+    checkpointer.restore(job)
+    consume_and_update(job, checkpointer, start_time=parse_time(START_TIME) if START_TIME else None)
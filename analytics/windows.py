@@ -0,0 +1,312 @@
+"""
+Event-time windows for the stream analytics job.
+
+Records are folded into accumulators as they arrive instead of being kept
+around, so memory grows with the number of open buckets (and, for session
+windows, open sessions) rather than with the number of messages. Windows are
+closed and emitted once the watermark passes their end.
+"""
+import math
+import time
+from typing import Dict, List, Optional
+
+from analytics.aggregations import Aggregation
+
+
+class SlidingWindow:
+    """Windows of `size` seconds starting every `slide` seconds.
+
+    Records land in slide-wide buckets (one accumulator per aggregation per
+    bucket); a window result merges the size/slide buckets it spans.
+    """
+    kind = "sliding"
+
+    def __init__(self, size: float, slide: float, aggregations: List[Aggregation]):
+        if size <= 0 or slide <= 0:
+            raise ValueError("window size and slide must be positive")
+        n = size / slide
+        if abs(n - round(n)) > 1e-9:
+            raise ValueError("window size must be a multiple of the slide")
+        self.size = size
+        self.slide = slide
+        self.span = int(round(n))  # buckets per window
+        self.aggregations = aggregations
+        self.buckets: Dict[int, Dict[str, object]] = {}
+        self.last_emitted_end: Optional[int] = None  # bucket index of the last emitted window end
+        # buckets changed / dropped since the last checkpoint, for delta checkpoints
+        self.dirty = set()
+        self.removed = set()
+
+    def _bucket(self, ts: float) -> int:
+        return int(math.floor(ts / self.slide))
+
+    def is_late(self, ts: float) -> bool:
+        """A record is late once every window containing it has been emitted."""
+        if self.last_emitted_end is None:
+            return False
+        return self._bucket(ts) + self.span <= self.last_emitted_end
+
+    def add(self, ts: float, record: Dict):
+        idx = self._bucket(ts)
+        accs = self.buckets.get(idx)
+        if accs is None:
+            accs = {a.name: a.create() for a in self.aggregations}
+            self.buckets[idx] = accs
+        for a in self.aggregations:
+            accs[a.name] = a.add(accs[a.name], record)
+        self.dirty.add(idx)
+
+    def add_columns(self, idx: int, cols):
+        """Vectorised counterpart of add() for one bucket's worth of a columnar batch."""
+        accs = self.buckets.get(idx)
+        if accs is None:
+            accs = {a.name: a.create() for a in self.aggregations}
+            self.buckets[idx] = accs
+        for a in self.aggregations:
+            accs[a.name] = a.add_columns(accs[a.name], cols)
+        self.dirty.add(idx)
+
+    def _window_result(self, end: int) -> Optional[Dict]:
+        merged = None
+        for idx in range(end - self.span, end):
+            accs = self.buckets.get(idx)
+            if accs is None:
+                continue
+            if merged is None:
+                merged = {a.name: a.merge(a.create(), accs[a.name]) for a in self.aggregations}
+            else:
+                merged = {a.name: a.merge(merged[a.name], accs[a.name]) for a in self.aggregations}
+        if merged is None:
+            return None
+        return {
+            "window_start": (end - self.span) * self.slide,
+            "window_end": end * self.slide,
+            "results": {a.name: a.result(merged[a.name]) for a in self.aggregations},
+        }
+
+    def advance(self, watermark: float) -> List[Dict]:
+        """Emit every window ending at or before the watermark and drop buckets no open window needs."""
+        emitted = []
+        if watermark == float("-inf"):
+            return emitted
+        limit = int(math.floor(watermark / self.slide))
+        if self.buckets:
+            first = min(self.buckets) + 1
+            end = first if self.last_emitted_end is None else max(self.last_emitted_end + 1, first)
+            while end <= limit:
+                res = self._window_result(end)
+                if res is not None:
+                    emitted.append(res)
+                    end += 1
+                    continue
+                # nothing buffered in this window; jump to the next window that has data
+                later = [i for i in self.buckets if i >= end]
+                if not later:
+                    break
+                end = max(end + 1, min(later) + 1)
+        elif self.last_emitted_end is None:
+            return emitted
+        # every window ending at or before `limit` is now closed, empty or not
+        self.last_emitted_end = limit if self.last_emitted_end is None else max(self.last_emitted_end, limit)
+        for idx in [i for i in self.buckets if i + self.span <= self.last_emitted_end]:
+            del self.buckets[idx]
+            self.dirty.discard(idx)
+            self.removed.add(idx)
+        return emitted
+
+    def current(self) -> Optional[Dict]:
+        """Partial result of the most recent window (for live display)."""
+        if not self.buckets:
+            return None
+        return self._window_result(max(self.buckets) + 1)
+
+    def state(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "last_emitted_end": self.last_emitted_end,
+        }
+
+    def restore(self, state: Dict):
+        if state.get("kind") != self.kind:
+            return
+        self.buckets = {int(k): v for k, v in state.get("buckets", {}).items()}
+        self.last_emitted_end = state.get("last_emitted_end")
+
+    def delta(self) -> Dict:
+        """Changes since the last clear_dirty(): touched buckets in full, dropped ones by index."""
+        return {
+            "kind": self.kind,
+            "buckets": {str(k): self.buckets[k] for k in self.dirty},
+            "removed": sorted(self.removed),
+            "last_emitted_end": self.last_emitted_end,
+        }
+
+    def apply_delta(self, delta: Dict):
+        if delta.get("kind") != self.kind:
+            return
+        for idx in delta.get("removed", []):
+            self.buckets.pop(int(idx), None)
+        for k, v in delta.get("buckets", {}).items():
+            self.buckets[int(k)] = v
+        self.last_emitted_end = delta.get("last_emitted_end")
+
+    def clear_dirty(self):
+        self.dirty = set()
+        self.removed = set()
+
+
+class TumblingWindow(SlidingWindow):
+    """Non-overlapping windows of `size` seconds."""
+    kind = "tumbling"
+
+    def __init__(self, size: float, aggregations: List[Aggregation]):
+        super().__init__(size, size, aggregations)
+
+
+class SessionWindow:
+    """Per-key sessions that stay open while records keep arriving within `gap` seconds."""
+    kind = "session"
+
+    def __init__(self, gap: float, aggregations: List[Aggregation]):
+        if gap <= 0:
+            raise ValueError("session gap must be positive")
+        self.gap = gap
+        self.aggregations = aggregations
+        self.sessions: Dict[str, List[Dict]] = {}  # key -> [{"start", "end", "accs"}]
+        self.watermark = float("-inf")
+        self.dirty = set()  # keys whose sessions changed since the last checkpoint
+
+    def is_late(self, ts: float) -> bool:
+        return ts + self.gap <= self.watermark
+
+    def add(self, ts: float, record: Dict):
+        key = str(record.get("key"))
+        sessions = self.sessions.setdefault(key, [])
+        merged = {"start": ts, "end": ts, "accs": {a.name: a.create() for a in self.aggregations}}
+        keep = []
+        for s in sessions:
+            if s["start"] - self.gap <= ts <= s["end"] + self.gap:
+                merged["start"] = min(merged["start"], s["start"])
+                merged["end"] = max(merged["end"], s["end"])
+                merged["accs"] = {a.name: a.merge(merged["accs"][a.name], s["accs"][a.name])
+                                  for a in self.aggregations}
+            else:
+                keep.append(s)
+        for a in self.aggregations:
+            merged["accs"][a.name] = a.add(merged["accs"][a.name], record)
+        keep.append(merged)
+        self.sessions[key] = keep
+        self.dirty.add(key)
+
+    def advance(self, watermark: float) -> List[Dict]:
+        self.watermark = max(self.watermark, watermark)
+        emitted = []
+        for key in list(self.sessions):
+            still_open = []
+            for s in self.sessions[key]:
+                if s["end"] + self.gap <= self.watermark:
+                    emitted.append({
+                        "key": key,
+                        "window_start": s["start"],
+                        "window_end": s["end"] + self.gap,
+                        "results": {a.name: a.result(s["accs"][a.name]) for a in self.aggregations},
+                    })
+                else:
+                    still_open.append(s)
+            if len(still_open) == len(self.sessions[key]):
+                continue
+            self.dirty.add(key)
+            if still_open:
+                self.sessions[key] = still_open
+            else:
+                del self.sessions[key]
+        emitted.sort(key=lambda r: r["window_end"])
+        return emitted
+
+    def current(self) -> Optional[Dict]:
+        if not self.sessions:
+            return None
+        return {"open_sessions": sum(len(v) for v in self.sessions.values()), "keys": len(self.sessions)}
+
+    def state(self) -> Dict:
+        return {"kind": self.kind, "sessions": self.sessions,
+                "watermark": None if self.watermark == float("-inf") else self.watermark}
+
+    def restore(self, state: Dict):
+        if state.get("kind") != self.kind:
+            return
+        self.sessions = state.get("sessions", {})
+        wm = state.get("watermark")
+        self.watermark = float("-inf") if wm is None else wm
+
+    def delta(self) -> Dict:
+        """Sessions of every key touched since the last clear_dirty(); None marks a key with no open sessions."""
+        return {
+            "kind": self.kind,
+            "sessions": {k: self.sessions.get(k) for k in self.dirty},
+            "watermark": None if self.watermark == float("-inf") else self.watermark,
+        }
+
+    def apply_delta(self, delta: Dict):
+        if delta.get("kind") != self.kind:
+            return
+        for k, v in delta.get("sessions", {}).items():
+            if v is None:
+                self.sessions.pop(k, None)
+            else:
+                self.sessions[k] = v
+        wm = delta.get("watermark")
+        self.watermark = float("-inf") if wm is None else wm
+
+    def clear_dirty(self):
+        self.dirty = set()
+
+
+class WatermarkTracker:
+    """Event-time watermark across partitions.
+
+    The watermark is the smallest per-partition maximum event time minus the
+    allowed lateness. Partitions that have been idle (no records) for longer
+    than `idle_timeout` seconds stop holding it back.
+    """
+
+    def __init__(self, allowed_lateness: float = 5.0, idle_timeout: float = 10.0):
+        self.allowed_lateness = allowed_lateness
+        self.idle_timeout = idle_timeout
+        self.max_ts: Dict[int, float] = {}
+        self.last_seen: Dict[int, float] = {}
+        self.current = float("-inf")
+
+    def observe(self, partition: int, ts: float):
+        if ts > self.max_ts.get(partition, float("-inf")):
+            self.max_ts[partition] = ts
+        self.last_seen[partition] = time.time()
+
+    def watermark(self) -> float:
+        if not self.max_ts:
+            return self.current
+        now = time.time()
+        active = [ts for p, ts in self.max_ts.items() if now - self.last_seen.get(p, 0) <= self.idle_timeout]
+        base = min(active) if active else max(self.max_ts.values())
+        self.current = max(self.current, base - self.allowed_lateness)
+        return self.current
+
+    def state(self) -> Dict:
+        return {"max_ts": {str(k): v for k, v in self.max_ts.items()},
+                "current": None if self.current == float("-inf") else self.current}
+
+    def restore(self, state: Dict):
+        self.max_ts = {int(k): v for k, v in state.get("max_ts", {}).items()}
+        cur = state.get("current")
+        self.current = float("-inf") if cur is None else cur
+
+
+def build_window(kind: str, size: float, slide: float, gap: float, aggregations: List[Aggregation]):
+    if kind == "tumbling":
+        return TumblingWindow(size, aggregations)
+    if kind == "sliding":
+        return SlidingWindow(size, slide, aggregations)
+    if kind == "session":
+        return SessionWindow(gap, aggregations)
+    raise ValueError(f"unknown window type: {kind}")
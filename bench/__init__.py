@@ -0,0 +1,14 @@
+"""
+Reproducible benchmark suite.
+
+    python -m bench list
+    python -m bench run single_partition_publish replication_rf3 --duration 20
+    python -m bench run --all --save-baseline
+    python -m bench compare bench_results/runs/<result>.json
+
+Each scenario starts its own broker cluster (bench.cluster.LocalCluster, or
+bench.embedded.EmbeddedCluster inside this process) in a fresh data directory,
+drives it with utils.load_generator or in-process clients, and writes a JSON
+result. `compare` checks a result against the stored baseline for the same
+scenario and exits non-zero on throughput or p99 regressions.
+"""
@@ -0,0 +1,106 @@
+"""
+python -m bench {list,run,compare} -- see bench/__init__.py.
+"""
+import argparse
+import os
+import sys
+
+from bench.results import (baseline_path, compare, load_result, save_baseline, save_result,
+                           RUNS_DIR)
+from bench.scenarios import SCENARIOS, run_scenario
+
+
+def _print_metrics(result):
+    for k, v in result["metrics"].items():
+        print(f"    {k:<26} {v}")
+
+
+def cmd_list(args):
+    for name, spec in SCENARIOS.items():
+        print(f"{name:<26} {spec['description']}")
+
+
+def cmd_run(args):
+    names = list(SCENARIOS) if args.all else args.scenarios
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown or not names:
+        print(f"unknown or missing scenario(s): {unknown or names}; see `python -m bench list`")
+        return 2
+    overrides = {"duration": args.duration, "rps": args.rps, "workers": args.workers,
+                 "batch_size": args.batch_size, "base_port": args.base_port}
+    status = 0
+    for name in names:
+        print(f"[bench] running {name}")
+        result = run_scenario(name, overrides)
+        path = save_result(result, args.out)
+        print(f"[bench] {name} -> {path}")
+        _print_metrics(result)
+        if args.save_baseline:
+            print(f"[bench] baseline saved to {save_baseline(result)}")
+        elif args.compare:
+            baseline = baseline_path(name)
+            if not os.path.exists(baseline):
+                # a scenario without a baseline yet is not a regression
+                print(f"[bench] {name}: no baseline at {baseline}; skipping comparison")
+                continue
+            status = max(status, _compare_and_report(result, load_result(baseline), args))
+    return status
+
+
+def _compare_and_report(current, baseline, args) -> int:
+    rows = compare(current, baseline, args.throughput_tolerance, args.p99_tolerance)
+    print(f"{'metric':<26} {'baseline':>12} {'current':>12} {'change':>9}")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<26} {r['baseline']:>12} {r['current']:>12} {r['change'] * 100:>8.1f}%{flag}")
+    regressions = [r["metric"] for r in rows if r["regression"]]
+    if regressions:
+        print(f"[bench] {current['scenario']}: regressions in {', '.join(regressions)}")
+        return 1
+    print(f"[bench] {current['scenario']}: no regressions")
+    return 0
+
+
+def cmd_compare(args):
+    current = load_result(args.result)
+    path = args.baseline or baseline_path(current["scenario"])
+    if not os.path.exists(path):
+        print(f"[bench] {current['scenario']}: no baseline at {path}; "
+              f"store one with `python -m bench run {current['scenario']} --save-baseline`")
+        return 2
+    return _compare_and_report(current, load_result(path), args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="list scenarios")
+
+    tolerances = argparse.ArgumentParser(add_help=False)
+    tolerances.add_argument("--throughput-tolerance", type=float, default=0.10,
+                            help="allowed relative drop in *_rps metrics (default 0.10)")
+    tolerances.add_argument("--p99-tolerance", type=float, default=0.20,
+                            help="allowed relative growth in p99 latency metrics (default 0.20)")
+
+    run = sub.add_parser("run", parents=[tolerances], help="run scenarios and store JSON results")
+    run.add_argument("scenarios", nargs="*")
+    run.add_argument("--all", action="store_true")
+    run.add_argument("--duration", type=float)
+    run.add_argument("--rps", type=float)
+    run.add_argument("--workers", type=int)
+    run.add_argument("--batch-size", type=int)
+    run.add_argument("--base-port", type=int)
+    run.add_argument("--out", default=RUNS_DIR)
+    run.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    run.add_argument("--compare", action="store_true", help="compare each result against its baseline")
+
+    cmp_ = sub.add_parser("compare", parents=[tolerances], help="compare a result against a baseline")
+    cmp_.add_argument("result")
+    cmp_.add_argument("baseline", nargs="?")
+
+    args = parser.parse_args(argv)
+    return {"list": cmd_list, "run": cmd_run, "compare": cmd_compare}[args.cmd](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Starts a throwaway broker cluster on localhost via `python -m broker.run_broker`.
+"""
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LocalCluster:
+    """
+    Broker processes for `ports`, all sharing the same cluster list. Each
+    broker writes its logs under `data_dir` (a fresh temp dir by default), so
+    every run starts from empty partitions.
+    """
+
+    def __init__(self, ports: Sequence[int] = (8000, 8001, 8002), num_partitions: int = 1,
+                 replication_factor: int = 3, data_dir: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None):
+        self.ports = list(ports)
+        self.num_partitions = num_partitions
+        self.replication_factor = replication_factor
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="pubg1-bench-")
+        self.extra_env = dict(env or {})
+        self.procs: Dict[int, subprocess.Popen] = {}
+
+    @property
+    def urls(self) -> List[str]:
+        return [f"http://localhost:{p}" for p in self.ports]
+
+    def start_broker(self, port: int):
+        env = os.environ.copy()
+        env.update(self.extra_env)
+        env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        env["BROKER_PORT"] = str(port)
+        env["NUM_PARTITIONS"] = str(self.num_partitions)
+        env["REPLICATION_FACTOR"] = str(self.replication_factor)
+        log = open(os.path.join(self.data_dir, f"broker_{port}.log"), "ab")
+        self.procs[port] = subprocess.Popen(
+            [sys.executable, "-m", "broker.run_broker", str(port)] + [str(p) for p in self.ports],
+            cwd=self.data_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+
+    def wait_ready(self, port: int, timeout: float = 15.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            proc = self.procs.get(port)
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"broker {port} exited with {proc.returncode}; see {self.data_dir}/broker_{port}.log")
+            try:
+                if requests.get(f"http://localhost:{port}/health", timeout=0.5).ok:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.05)
+        return False
+
+    def start(self, timeout: float = 15.0):
+        for port in self.ports:
+            self.start_broker(port)
+        for port in self.ports:
+            if not self.wait_ready(port, timeout):
+                self.stop()
+                raise RuntimeError(f"broker {port} did not become ready within {timeout}s")
+        return self
+
+    def stop_broker(self, port: int, sig: int = signal.SIGTERM, timeout: float = 5.0):
+        proc = self.procs.pop(port, None)
+        if proc is None or proc.poll() is not None:
+            return
+        proc.send_signal(sig)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def restart_broker(self, port: int, timeout: float = 15.0) -> bool:
+        self.stop_broker(port)
+        self.start_broker(port)
+        return self.wait_ready(port, timeout)
+
+    def leader(self, partition: int) -> str:
+        for url in self.urls:
+            try:
+                r = requests.get(f"{url}/metadata", timeout=1.0)
+                r.raise_for_status()
+                return r.json()["leaders"][str(partition)]
+            except requests.exceptions.RequestException:
+                continue
+        raise RuntimeError("No brokers available to fetch metadata from")
+
+    def stop(self):
+        for port in list(self.procs):
+            self.stop_broker(port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
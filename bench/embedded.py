@@ -0,0 +1,163 @@
+"""
+A broker cluster inside the calling process, for integration tests and
+microbenchmarks that should not pay for process startup or HTTP.
+
+    with EmbeddedCluster(num_partitions=2) as cluster:
+        cluster.publish(0, [{"key": "k", "value": 1}])
+        cluster.consume(0)
+
+Brokers are broker.broker.Broker objects with their logs under `data_dir` (a
+fresh temp dir by default). With transport="memory" (the default) they call
+each other through an InMemoryTransport and the ports are only names; with
+transport="http" every broker also serves its FastAPI app on its port from a
+uvicorn thread, so HTTP clients and tools like utils/load_generator.py work
+against it. Broker settings not covered by the arguments go in `config`
+(BrokerConfig field names).
+"""
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from broker.broker import Broker, BrokerConfig, create_app
+from broker.transport import HttpTransport, InMemoryTransport, TransportError
+
+
+class EmbeddedCluster:
+    def __init__(self, ports: Sequence[int] = (8000, 8001, 8002), num_partitions: int = 1,
+                 replication_factor: int = 3, data_dir: Optional[str] = None,
+                 transport: str = "memory", config: Optional[Dict] = None):
+        if transport not in ("memory", "http"):
+            raise ValueError(f"transport must be 'memory' or 'http', not {transport!r}")
+        self.ports = list(ports)
+        self.num_partitions = num_partitions
+        self.replication_factor = replication_factor
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix="pubg1-embedded-")
+        self.http = transport == "http"
+        self.transport = HttpTransport() if self.http else InMemoryTransport()
+        self.config = dict(config or {})
+        self.brokers: Dict[int, Broker] = {}
+        self._servers: Dict[int, tuple] = {}
+
+    @property
+    def urls(self) -> List[str]:
+        return [f"http://localhost:{p}" for p in self.ports]
+
+    def broker_config(self, port: int) -> BrokerConfig:
+        return BrokerConfig(port=port, cluster_ports=self.ports, num_partitions=self.num_partitions,
+                            replication_factor=self.replication_factor,
+                            data_dir=os.path.join(self.data_dir, f"broker_{port}"), **self.config)
+
+    def _create_broker(self, port: int) -> Broker:
+        broker = Broker(self.broker_config(port), self.transport)
+        self.brokers[port] = broker
+        return broker
+
+    def _serve(self, broker: Broker):
+        import uvicorn  # only needed for transport="http"
+        server = uvicorn.Server(uvicorn.Config(create_app(broker), host="127.0.0.1", port=broker.port,
+                                               log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True, name=f"uvicorn-{broker.port}")
+        thread.start()
+        self._servers[broker.port] = (server, thread)
+
+    def wait_ready(self, port: int, timeout: float = 10.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self.transport.get(f"http://localhost:{port}", "/health", timeout=0.5)
+                return True
+            except TransportError:
+                time.sleep(0.02)
+        return False
+
+    def start_broker(self, port: int, timeout: float = 10.0) -> Broker:
+        """Open the broker's logs and start it. Over HTTP the app's startup starts the broker."""
+        broker = self._create_broker(port)
+        if self.http:
+            self._serve(broker)
+            if not self.wait_ready(port, timeout):
+                raise RuntimeError(f"broker {port} did not become ready within {timeout}s")
+        else:
+            # peers reach the broker only once start() has caught up on the cluster state
+            broker.start()
+            self.transport.register(broker)
+        return broker
+
+    def start(self, timeout: float = 10.0):
+        # every broker exists before any of them starts looking for its peers
+        if self.http:
+            for port in self.ports:
+                self.start_broker(port, timeout)
+            return self
+        for port in self.ports:
+            self.transport.register(self._create_broker(port))
+        for port in self.ports:
+            self.brokers[port].start()
+        return self
+
+    def stop_broker(self, port: int):
+        """Take the broker down like a killed process: peers can no longer reach it."""
+        broker = self.brokers.pop(port, None)
+        if broker is None:
+            return
+        if self.http:
+            server, thread = self._servers.pop(port)
+            server.should_exit = True
+            thread.join(10.0)
+        else:
+            self.transport.unregister(broker.base_url)
+            broker.stop()
+
+    def restart_broker(self, port: int) -> Broker:
+        """Stop the broker and start a new one on the same logs."""
+        self.stop_broker(port)
+        return self.start_broker(port)
+
+    def stop(self):
+        for port in list(self.brokers):
+            self.stop_broker(port)
+
+    def broker(self, url: str) -> Broker:
+        return self.brokers[int(url.rsplit(":", 1)[-1])]
+
+    def leader(self, partition: int) -> str:
+        for broker in self.brokers.values():
+            return broker.cluster.leaders[partition]
+        raise RuntimeError("No brokers running")
+
+    def wait_in_sync(self, partition: int, timeout: float = 10.0) -> bool:
+        """Wait until every replica of the partition is in the ISR, as seen by its leader."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            leader = self.brokers.get(int(self.leader(partition).rsplit(":", 1)[-1]))
+            if leader is not None:
+                if set(leader.cluster.replicas[partition]) <= leader.isr_view.get(partition, set()):
+                    return True
+            time.sleep(0.02)
+        return False
+
+    # --- client calls, through the cluster's transport like a remote client ---
+
+    def publish(self, partition: int, messages: List[Dict], client_id: Optional[str] = None) -> Dict:
+        """Publish a batch to the partition's leader (following one redirect)."""
+        body = {"partition": partition, "messages": messages}
+        if client_id is not None:
+            body["client_id"] = client_id
+        url = self.leader(partition)
+        resp = self.transport.post(url, "/publish", body, timeout=5.0)
+        if resp.get("status") == "redirect":
+            resp = self.transport.post(resp["leader"], "/publish", body, timeout=5.0)
+        return resp
+
+    def consume(self, partition: int, offset: int = 0, url: Optional[str] = None, **params) -> Dict:
+        """Read from `url`, or from the partition's leader."""
+        params = dict(params, partition=partition, offset=offset)
+        return self.transport.get(url or self.leader(partition), "/consume", params=params, timeout=5.0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
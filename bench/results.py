@@ -0,0 +1,79 @@
+"""
+Storing benchmark results and comparing them against a baseline.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+from bench.cluster import REPO_ROOT
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench_results")
+RUNS_DIR = os.path.join(RESULTS_DIR, "runs")
+BASELINE_DIR = os.path.join(RESULTS_DIR, "baseline")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                             text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save_result(result: Dict, out_dir: str = RUNS_DIR) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    result = dict(result)
+    result.setdefault("git_commit", _git_commit())
+    result.setdefault("host", {"python": platform.python_version(), "machine": platform.machine(),
+                               "system": platform.system(), "cpus": os.cpu_count()})
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(result.get("started_at", time.time())))
+    path = os.path.join(out_dir, f"{result['scenario']}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def save_baseline(result: Dict, baseline_dir: str = BASELINE_DIR) -> str:
+    os.makedirs(baseline_dir, exist_ok=True)
+    path = os.path.join(baseline_dir, f"{result['scenario']}.json")
+    result = dict(result)
+    result.setdefault("git_commit", _git_commit())
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def load_result(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def baseline_path(scenario: str, baseline_dir: str = BASELINE_DIR) -> str:
+    return os.path.join(baseline_dir, f"{scenario}.json")
+
+
+def compare(current: Dict, baseline: Dict, throughput_tolerance: float = 0.10,
+            p99_tolerance: float = 0.20) -> List[Dict]:
+    """
+    One row per metric present in both results. A row is a regression when a
+    `*_rps` metric dropped by more than throughput_tolerance, or a p99/p99.9
+    `*_ms` metric grew by more than p99_tolerance (relative to the baseline).
+    """
+    rows = []
+    cur, base = current.get("metrics", {}), baseline.get("metrics", {})
+    for key in sorted(set(cur) & set(base)):
+        c, b = cur[key], base[key]
+        if not isinstance(c, (int, float)) or not isinstance(b, (int, float)):
+            continue
+        change = (c - b) / b if b else 0.0
+        regression = False
+        if key.endswith("_rps"):
+            regression = change < -throughput_tolerance
+        elif key.endswith("_ms") and ("p99" in key):
+            regression = change > p99_tolerance
+        rows.append({"metric": key, "baseline": b, "current": c, "change": change, "regression": regression})
+    return rows
@@ -0,0 +1,245 @@
+"""
+Named benchmark scenarios. Each takes a params dict (defaults merged in by
+run_scenario) and returns {"metrics": {...}, "intervals": [...], ...}.
+
+Metric naming is what bench.results.compare keys off: `*_rps` is higher-is-
+better throughput, `*_ms` is latency.
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+import requests
+
+from bench.cluster import LocalCluster
+from bench.embedded import EmbeddedCluster
+from broker.transport import TransportError
+from utils.fault_injector import FaultInjector
+from utils.load_generator import HttpLoadGenerator, KeyPayloadSource
+from utils.metrics import Metrics
+
+SCENARIOS: Dict[str, Dict] = {}
+
+
+def scenario(name: str, description: str, **defaults):
+    def register(fn: Callable[[Dict], Dict]):
+        SCENARIOS[name] = {"fn": fn, "description": description, "defaults": defaults}
+        return fn
+    return register
+
+
+def _ms(x):
+    return None if x is None else round(x * 1000, 3)
+
+
+def _latency_metrics(prefix: str, section: Dict) -> Dict:
+    lat = section["latency"]
+    return {
+        f"{prefix}_rps": round(section["throughput"], 2),
+        f"{prefix}_errors": section["errors"],
+        f"{prefix}_p50_ms": _ms(lat["p50"]),
+        f"{prefix}_p99_ms": _ms(lat["p99"]),
+        f"{prefix}_p999_ms": _ms(lat["p999"]),
+        f"{prefix}_max_ms": _ms(lat["max"]),
+    }
+
+
+def _generator(cluster: LocalCluster, params: Dict) -> HttpLoadGenerator:
+    return HttpLoadGenerator(None, 0, params["rps"], workers=params["workers"],
+                             batch_size=params["batch_size"], bootstrap=cluster.urls,
+                             seed=params["seed"],
+                             source=KeyPayloadSource(num_keys=params["num_keys"],
+                                                     payload_size=params["payload_size"]))
+
+
+def _publish(params: Dict, fault: Callable[[LocalCluster, FaultInjector], None] = None) -> Dict:
+    ports = [params["base_port"] + i for i in range(params["brokers"])]
+    # admin endpoints on, for the faults set through /admin/faults
+    with LocalCluster(ports, num_partitions=1, replication_factor=params["replication_factor"],
+                      env={"BROKER_ADMIN": "1"}) as cluster:
+        injector = FaultInjector(ports, cluster=cluster)
+        lg = _generator(cluster, params)
+        lg.metrics.start_intervals(params["interval_sec"])
+        fault_thread = None
+        if fault is not None:
+            fault_thread = threading.Thread(target=fault, args=(cluster, injector), daemon=True)
+            fault_thread.start()
+        run = lg.run_for(params["duration"])
+        lg.metrics.stop_intervals()
+        lg.metrics.snapshot_interval()
+        if fault_thread is not None:
+            fault_thread.join(timeout=params["duration"])
+    # publish_* latencies are measured from the intended send time; service_* from the actual one
+    metrics = _latency_metrics("publish", lg.metrics.summary()["publish"])
+    service = lg.service_metrics.summary()["publish"]["latency"]
+    metrics["publish_service_p50_ms"] = _ms(service["p50"])
+    metrics["publish_service_p99_ms"] = _ms(service["p99"])
+    metrics["publish_rps"] = round(run["achieved_rps"], 2)
+    metrics["publish_offered"] = run["offered"]
+    # t_rel puts each fault on the same clock as the intervals' t_start / t_end
+    for event in injector.events:
+        event["t_rel"] = round(event["t"] - lg.metrics.t0, 3)
+    return {"metrics": metrics, "intervals": lg.metrics.intervals, "faults": injector.events}
+
+
+_PUBLISH_DEFAULTS = dict(duration=20.0, rps=500.0, workers=8, batch_size=1, num_keys=1000,
+                         payload_size=64, brokers=3, base_port=8100, interval_sec=1.0, seed=42)
+
+
+@scenario("single_partition_publish", "Open-loop publish to one partition, replication factor 3",
+          replication_factor=3, **_PUBLISH_DEFAULTS)
+def single_partition_publish(params: Dict) -> Dict:
+    return _publish(params)
+
+
+@scenario("replication_rf1", "single_partition_publish with replication factor 1",
+          replication_factor=1, **_PUBLISH_DEFAULTS)
+def replication_rf1(params: Dict) -> Dict:
+    return _publish(params)
+
+
+@scenario("replication_rf3", "single_partition_publish with replication factor 3",
+          replication_factor=3, **_PUBLISH_DEFAULTS)
+def replication_rf3(params: Dict) -> Dict:
+    return _publish(params)
+
+
+@scenario("leader_kill", "Publish while the partition leader is killed mid-run and restarted",
+          replication_factor=3, kill_at=5.0, downtime=3.0, **dict(_PUBLISH_DEFAULTS, duration=20.0))
+def leader_kill(params: Dict) -> Dict:
+    def fault(cluster: LocalCluster, injector: FaultInjector):
+        time.sleep(params["kill_at"])
+        port = int(cluster.leader(0).rsplit(":", 1)[-1])
+        injector.kill_and_restart(port, downtime=params["downtime"])
+
+    return _publish(params, fault)
+
+
+def _follower_port(cluster: LocalCluster) -> int:
+    leader = cluster.leader(0)
+    return next(p for p in cluster.ports if f"http://localhost:{p}" != leader)
+
+
+@scenario("follower_pause", "Publish while a follower is frozen with SIGSTOP, then resumed",
+          replication_factor=3, fault_at=5.0, fault_sec=3.0, **_PUBLISH_DEFAULTS)
+def follower_pause(params: Dict) -> Dict:
+    def fault(cluster: LocalCluster, injector: FaultInjector):
+        time.sleep(params["fault_at"])
+        injector.pause_broker(_follower_port(cluster), duration=params["fault_sec"])
+
+    return _publish(params, fault)
+
+
+@scenario("follower_slow_disk", "Publish while every log append on a follower takes delay_ms longer",
+          replication_factor=3, fault_at=5.0, fault_sec=5.0, delay_ms=50.0, **_PUBLISH_DEFAULTS)
+def follower_slow_disk(params: Dict) -> Dict:
+    def fault(cluster: LocalCluster, injector: FaultInjector):
+        time.sleep(params["fault_at"])
+        injector.slow_disk(_follower_port(cluster), params["delay_ms"], duration=params["fault_sec"])
+
+    return _publish(params, fault)
+
+
+@scenario("fanout_consume", "Concurrent consumers re-reading one preloaded partition",
+          preload=20000, consumers=4, duration=10.0, brokers=1, base_port=8100,
+          replication_factor=1, payload_size=64, seed=42, num_keys=1000)
+def fanout_consume(params: Dict) -> Dict:
+    ports = [params["base_port"] + i for i in range(params["brokers"])]
+    metrics = Metrics()
+    with LocalCluster(ports, num_partitions=1, replication_factor=params["replication_factor"]) as cluster:
+        lg = HttpLoadGenerator(None, 0, bootstrap=cluster.urls, seed=params["seed"],
+                               source=KeyPayloadSource(num_keys=params["num_keys"],
+                                                       payload_size=params["payload_size"]))
+        remaining = params["preload"]
+        while remaining > 0:
+            n = min(500, remaining)
+            if lg.send_batch(n) < 0:
+                raise RuntimeError("preload publish failed")
+            remaining -= n
+        leader = cluster.leader(0)
+        stop_evt = threading.Event()
+        records = [0] * params["consumers"]
+
+        def consumer(i: int):
+            session = requests.Session()
+            offset = 0
+            while not stop_evt.is_set():
+                t0 = time.time()
+                try:
+                    r = session.get(f"{leader}/consume", params={"partition": 0, "offset": offset}, timeout=5.0)
+                    r.raise_for_status()
+                    data = r.json()
+                except requests.exceptions.RequestException:
+                    metrics.record_consume(-1.0)
+                    continue
+                metrics.record_consume(time.time() - t0)
+                records[i] += len(data.get("messages", []))
+                offset = data.get("next_offset", 0)
+                if offset >= params["preload"]:
+                    offset = 0  # wrap around and read the partition again
+
+        metrics.start_intervals(1.0)
+        t_start = time.time()
+        threads = [threading.Thread(target=consumer, args=(i,), daemon=True) for i in range(params["consumers"])]
+        for t in threads:
+            t.start()
+        time.sleep(params["duration"])
+        stop_evt.set()
+        for t in threads:
+            t.join(timeout=10.0)
+        elapsed = time.time() - t_start
+        metrics.stop_intervals()
+    out = _latency_metrics("fetch", metrics.summary()["consume"])
+    out["consume_records_rps"] = round(sum(records) / elapsed, 2)
+    return {"metrics": out, "intervals": metrics.intervals}
+
+
+@scenario("embedded_publish", "Closed-loop publish to an in-process cluster over the in-memory transport",
+          replication_factor=3, brokers=3, duration=10.0, workers=4, batch_size=1, num_keys=1000,
+          payload_size=64, seed=42)
+def embedded_publish(params: Dict) -> Dict:
+    """Broker-side cost of a publish (append, replicate, HWM) without HTTP or process hops."""
+    metrics = Metrics()
+    source = KeyPayloadSource(num_keys=params["num_keys"], payload_size=params["payload_size"])
+    with EmbeddedCluster(range(8000, 8000 + params["brokers"]), num_partitions=1,
+                         replication_factor=params["replication_factor"]) as cluster:
+        cluster.wait_in_sync(0)
+        stop_evt = threading.Event()
+
+        def producer(i: int):
+            rnd = random.Random(params["seed"] + i)
+            while not stop_evt.is_set():
+                batch = [{"key": source.key(rnd), "value": source.value(rnd), "client_ts": time.time()}
+                         for _ in range(params["batch_size"])]
+                t0 = time.perf_counter()
+                try:
+                    cluster.publish(0, batch)
+                except TransportError:
+                    metrics.record_pub(-1.0)
+                    continue
+                metrics.record_pub(time.perf_counter() - t0)
+
+        metrics.start_intervals(1.0)
+        threads = [threading.Thread(target=producer, args=(i,), daemon=True) for i in range(params["workers"])]
+        for t in threads:
+            t.start()
+        time.sleep(params["duration"])
+        stop_evt.set()
+        for t in threads:
+            t.join(timeout=10.0)
+        metrics.stop_intervals()
+    out = _latency_metrics("publish", metrics.summary()["publish"])
+    out["publish_records_rps"] = round(out["publish_rps"] * params["batch_size"], 2)
+    return {"metrics": out, "intervals": metrics.intervals}
+
+
+def run_scenario(name: str, overrides: Dict = None) -> Dict:
+    spec = SCENARIOS[name]
+    params = dict(spec["defaults"])
+    params.update({k: v for k, v in (overrides or {}).items() if k in params and v is not None})
+    started = time.time()
+    result = spec["fn"](params)
+    result.update({"scenario": name, "params": params, "started_at": started,
+                   "wall_sec": round(time.time() - started, 3)})
+    return result
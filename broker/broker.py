@@ -2,236 +2,1314 @@
 # Author: Jeevan Reji (modified)
 # Date: 2025-08-28
 # -------------------------
+"""
+One broker is a Broker object built from a BrokerConfig; create_app puts the
+FastAPI routes in front of it. `python -m broker.run_broker` serves a broker
+configured from the environment (BrokerConfig.from_env). Nothing happens at
+import time, so any number of brokers can live in one process, talking to
+each other over HTTP or, with an InMemoryTransport, by direct calls (see
+bench/embedded.py).
+"""
 from fastapi import FastAPI, HTTPException, Request
-import json, os, time, hashlib, asyncio
-from typing import Dict, List
-import requests
-from threading import Lock, Thread
+from fastapi.responses import JSONResponse, PlainTextResponse
+import json, math, os, time, asyncio
+from dataclasses import dataclass, field, fields
+from typing import Dict, List, Optional, Tuple
+from threading import Condition, Event, Lock, Thread
+from broker.telemetry import NULL_TIMER, Registry, StageTimer
+from broker.profiler import SlowRequestLog, StackSampler
+from broker.log import PartitionLog, record_time
+from broker.tiered import DirectoryObjectStore, TieredStorage
+from broker.quotas import QuotaManager, TokenBucket
+from broker.cluster import ClusterState
+from broker.faults import FaultState
+from broker.producers import ProducerState
+from broker.placement import (TrafficMeter, broker_load, leader_elections, leader_imbalance,
+                              partition_weights, place_partition, preferred_order, replica_moves)
+from broker.transport import HttpTransport, TransportError
 
-app = FastAPI()
 
-NUM_PARTITIONS = int(os.environ.get("NUM_PARTITIONS", 4))
+@dataclass
+class BrokerConfig:
+    """Broker settings. from_env reads each one from the upper-cased field name
+    (or the `env` name given below), with the same defaults."""
+    port: int = field(metadata={"env": "BROKER_PORT"})
+    cluster_ports: List[int] = field(default_factory=lambda: [8000, 8001, 8002, 8003],
+                                     metadata={"env": "BROKER_CLUSTER"})
+    host: str = field(default="localhost", metadata={"env": "BROKER_HOST"})
+    # partition logs, cluster state and the slow request log; logs_<port> by default
+    data_dir: Optional[str] = field(default=None, metadata={"env": "BROKER_DATA_DIR"})
+    num_partitions: int = 4
+    replication_factor: int = 3
+    log_segment_bytes: int = 8 * 1024 * 1024
+    time_index_interval_bytes: int = 4096
+    # keep the latest key_index_depth offsets per record key for /lookup
+    key_index: bool = False
+    key_index_depth: int = 10
+    # move closed segments to a directory-backed object store
+    tiered_storage_dir: Optional[str] = None
+    tier_retain_segments: int = 1
+    tier_cache_bytes: int = 64 * 1024 * 1024
+    tier_interval_sec: float = 30.0
+    # per-client quotas (0 = unlimited); clients identify themselves with X-Client-Id
+    quota_produce_bytes_per_sec: float = 0.0
+    quota_consume_bytes_per_sec: float = 0.0
+    quota_requests_per_sec: float = 0.0
+    quota_burst_sec: float = 1.0
+    quota_reject_after_ms: float = 1000.0
+    # upper bounds for one /consume response (clients page with next_offset)
+    consume_max_records: int = 10000
+    consume_max_bytes: int = 8 * 1024 * 1024
+    producer_dedup_window: int = 5
+    # producers tracked per partition for deduplication (least recently seen are dropped)
+    producer_state_max: int = 1000
+    replica_fetch_bytes_per_sec: float = 1024 * 1024
+    replica_fetch_max_bytes: int = 256 * 1024
+    # how long a follower holds a push that arrived ahead of an earlier one (concurrent
+    # publishes) before answering "behind"; below the leader's 1 s push timeout
+    replica_reorder_wait_sec: float = 0.5
+    cluster_sync_sec: float = 5.0
+    rebalance_interval_sec: float = 10.0
+    failover_after_sec: float = 6.0
+    auto_leader_rebalance: bool = True
+    leader_imbalance_ratio: float = 0.5
+    # /admin/* is only served with admin enabled
+    admin: bool = field(default=False, metadata={"env": "BROKER_ADMIN"})
+    slow_request_ms: float = 500.0
 
+    @classmethod
+    def from_env(cls, env=None) -> "BrokerConfig":
+        env = os.environ if env is None else env
+        if "BROKER_PORT" not in env:
+            raise RuntimeError("BROKER_PORT env var must be set (e.g., BROKER_PORT=8000)")
+        values = {}
+        for f in fields(cls):
+            name = f.metadata.get("env", f.name.upper())
+            raw = env.get(name)
+            if raw is None:
+                continue
+            if f.name == "cluster_ports":
+                values[f.name] = [int(p) for p in raw.split(",") if p.strip() != ""]
+            elif f.type is bool:
+                values[f.name] = raw.lower() in ("1", "true", "yes")
+            elif f.type in (int, float):
+                values[f.name] = f.type(raw)
+            else:
+                values[f.name] = raw
+        return cls(**values)
 
-try:
-    PORT = int(os.environ["BROKER_PORT"])
-except KeyError:
-    raise RuntimeError("BROKER_PORT env var must be set (e.g., BROKER_PORT=8000)")
-BASE_URL = f"http://localhost:{PORT}"
+    def url_of(self, port: int) -> str:
+        return f"http://{self.host}:{port}"
 
+    @property
+    def base_url(self) -> str:
+        return self.url_of(self.port)
 
-CLUSTER_PORTS = [int(p) for p in os.environ.get("BROKER_CLUSTER", "8000,8001,8002,8003").split(",") if p.strip()!='']
-CLUSTER_URLS = [f"http://localhost:{p}" for p in CLUSTER_PORTS]
+    @property
+    def cluster_urls(self) -> List[str]:
+        return [self.url_of(p) for p in self.cluster_ports]
 
-HERE = os.path.dirname(__file__)
-LOG_DIR = f"logs_{PORT}"
-os.makedirs(LOG_DIR, exist_ok=True)
+    @property
+    def log_dir(self) -> str:
+        return self.data_dir or f"logs_{self.port}"
 
-# -------------------------
-# In-memory state for partitions and offsets (durable to files)
-# -------------------------
-partitions: List[List[Dict]] = [[] for _ in range(NUM_PARTITIONS)]
-locks: List[Lock] = [Lock() for _ in range(NUM_PARTITIONS)]
-consumer_offsets: Dict[str, Dict[int, int]] = {}
 
-# raftos-backed replicated stores 
-raft_available = False
-leaders_store = None
-partitions_store = None
+class Throttled(HTTPException):
+    """A request refused by a quota; create_app renders it as a 429 with throttle_time_ms."""
+
+    def __init__(self, kind: str, throttle_ms: float):
+        super().__init__(status_code=429, detail=f"{kind} quota exceeded",
+                         headers={"Retry-After": str(max(1, math.ceil(throttle_ms / 1000.0)))})
+        self.throttle_ms = throttle_ms
+
+
+class Broker:
+    """
+    The partition logs, cluster state and replication of one broker. Creating
+    it opens (or creates) the logs under config.log_dir; start() runs the
+    background loops (cluster state sync, replica catch-up, controller duties,
+    tiering) until stop(). Peers are reached through `transport`.
+    """
+
+    def __init__(self, config: BrokerConfig, transport=None):
+        self.config = config
+        self.port = config.port
+        self.base_url = config.base_url
+        self.log_dir = config.log_dir
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.transport = transport if transport is not None else HttpTransport()
+
+        # -------------------------
+        # In-memory state for partitions and offsets (durable to files)
+        # -------------------------
+        self.quotas = QuotaManager(
+            produce_bytes_per_sec=config.quota_produce_bytes_per_sec,
+            consume_bytes_per_sec=config.quota_consume_bytes_per_sec,
+            requests_per_sec=config.quota_requests_per_sec,
+            burst_sec=config.quota_burst_sec,
+            reject_after_ms=config.quota_reject_after_ms,
+        )
+        self.tiered: Optional[TieredStorage] = None
+        if config.tiered_storage_dir:
+            self.tiered = TieredStorage(DirectoryObjectStore(config.tiered_storage_dir), f"broker_{self.port}",
+                                        config.tier_cache_bytes, config.tier_retain_segments)
+
+        # grown by _ensure_partitions when the partition count is raised
+        self.partitions: List[PartitionLog] = []
+        self.locks: List[Lock] = []
+        # notified (under locks[pid]) whenever the log of pid grows
+        self._appended: List[Condition] = []
+        self._partitions_lock = Lock()
+        self.consumer_offsets: Dict[str, Dict[int, int]] = {}
+
+        # Idempotent producer state per partition (see broker/producers.py): the
+        # sequences seen per producer, and the offsets of its last producer_dedup_window
+        # records so a retried publish can be answered with the offset of the original
+        # append. The producer_id and seq travel inside each record, so this state is
+        # rebuilt from the log itself on startup and followers maintain it through /replicate.
+        self.producer_state: List[ProducerState] = []
+
+        # Replication: leaders push new records to the followers in their in-sync
+        # replica set (ISR) with the offset they start at; a follower that is not in
+        # sync (restarted, newly assigned by a reassignment) pulls from the leader via
+        # /replica_fetch at up to replica_fetch_bytes_per_sec until it has caught up.
+        # leader's current view of each partition's ISR (authoritative while it leads)
+        self.isr_view: Dict[int, set] = {}
+        # High-water mark: records below it are on every in-sync replica, and only those
+        # are served by /consume, on the leader and on followers alike. The leader
+        # advances it from the log ends its followers report (push responses,
+        # /replica_fetch, /high_watermark) and passes it on with every push. It is
+        # checkpointed every sync interval and on stop(); records on disk without a
+        # checkpoint count as committed. A follower starting to follow a leader first
+        # truncates its log to the HWM, since a former leader may hold records that were
+        # never replicated, and later pushes cut off any tail that differs from the leader.
+        self.high_watermark: List[int] = []
+        self.replica_ends: Dict[int, Dict[str, int]] = {}  # leader: follower -> its log end offset
+        self._hwm_reported: Dict[int, Tuple[str, int]] = {}  # follower: (leader, end offset) last reported
+        self._following: Dict[int, str] = {}  # follower: the leader it last fetched from
+        self._hwm_path = os.path.join(self.log_dir, "hwm_checkpoint.json")
+        self._hwm_checkpoint = self._load_hwm_checkpoint()
+
+        self._init_telemetry()
+
+        # Diagnostics: /admin/* is only served with config.admin
+        self.slow_requests = SlowRequestLog(os.path.join(self.log_dir, f"slow_requests_{self.port}.jsonl"),
+                                            config.slow_request_ms / 1000.0)
+        # set through /admin/faults by utils/fault_injector.py
+        self.faults = FaultState()
+
+        # Partition count, replicas, leaders and ISR (see broker/cluster.py). The
+        # persisted state wins over num_partitions / cluster_urls after the first start.
+        # New partitions go to the least loaded brokers (see broker/placement.py).
+        # Controller duties: fail over leaders of brokers unreachable for failover_after_sec
+        # and, with auto_leader_rebalance, move leadership back to in-sync preferred
+        # replicas, reordering preferences first when leader load (weighted by traffic)
+        # is off by more than leader_imbalance_ratio of the mean.
+        self.cluster_traffic: Dict[int, float] = {}  # client bytes/sec per partition, as last seen by the controller
+        self.cluster = ClusterState(os.path.join(self.log_dir, "cluster_state.json"), config.cluster_urls,
+                                    config.num_partitions,
+                                    lambda pid, members, current: place_partition(
+                                        pid, members, config.replication_factor, current,
+                                        partition_weights(current, self.cluster_traffic)))
+        self.traffic_meter = TrafficMeter()
+        self._down_since: Dict[str, float] = {}
+        self._controller_cache = {"url": None, "at": 0.0}
 
-async def setup_raft():
-    global raft_available, leaders_store, partitions_store
-    try:
-        import raftos
-    except Exception:
-        print("[broker] raftos not available; running without raft-backed metadata replication")
-        raft_available = False
-        return
+        self._stopped = Event()
+        self._threads: List[Thread] = []
+        self._routes = self._route_table()
 
-    raft_available = True
-    try:
-        raftos.configure({'log_path': f'./raft_logs_{PORT}'})
-    except Exception as e:
-        print(f"[broker:{PORT}] raftos.configure() warning: {e}")
+        self._ensure_partitions(self.cluster.num_partitions)
+        self._on_state_change()
 
- 
-    cluster_nodes = [f"127.0.0.1:{p}" for p in CLUSTER_PORTS if p != PORT]
+    # -------------------------
+    # Telemetry (served by /metrics)
+    # -------------------------
 
+    def _init_telemetry(self):
+        t = self.telemetry = Registry()
+        self.messages_in = t.counter("pubg1_messages_in_total", "Records appended to the local log", ["partition", "source"])
+        self.bytes_in = t.counter("pubg1_bytes_in_total", "Serialized bytes appended to the local log", ["partition", "source"])
+        self.duplicates_in = t.counter("pubg1_duplicates_total", "Records dropped as producer retries", ["partition"])
+        self.messages_out = t.counter("pubg1_messages_out_total", "Records returned by /consume", ["partition"])
+        self.bytes_out = t.counter("pubg1_bytes_out_total", "Serialized bytes returned by /consume", ["partition"])
+        self.throttled_requests = t.counter("pubg1_throttled_requests_total", "Requests refused with 429 by a quota", ["kind"])
+        self.throttle_time = t.counter("pubg1_throttle_time_ms_total", "Throttle time handed out to clients", ["kind"])
+        self.replicate_errors = t.counter("pubg1_replicate_errors_total", "Failed replicate calls to a follower", ["follower"])
+        self.publish_stages = t.histogram("pubg1_publish_stage_seconds", "Time spent in each stage of /publish", ["stage"])
+        self.replicate_calls = t.histogram("pubg1_replicate_call_seconds", "Leader-side duration of one replicate call", ["follower"])
+        self.replicate_stages = t.histogram("pubg1_replicate_stage_seconds", "Time spent in each stage of /replicate", ["stage"])
+        self.consume_stages = t.histogram("pubg1_consume_stage_seconds", "Time spent in each stage of /consume", ["stage"])
+        parts = self.partitions
+        t.gauge("pubg1_log_end_offset", "Next offset to be written", ["partition"],
+                lambda: [((pid,), len(parts[pid])) for pid in range(len(parts))])
+        t.gauge("pubg1_high_watermark", "Offset below which records are on all in-sync replicas", ["partition"],
+                lambda: [((pid,), self.high_watermark[pid]) for pid in range(len(parts))])
+        t.gauge("pubg1_consumer_lag", "Log end offset minus committed offset", ["group", "partition"], self._consumer_lag)
+        t.gauge("pubg1_under_replicated", "Partitions led here whose ISR is smaller than the replica set", [],
+                lambda: [((), sum(1 for pid, isr in list(self.isr_view.items())
+                                  if self.cluster.leaders.get(pid) == self.base_url
+                                  and len(isr) < len(self.cluster.replicas.get(pid, []))))])
+        t.gauge("pubg1_remote_segments", "Segments offloaded to the remote tier", ["partition"],
+                lambda: [((pid,), sum(1 for seg in parts[pid].segments if seg.remote)) for pid in range(len(parts))])
+        tiered = self.tiered
+        t.gauge("pubg1_remote_cache", "Remote segment read cache (bytes held, hits, misses, evictions)", ["stat"],
+                lambda: [] if tiered is None else [(("bytes",), tiered.cache.bytes), (("hits",), tiered.cache.hits),
+                                                   (("misses",), tiered.cache.misses),
+                                                   (("evictions",), tiered.cache.evictions)])
 
-    try:
-        await raftos.register(f"127.0.0.1:{PORT}", cluster=cluster_nodes)
-    except Exception as e:
+    def _consumer_lag(self):
+        for group, offs in list(self.consumer_offsets.items()):
+            for pid, off in list(offs.items()):
+                if 0 <= pid < len(self.partitions):
+                    yield (group, pid), max(0, len(self.partitions[pid]) - off)
 
-        print(f"[broker:{PORT}] raftos.register() raised: {e}")
+    def _throttled(self, kind: str, throttle_ms: float) -> Throttled:
+        self.throttled_requests.inc(1, kind)
+        return Throttled(kind, throttle_ms)
 
+    def _charge(self, client_id: str, kind: str, nbytes: int) -> float:
+        throttle_ms = self.quotas.record(client_id, kind, nbytes)
+        if throttle_ms > 0:
+            self.throttle_time.inc(throttle_ms, kind)
+        return round(throttle_ms, 1)
 
-    try:
-        leaders_store = raftos.ReplicatedDict('leaders')
-        partitions_store = raftos.ReplicatedDict('partitions')
-    except Exception as e:
+    # -------------------------
+    # Lifecycle
+    # -------------------------
 
-        print(f"[broker:{PORT}] Could not create ReplicatedDicts: {e}")
-        raft_available = False
-        leaders_store = None
-        partitions_store = None
-        return
+    def start(self) -> "Broker":
+        """Catch up on the cluster state held by the peers, then start the background loops."""
+        self._stopped.clear()
+        self._pull_latest_state()
+        self._expand_partitions()
+        loops = [self._cluster_sync_loop, self._replica_fetcher_loop, self._controller_loop]
+        if self.tiered is not None:
+            loops.append(self._tiering_loop)
+        self._threads = [Thread(target=fn, daemon=True, name=f"broker-{self.port}-{fn.__name__.strip('_')}")
+                         for fn in loops]
+        for t in self._threads:
+            t.start()
+        return self
 
+    def stop(self, timeout: float = 5.0):
+        """Stop the background loops and wait for them, so the logs can be reopened."""
+        self._stopped.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._save_hwm_checkpoint()
 
-    replication_factor = min(3, max(1, len(CLUSTER_URLS)))
-    for pid in range(NUM_PARTITIONS):
-        start = pid % len(CLUSTER_URLS)
-        replicas = [CLUSTER_URLS[(start + i) % len(CLUSTER_URLS)] for i in range(replication_factor)]
+    def _tiering_loop(self):
+        while not self._stopped.wait(self.config.tier_interval_sec):
+            for pid in range(len(self.partitions)):
+                try:
+                    n = self.tiered.offload(self.partitions[pid], self.locks[pid])
+                    if n:
+                        print(f"[broker:{self.port}] offloaded {n} segment(s) of partition {pid}")
+                except Exception as e:
+                    print(f"[broker:{self.port}] tiering partition {pid} failed: {e}")
+
+    def metadata(self) -> Dict:
+        """Return current metadata describing partitions, leaders and in-sync replicas,
+        from the controller-maintained cluster state."""
+        return self.cluster.metadata()
+
+    def health(self) -> Dict:
+        return {"status": "ok", "port": self.port}
+
+    # -------------------------
+    # Controller and cluster state propagation
+    # -------------------------
+
+    def controller_url(self) -> str:
+        """Lowest-addressed member that answers /health (cached for a couple of seconds).
+        A broker taking over as controller first adopts the newest state its peers hold."""
+        now = time.time()
+        cache = self._controller_cache
+        if cache["url"] and now - cache["at"] < 2.0:
+            return cache["url"]
+        url = self.base_url
+        for member in self.cluster.controller_order():
+            if member == self.base_url:
+                break
+            try:
+                self.transport.get(member, "/health", timeout=0.3)
+                url = member
+                break
+            except TransportError:
+                continue
+        was_controller = cache["url"] == self.base_url
+        cache.update(url=url, at=now)
+        if url == self.base_url and not was_controller:
+            self._pull_latest_state()
+        return url
+
+    def is_controller(self) -> bool:
+        return self.controller_url() == self.base_url
+
+    def _broadcast_state(self):
+        doc = self.cluster.to_dict()
+
+        def push(member: str):
+            try:
+                self.transport.post(member, "/cluster/state", doc, timeout=1.0)
+            except TransportError:
+                pass  # the member pulls the state on its next sync
+
+        for member in self.cluster.members:
+            if member != self.base_url:
+                Thread(target=push, args=(member,), daemon=True).start()
+
+    def _on_state_change(self):
+        cluster = self.cluster
+        self._ensure_partitions(cluster.num_partitions)
+        for pid in range(cluster.num_partitions):
+            if cluster.leaders.get(pid) != self.base_url:
+                self.isr_view.pop(pid, None)
+            elif pid not in self.isr_view:
+                # newly leading: start from the controller's ISR; the HWM waits for the followers' ends
+                self.isr_view[pid] = set(cluster.isr.get(pid, [])) | {self.base_url}
+                self.replica_ends[pid] = {}
+                with self.locks[pid]:
+                    self._advance_hwm(pid)
+            elif self.isr_view[pid] != set(cluster.isr.get(pid, [])):
+                # the leader's view wins; repair a lost or outdated report
+                self._report_isr(pid)
+
+    def receive_state(self, doc: Dict) -> Dict:
+        """State pushed by the controller; adopted if its epoch is newer."""
+        if self.cluster.apply(doc):
+            self._on_state_change()
+        return {"epoch": self.cluster.epoch}
+
+    def _pull_latest_state(self):
+        """Adopt the highest-epoch state held by any reachable member. Run before acting
+        as controller: the persisted state of a restarted broker may be outdated, and
+        members reject a controller's pushes with a lower epoch than their own."""
+        for member in self.cluster.members:
+            if member == self.base_url:
+                continue
+            try:
+                self.receive_state(self.transport.get(member, "/cluster/state", timeout=0.5))
+            except TransportError:
+                continue
 
+    def _controller_apply(self, op: Dict) -> Dict:
+        """Run a cluster state mutation on the controller and push the new state."""
+        cluster = self.cluster
+        kind = op.get("op")
+        if kind == "add_partitions":
+            cluster.add_partitions(int(op["count"]))
+        elif kind == "reassign":
+            cluster.reassign(int(op["partition"]), list(op["replicas"]))
+        elif kind == "isr":
+            cluster.set_isr(int(op["partition"]), list(op["isr"]), op["leader"])
+        elif kind == "rebalance_replicas":
+            weights = partition_weights(cluster.replicas, self.cluster_traffic)
+            moves = replica_moves(cluster.replicas, cluster.members, weights, int(op.get("max_moves", 1)))
+            if op.get("dry_run"):
+                return dict(cluster.to_dict(), planned={str(p): r for p, r in moves.items()})
+            for pid, target in moves.items():
+                cluster.reassign(pid, target)
+        else:
+            raise ValueError(f"unknown cluster operation: {kind}")
+        self._on_state_change()
+        self._broadcast_state()
+        return cluster.to_dict()
+
+    def _submit(self, op: Dict) -> Dict:
+        """Apply op locally when this broker is the controller, otherwise forward it."""
+        if self.is_controller():
+            return self._controller_apply(op)
+        doc = self.transport.post(self.controller_url(), "/cluster/mutate", op, timeout=2.0)
+        if self.cluster.apply(doc):
+            self._on_state_change()
+        return doc
+
+    def cluster_mutate(self, op: Dict) -> Dict:
+        """Controller-side entry point for state changes (forwarded by other brokers)."""
+        try:
+            return self._submit(op)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def submit_admin(self, op: Dict) -> Dict:
         try:
-            await partitions_store.set(str(pid), replicas)
-            await leaders_store.set(str(pid), replicas[0])
-        except Exception as e:
-            print(f"[broker:{PORT}] warning setting replicated dicts: {e}")
+            doc = self._submit(op)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except TransportError as e:
+            raise HTTPException(status_code=503, detail=f"controller unavailable: {e}")
+        if op.get("dry_run"):
+            return {"status": "ok", "planned": doc["planned"]}
+        return {"status": "ok", "epoch": doc["epoch"], "reassignments": doc["reassignments"]}
 
-    print(f"[broker:{PORT}] raftos setup complete (or attempted). Cluster members: {CLUSTER_URLS}")
+    def _report_isr(self, pid: int):
+        """Tell the controller about an ISR change of a partition led here (in the background)."""
+        isr = sorted(self.isr_view.get(pid, ()))
 
+        def send():
+            try:
+                self._submit({"op": "isr", "partition": pid, "isr": isr, "leader": self.base_url})
+            except Exception as e:
+                print(f"[broker:{self.port}] reporting ISR of partition {pid} failed: {e}")
 
-@app.on_event("startup")
-async def _startup_event():
+        Thread(target=send, daemon=True).start()
 
-    await setup_raft()
+    def _expand_partitions(self):
+        """A num_partitions above the cluster's partition count is an expansion: ask the
+        controller for it (as /admin/partitions does), so it is committed and pushed."""
+        if self.config.num_partitions <= self.cluster.num_partitions:
+            return
+        try:
+            self._submit({"op": "add_partitions", "count": self.config.num_partitions})
+        except TransportError as e:
+            print(f"[broker:{self.port}] adding partitions up to {self.config.num_partitions} failed: {e}")
 
-async def get_metadata() -> Dict:
-    """Return current metadata describing partitions and leaders.
-    If raft is available use replicated dicts, otherwise compute deterministically
-    from CLUSTER_URLS.
-    """
-    if raft_available and partitions_store is not None and leaders_store is not None:
+    def _cluster_sync_loop(self):
+        while not self._stopped.wait(self.config.cluster_sync_sec):
+            self._save_hwm_checkpoint()
+            # retried until the controller is reachable
+            self._expand_partitions()
+            try:
+                if self.is_controller():
+                    # another broker may have acted as controller while this one was unreachable
+                    self._pull_latest_state()
+                    continue
+                self.receive_state(self.transport.get(self.controller_url(), "/cluster/state", timeout=1.0))
+            except TransportError:
+                self._controller_cache["url"] = None
+
+    def local_load(self) -> Dict:
+        """This broker's per-partition traffic (bytes/sec, smoothed) and leadership."""
+        totals: Dict[Tuple[int, str], float] = {}
+        for (pid, source), v in self.bytes_in.snapshot().items():
+            kind = "bytes_in" if source == "publish" else "replication_bytes_in"
+            totals[(int(pid), kind)] = totals.get((int(pid), kind), 0.0) + v
+        for (pid,), v in self.bytes_out.snapshot().items():
+            totals[(int(pid), "bytes_out")] = v
+        rates = self.traffic_meter.sample(totals)
         parts = {}
-        leaders = {}
-        for pid in range(NUM_PARTITIONS):
+        for pid in range(len(self.partitions)):
+            p = {k: round(rates.get((pid, k), 0.0), 1) for k in ("bytes_in", "replication_bytes_in", "bytes_out")}
+            p["leader"] = self.cluster.leaders.get(pid) == self.base_url
+            p["end_offset"] = self.partitions[pid].end_offset
+            parts[str(pid)] = p
+        return {"broker": self.base_url, "partitions": parts,
+                "bytes_in_per_sec": round(sum(p["bytes_in"] for p in parts.values()), 1),
+                "bytes_out_per_sec": round(sum(p["bytes_out"] for p in parts.values()), 1),
+                "replication_bytes_in_per_sec": round(sum(p["replication_bytes_in"] for p in parts.values()), 1)}
+
+    def _collect_loads(self) -> Dict[str, Dict]:
+        """Load reports of every reachable member (this one included)."""
+        reports = {self.base_url: self.local_load()}
+        for member in self.cluster.members:
+            if member == self.base_url:
+                continue
             try:
-                p = await partitions_store.get(str(pid))
-            except Exception:
-                p = None
+                reports[member] = self.transport.get(member, "/cluster/load", timeout=0.5)
+            except TransportError:
+                pass
+        return reports
+
+    @staticmethod
+    def _partition_traffic(reports: Dict[str, Dict]) -> Dict[int, float]:
+        """Client bytes/sec per partition, as measured on its leader."""
+        traffic = {}
+        for report in reports.values():
+            for pid, p in report["partitions"].items():
+                if p["leader"]:
+                    traffic[int(pid)] = p["bytes_in"] + p["bytes_out"]
+        return traffic
+
+    def load_summary(self) -> Dict:
+        """Per-broker load across the cluster: partitions held and led, client and
+        replication traffic, and how uneven the preferred leaders are."""
+        cluster = self.cluster
+        reports = self._collect_loads()
+        traffic = self._partition_traffic(reports)
+        summary = broker_load(cluster.replicas, cluster.leaders, cluster.members, traffic)
+        for member, report in reports.items():
+            summary.setdefault(member, {}).update(
+                {k: report[k] for k in ("bytes_in_per_sec", "bytes_out_per_sec", "replication_bytes_in_per_sec")})
+        for member in summary:
+            summary[member]["reachable"] = member in reports
+        weights = partition_weights(cluster.replicas, traffic)
+        return {"controller": self.controller_url(), "brokers": summary,
+                "leader_imbalance": round(leader_imbalance(cluster.replicas, cluster.members, weights), 3),
+                "partitions": {str(p): round(t, 1) for p, t in sorted(traffic.items())}}
+
+    def _controller_loop(self):
+        config = self.config
+        cluster = self.cluster
+        while not self._stopped.wait(config.rebalance_interval_sec):
             try:
-                l = await leaders_store.get(str(pid))
-            except Exception:
-                l = None
-
-            if not p:
-                start = pid % len(CLUSTER_URLS)
-                p = [CLUSTER_URLS[(start + i) % len(CLUSTER_URLS)] for i in range(min(3, len(CLUSTER_URLS)))]
-            if not l:
-                l = p[0]
-            parts[str(pid)] = p
-            leaders[str(pid)] = l
-        return {"partitions": parts, "leaders": leaders, "members": CLUSTER_URLS}
-    else:
-        parts = {}
-        leaders = {}
-        for pid in range(NUM_PARTITIONS):
-            start = pid % len(CLUSTER_URLS)
-            replicas = [CLUSTER_URLS[(start + i) % len(CLUSTER_URLS)] for i in range(min(3, len(CLUSTER_URLS)))]
-            parts[str(pid)] = replicas
-            leaders[str(pid)] = replicas[0]
-        return {"partitions": parts, "leaders": leaders, "members": CLUSTER_URLS}
-
-def part_file(pid: int) -> str:
-    return os.path.join(LOG_DIR, f"partition_{pid}.jsonl")
-
-def append_message(pid: int, msg: Dict) -> int:
-    """Append message to local partition log and persist to file. Return offset."""
-    with locks[pid]:
-        partitions[pid].append(msg)
-        offset = len(partitions[pid]) - 1
-
-        with open(part_file(pid), "a") as f:
-            f.write(json.dumps(msg) + "\n")
-        return offset
-
-def _load_logs_from_disk():
-    for pid in range(NUM_PARTITIONS):
-        fp = part_file(pid)
-        if os.path.exists(fp):
-            with open(fp, "r") as f:
-                lines = [l.strip() for l in f.readlines() if l.strip()]
-            for ln in lines:
+                if not self.is_controller():
+                    self._down_since.clear()
+                    continue
+                reports = self._collect_loads()
+                now = time.time()
+                for member in cluster.members:
+                    if member in reports:
+                        self._down_since.pop(member, None)
+                    else:
+                        self._down_since.setdefault(member, now)
+                dead = {m for m, t in self._down_since.items() if now - t >= config.failover_after_sec}
+                self.cluster_traffic.clear()
+                self.cluster_traffic.update(self._partition_traffic(reports))
+                weights = partition_weights(cluster.replicas, self.cluster_traffic)
+
+                orders = {}
+                replicas = dict(cluster.replicas)
+                if (config.auto_leader_rebalance
+                        and leader_imbalance(replicas, cluster.members, weights) > config.leader_imbalance_ratio):
+                    orders = preferred_order(replicas, weights)
+                    replicas.update(orders)
+                alive = [m for m in cluster.members if m not in dead]
+                elections = leader_elections(replicas, cluster.leaders, cluster.isr, alive, skip=cluster.reassignments)
+                if not config.auto_leader_rebalance:
+                    elections = {pid: l for pid, l in elections.items() if cluster.leaders.get(pid) in dead}
+                if cluster.rebalance(orders, elections):
+                    for pid, leader in elections.items():
+                        print(f"[broker:{self.port}] partition {pid}: leader -> {leader}")
+                    self._on_state_change()
+                    self._broadcast_state()
+            except Exception as e:
+                print(f"[broker:{self.port}] controller loop error: {e}")
+
+    # -------------------------
+    # Replication
+    # -------------------------
+
+    def _advance_hwm(self, pid: int):
+        """Leader: move the HWM up to the smallest log end in the ISR. Caller holds locks[pid]."""
+        ends = [self.partitions[pid].end_offset]
+        for follower in self.isr_view.get(pid, ()):
+            if follower != self.base_url:
+                ends.append(self.replica_ends.get(pid, {}).get(follower))
+        if None not in ends:
+            self.high_watermark[pid] = max(self.high_watermark[pid], min(ends))
+
+    def _follow_hwm(self, pid: int, leader_hwm: int):
+        """Follower: adopt the leader's HWM, up to what this replica has. Caller holds locks[pid]."""
+        self.high_watermark[pid] = max(self.high_watermark[pid], min(int(leader_hwm), self.partitions[pid].end_offset))
+
+    def _sync_hwm(self, pid: int, leader: str):
+        """In-sync follower with nothing pushed to it lately: report its end, fetch the HWM."""
+        with self.locks[pid]:
+            end = self.partitions[pid].end_offset
+            if self.high_watermark[pid] >= end and self._hwm_reported.get(pid) == (leader, end):
+                return
+        try:
+            hwm = self.transport.get(leader, "/high_watermark", timeout=1.0,
+                                     params={"partition": pid, "replica": self.base_url,
+                                             "end_offset": end})["high_watermark"]
+        except (TransportError, KeyError):
+            return
+        self._hwm_reported[pid] = (leader, end)
+        with self.locks[pid]:
+            self._follow_hwm(pid, hwm)
+
+    def _load_hwm_checkpoint(self) -> Dict[int, int]:
+        try:
+            with open(self._hwm_path, "r") as f:
+                return {int(pid): int(hwm) for pid, hwm in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_hwm_checkpoint(self):
+        hwms = {str(pid): hwm for pid, hwm in enumerate(self.high_watermark)}
+        tmp = self._hwm_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(hwms, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._hwm_path)
+        except OSError as e:
+            print(f"[broker:{self.port}] writing the HWM checkpoint failed: {e}")
+
+    def _truncate(self, pid: int, offset: int):
+        """Follower: drop local records from offset on, which the leader does not have.
+        Caller holds locks[pid]."""
+        log = self.partitions[pid]
+        offset = max(offset, log.start_offset)
+        if offset >= log.end_offset:
+            return
+        print(f"[broker:{self.port}] partition {pid}: truncating {log.end_offset - offset} record(s) "
+              f"from offset {offset}")
+        log.truncate(offset)
+        self.producer_state[pid] = ProducerState(self.config.producer_dedup_window, self.config.producer_state_max)
+        for off, msg in enumerate(log.records, log.start_offset):
+            self._record_sequence(pid, msg, off)
+        self.high_watermark[pid] = min(self.high_watermark[pid], log.end_offset)
+
+    def _replica_fetcher_loop(self):
+        """Catch up partitions this broker replicates but is not in sync for, at a throttled rate."""
+        rate = self.config.replica_fetch_bytes_per_sec
+        bucket = TokenBucket(rate, rate) if rate > 0 else None
+        # a single fetch never exceeds one second's worth of the throttle
+        max_bytes = min(self.config.replica_fetch_max_bytes, int(rate)) if bucket else self.config.replica_fetch_max_bytes
+        cluster = self.cluster
+        while not self._stopped.is_set():
+            busy = False
+            for pid in range(cluster.num_partitions):
+                leader = cluster.leaders.get(pid)
+                if (self.base_url not in cluster.replicas.get(pid, []) or leader == self.base_url
+                        or pid >= len(self.partitions)):
+                    self._following.pop(pid, None)
+                    continue
+                if self._following.get(pid) != leader:
+                    # new leader (or just started): records past the HWM may never have
+                    # reached it, so drop them and fetch from there, even if in the ISR
+                    with self.locks[pid]:
+                        self._truncate(pid, self.high_watermark[pid])
+                    self._following[pid] = leader
+                elif self.base_url in cluster.isr.get(pid, []):
+                    self._sync_hwm(pid, leader)
+                    continue
+                if self.faults.drop_replication():
+                    continue
+                with self.locks[pid]:
+                    offset = self.partitions[pid].end_offset
                 try:
-                    partitions[pid].append(json.loads(ln))
-                except Exception:
-                    pass
+                    data = self.transport.get(leader, "/replica_fetch", timeout=2.0,
+                                              params={"partition": pid, "offset": offset, "replica": self.base_url,
+                                                      "max_bytes": max_bytes})
+                except TransportError:
+                    continue
+                if data["messages"]:
+                    start = data["next_offset"] - len(data["messages"])
+                    self.append_replica(pid, start, data["messages"], source="fetch")
+                    busy = True
+                with self.locks[pid]:
+                    if data["end_offset"] < offset == self.partitions[pid].end_offset:
+                        # a tail past the leader's log end was never the leader's
+                        self._truncate(pid, data["end_offset"])
+                    self._follow_hwm(pid, data["high_watermark"])
+                if bucket is not None:
+                    debt = bucket.charge(data["bytes"], time.monotonic())
+                    if debt > 0:
+                        self._stopped.wait(debt)
+            if not busy:
+                self._stopped.wait(0.5)
+
+    # -------------------------
+    # Partition logs
+    # -------------------------
 
+    def part_dir(self, pid: int) -> str:
+        return os.path.join(self.log_dir, f"partition_{pid}")
 
-_load_logs_from_disk()
+    def legacy_part_file(self, pid: int) -> str:
+        """Single-file log written before segmentation; migrated on first start."""
+        return os.path.join(self.log_dir, f"partition_{pid}.jsonl")
 
-@app.get("/metadata")
-async def metadata_endpoint():
-    return await get_metadata()
+    def _find_duplicate(self, pid: int, msg: Dict) -> Tuple[bool, Optional[int]]:
+        """Check msg against the sequences already in the log. Caller must hold locks[pid].
+        Returns (is_duplicate, original_offset); the offset is None when the sequence
+        is older than the dedup window and the original offset is no longer known."""
+        producer_id = msg.get("producer_id")
+        seq = msg.get("seq")
+        if producer_id is None or seq is None:
+            return False, None
+        return self.producer_state[pid].check(producer_id, int(seq))
 
-@app.get("/health")
-async def health():
-    return {"status": "ok", "port": PORT}
+    def _record_sequence(self, pid: int, msg: Dict, offset: int):
+        producer_id = msg.get("producer_id")
+        seq = msg.get("seq")
+        if producer_id is None or seq is None:
+            return
+        self.producer_state[pid].record(producer_id, int(seq), offset)
 
-@app.post("/publish")
-async def publish(request: Request):
- 
-    data = await request.json()
-    partition = int(data.get("partition"))
-    if partition < 0 or partition >= NUM_PARTITIONS:
-        raise HTTPException(status_code=400, detail="invalid partition")
+    def append_messages(self, pid: int, msgs: List[Dict], timer=NULL_TIMER,
+                        source: str = "publish") -> List[Tuple[Optional[int], bool]]:
+        """Append a batch to the local partition log with one lock acquisition and
+        one file write. Return (offset, duplicate) per message. Retries of an already
+        appended (producer_id, seq) are not written again; the offset of the original
+        append is returned instead. Lock wait and file write are recorded on `timer`."""
+        results = []
+        fresh = []
+        lines = []
+        t0 = time.perf_counter()
+        with self.locks[pid]:
+            timer.record("lock_wait", time.perf_counter() - t0)
+            log = self.partitions[pid]
+            for msg in msgs:
+                duplicate, offset = self._find_duplicate(pid, msg)
+                if duplicate:
+                    results.append((offset, True))
+                    continue
+                offset = log.end_offset + len(fresh)
+                fresh.append(msg)
+                lines.append(json.dumps(msg) + "\n")
+                self._record_sequence(pid, msg, offset)
+                results.append((offset, False))
 
-    md = await get_metadata()
-    leader = md["leaders"][str(partition)]
+            if lines:
+                with timer.stage("disk_write"):
+                    self.faults.disk_delay()
+                    log.append(fresh, lines)
+                self._appended[pid].notify_all()
+        if lines:
+            self.messages_in.inc(len(lines), pid, source)
+            self.bytes_in.inc(sum(len(l) for l in lines), pid, source)
+        if len(lines) < len(msgs):
+            self.duplicates_in.inc(len(msgs) - len(lines), pid)
+        return results
 
+    def append_replica(self, pid: int, base_offset: int, msgs: List[Dict], timer=NULL_TIMER,
+                       source: str = "replicate") -> Tuple[bool, int]:
+        """Write records a leader stored at base_offset.. verbatim (no producer dedup, so
+        the logs stay identical). Records this replica already has are skipped if they
+        match the leader's; from the first one that does not, the local log is truncated
+        and replaced. The leader pushes concurrent publishes in parallel, so a push can
+        arrive before an earlier one: it waits up to replica_reorder_wait_sec for the gap
+        to fill. Returns (in_order, end_offset); in_order is False when there is still a
+        gap before base_offset."""
+        t0 = time.perf_counter()
+        with self.locks[pid]:
+            timer.record("lock_wait", time.perf_counter() - t0)
+            log = self.partitions[pid]
+            if base_offset > log.end_offset:
+                self._appended[pid].wait_for(lambda: base_offset <= log.end_offset,
+                                             self.config.replica_reorder_wait_sec)
+            end = log.end_offset
+            if base_offset > end:
+                return False, end
+            for off in range(max(base_offset, log.start_offset), min(end, base_offset + len(msgs))):
+                if log.records[off - log.start_offset] != msgs[off - base_offset]:
+                    self._truncate(pid, off)
+                    end = log.end_offset
+                    break
+            fresh = msgs[end - base_offset:]
+            if fresh:
+                lines = [json.dumps(m) + "\n" for m in fresh]
+                with timer.stage("disk_write"):
+                    self.faults.disk_delay()
+                    log.append(fresh, lines)
+                self._appended[pid].notify_all()
+                for i, m in enumerate(fresh):
+                    self._record_sequence(pid, m, end + i)
+                end = log.end_offset
+        if fresh:
+            self.messages_in.inc(len(fresh), pid, source)
+            self.bytes_in.inc(sum(len(l) for l in lines), pid, source)
+        return True, end
 
-    if leader != BASE_URL:
-        return {"status": "redirect", "leader": leader}
+    def append_message(self, pid: int, msg: Dict, timer=NULL_TIMER,
+                       source: str = "publish") -> Tuple[Optional[int], bool]:
+        """Append message to local partition log and persist to file. Return (offset, duplicate)."""
+        return self.append_messages(pid, [msg], timer, source)[0]
 
+    def _ensure_partitions(self, count: int):
+        """Open (or create) the logs of partitions up to count; existing ones are kept."""
+        config = self.config
+        with self._partitions_lock:
+            for pid in range(len(self.partitions), count):
+                log = PartitionLog(self.part_dir(pid), config.log_segment_bytes, config.time_index_interval_bytes,
+                                   legacy_file=self.legacy_part_file(pid),
+                                   key_index_depth=config.key_index_depth if config.key_index else 0)
+                if self.tiered is not None:
+                    self.tiered.attach(log)
+                self.producer_state.append(ProducerState(config.producer_dedup_window, config.producer_state_max))
+                self.locks.append(Lock())
+                self._appended.append(Condition(self.locks[-1]))
+                self.high_watermark.append(min(self._hwm_checkpoint.get(pid, log.end_offset), log.end_offset))
+                for offset, msg in enumerate(log.records, log.start_offset):
+                    self._record_sequence(pid, msg, offset)
+                # publish the partition last: handlers check len(partitions)
+                self.partitions.append(log)
 
-    offset = append_message(partition, data)
+    def _valid_partition(self, partition: int):
+        if partition < 0 or partition >= len(self.partitions):
+            raise HTTPException(status_code=400, detail="invalid partition")
 
+    # -------------------------
+    # Request handlers (routes in create_app)
+    # -------------------------
 
-    followers = [u for u in md["partitions"][str(partition)] if u != BASE_URL]
-    for follower in followers:
+    def publish(self, data: Dict, client_id: str = "local", nbytes: Optional[int] = None) -> Dict:
+        """Publish one message, or a batch as {"partition": p, "messages": [...]}.
+        With quotas enabled the response carries throttle_time_ms; a client that is
+        still over its quota by more than quota_reject_after_ms gets a 429."""
+        partition = int(data.get("partition"))
+        self._valid_partition(partition)
+        owed = self.quotas.check(client_id, "produce")
+        if self.quotas.should_reject(owed):
+            raise self._throttled("produce", owed)
+
+        timer = StageTimer(self.publish_stages)
+        with timer.stage("metadata"):
+            md = self.metadata()
+        leader = md["leaders"][str(partition)]
+
+        if leader != self.base_url:
+            return {"status": "redirect", "leader": leader}
+
+        batch = data.get("messages")
+        msgs = batch if isinstance(batch, list) else [data]
+        for m in msgs:
+            m.setdefault("partition", partition)
+
+        results = self.append_messages(partition, msgs, timer)
+        # records already appended (and replicated) by an earlier attempt are not sent again
+        fresh = [m for m, (_, dup) in zip(msgs, results) if not dup]
+
+        if fresh:
+            base_offset = next(off for off, dup in results if not dup)
+            want = base_offset + len(fresh)
+            # only in-sync followers are pushed to; the others catch up through /replica_fetch
+            followers = sorted(self.isr_view.get(partition, {self.base_url}) - {self.base_url})
+            body = {"partition": partition, "msgs": fresh, "base_offset": base_offset,
+                    "hwm": self.high_watermark[partition]}
+            dropped = []
+            ends = {}
+            with timer.stage("replicate"):
+                for follower in followers:
+                    t0 = time.perf_counter()
+                    try:
+                        ends[follower] = self.transport.post(follower, "/replicate", body,
+                                                             timeout=1.0).get("end_offset", want)
+                        # short only if the follower still missed earlier records after
+                        # waiting for them (replica_reorder_wait_sec): it has fallen behind
+                        if ends[follower] < want:
+                            dropped.append(follower)
+                    except TransportError as e:
+                        self.replicate_errors.inc(1, follower)
+                        dropped.append(follower)
+                        print(f"[broker:{self.port}] replicate to {follower} failed: {e}")
+                    dt = time.perf_counter() - t0
+                    self.replicate_calls.observe(dt, follower)
+                    timer.note(f"replicate:{follower}", dt)
+            with self.locks[partition]:
+                self.replica_ends.setdefault(partition, {}).update(ends)
+                if dropped:
+                    self.isr_view[partition] = self.isr_view.get(partition, {self.base_url}) - set(dropped)
+                self._advance_hwm(partition)
+            if dropped:
+                self._report_isr(partition)
+        timer.finish()
+        self.slow_requests.maybe_record("/publish", timer, partition=partition, records=len(msgs))
+
+        if batch is None:
+            offset, duplicate = results[0]
+            resp = {"status": "ok", "offset": offset}
+            if duplicate:
+                resp["duplicate"] = True
+        else:
+            resp = {"status": "ok", "offsets": [off for off, _ in results],
+                    "duplicates": sum(1 for _, dup in results if dup)}
+        if self.quotas.enabled:
+            if nbytes is None:
+                nbytes = len(json.dumps(data))
+            resp["throttle_time_ms"] = self._charge(client_id, "produce", nbytes)
+        return resp
+
+    def replicate(self, body: Dict) -> Dict:
+        partition = int(body.get("partition"))
+        self._valid_partition(partition)
+        if self.faults.drop_replication():
+            raise HTTPException(status_code=503, detail="replication dropped (injected fault)")
+        timer = StageTimer(self.replicate_stages)
+        if "base_offset" in body:
+            in_order, end = self.append_replica(partition, int(body["base_offset"]), body["msgs"], timer)
+            if "hwm" in body:
+                with self.locks[partition]:
+                    self._follow_hwm(partition, body["hwm"])
+            timer.finish()
+            return {"status": "ok" if in_order else "behind", "end_offset": end}
+        if "msgs" in body:
+            results = self.append_messages(partition, body["msgs"], timer, "replicate")
+            timer.finish()
+            return {"status": "ok", "offsets": [off for off, _ in results]}
+        offset, duplicate = self.append_message(partition, body.get("msg"), timer, "replicate")
+        timer.finish()
+        return {"status": "ok", "offset": offset, "duplicate": duplicate}
+
+    def consume(self, partition: int, offset: int = 0, max_records: Optional[int] = None,
+                max_bytes: Optional[int] = None, client_id: str = "local") -> Dict:
+        """Records from offset, at most max_records / max_bytes (capped by the broker
+        limits, at least one record). Continue from next_offset.
+        Any replica serves reads, up to the high-water mark; end_offset is the HWM."""
+        config = self.config
+        self._valid_partition(partition)
+        owed = self.quotas.check(client_id, "consume")
+        if self.quotas.should_reject(owed):
+            raise self._throttled("consume", owed)
+        max_records = max(1, min(config.consume_max_records if max_records is None else max_records,
+                                 config.consume_max_records))
+        max_bytes = max(1, min(config.consume_max_bytes if max_bytes is None else max_bytes, config.consume_max_bytes))
+        timer = StageTimer(self.consume_stages)
+        log = self.partitions[partition]
+        remote_seg = None
+        t0 = time.perf_counter()
+        with self.locks[partition]:
+            timer.record("lock_wait", time.perf_counter() - t0)
+            with timer.stage("read"):
+                offset = max(offset, log.first_offset)
+                end_off = self.high_watermark[partition]
+                if offset >= end_off:
+                    # nothing committed there yet (this replica's HWM may trail the leader's):
+                    # the consumer retries from the same offset
+                    msgs, nbytes = [], 0
+                elif offset < log.start_offset:
+                    remote_seg = log.segment_for(offset)
+                else:
+                    msgs, nbytes = log.read(offset, min(max_records, end_off - offset), max_bytes)
+        if remote_seg is not None:
+            # offloaded offsets are served at most one segment per call, outside the partition lock
+            with timer.stage("remote_read"):
+                msgs, nbytes = self.tiered.read(remote_seg, offset, min(max_records, end_off - offset), max_bytes)
+        next_off = offset + len(msgs)
+        if msgs:
+            self.messages_out.inc(len(msgs), partition)
+            self.bytes_out.inc(nbytes, partition)
+        timer.finish()
+        self.slow_requests.maybe_record("/consume", timer, partition=partition, offset=offset, records=len(msgs))
+        resp = {"messages": msgs, "next_offset": next_off, "end_offset": end_off}
+        if self.quotas.enabled:
+            resp["throttle_time_ms"] = self._charge(client_id, "consume", nbytes)
+        return resp
+
+    def replica_fetch(self, partition: int, offset: int, replica: str, max_bytes: Optional[int] = None) -> Dict:
+        """Follower catch-up read from the leader. A replica whose fetch reaches the log
+        end is added to the ISR in the same critical section, so every later publish
+        pushes to it."""
+        self._valid_partition(partition)
+        max_bytes = max(1, self.config.replica_fetch_max_bytes if max_bytes is None else max_bytes)
+        log = self.partitions[partition]
+        remote_seg = None
+        joined = False
+        with self.locks[partition]:
+            # the request offset is the follower's log end (a longer log is cut back to this one's)
+            self.replica_ends.setdefault(partition, {})[replica] = min(offset, log.end_offset)
+            offset = max(offset, log.first_offset)
+            if offset < log.start_offset:
+                remote_seg = log.segment_for(offset)
+            else:
+                offset = min(offset, log.end_offset)
+                msgs, nbytes = log.read(offset, None, max_bytes)
+                end = log.end_offset
+                if (self.cluster.leaders.get(partition) == self.base_url
+                        and replica in self.cluster.replicas.get(partition, [])
+                        and offset + len(msgs) >= end and replica not in self.isr_view.get(partition, ())):
+                    self.isr_view[partition] = self.isr_view.get(partition, {self.base_url}) | {replica}
+                    joined = True
+            hwm = self.high_watermark[partition]
+        if remote_seg is not None:
+            msgs, nbytes = self.tiered.read(remote_seg, offset, None, max_bytes)
+            end = log.end_offset
+        if joined:
+            self._report_isr(partition)
+        return {"messages": msgs, "next_offset": offset + len(msgs), "end_offset": end, "bytes": nbytes,
+                "high_watermark": hwm}
+
+    def get_high_watermark(self, partition: int, replica: Optional[str] = None,
+                           end_offset: Optional[int] = None) -> Dict:
+        """The partition's HWM. An in-sync follower passes its log end, which may advance it."""
+        self._valid_partition(partition)
+        with self.locks[partition]:
+            if (replica is not None and end_offset is not None
+                    and self.cluster.leaders.get(partition) == self.base_url
+                    and replica in self.isr_view.get(partition, ())):
+                self.replica_ends.setdefault(partition, {})[replica] = end_offset
+                self._advance_hwm(partition)
+            return {"partition": partition, "high_watermark": self.high_watermark[partition],
+                    "end_offset": self.partitions[partition].end_offset}
+
+    def offsets_for_time(self, partition: int, timestamp: float) -> Dict:
+        """First offset whose record time (timestamp, client_ts or ts) is >= `timestamp`.
+        When no such record exists yet the log end offset is returned with found=false,
+        which is where a consumer starting "from now" should begin."""
+        self._valid_partition(partition)
+        log = self.partitions[partition]
+        with self.locks[partition]:
+            start, stop = log.time_scan_range(timestamp)
+            # offloaded segments in the range are read after the lock is released
+            remote = [seg for seg in log.segments
+                      if seg.remote and seg.end_offset > start and seg.base_offset < stop]
+            local_from = max(start, log.start_offset)
+            local, _ = log.read(local_from, max(0, stop - local_from))
+            end = log.end_offset
+        candidates = []
+        for seg in remote:
+            lo = max(start, seg.base_offset)
+            msgs, _ = self.tiered.read(seg, lo, min(stop, seg.end_offset) - lo)
+            candidates.append((lo, msgs))
+        candidates.append((local_from, local))
+        for base, msgs in candidates:
+            for i, msg in enumerate(msgs):
+                t = record_time(msg)
+                if t is not None and t >= timestamp:
+                    return {"partition": partition, "offset": base + i, "timestamp": t, "found": True}
+        return {"partition": partition, "offset": end, "timestamp": None, "found": False}
+
+    def lookup(self, partition: int, key: str, n: int = 1) -> Dict:
+        """Latest n records (newest first, at most key_index_depth) written with `key`."""
+        self._valid_partition(partition)
+        log = self.partitions[partition]
+        if log.key_index is None:
+            raise HTTPException(status_code=400, detail="key index disabled (set KEY_INDEX=1)")
+        with self.locks[partition]:
+            offsets = log.key_index.lookup(key, n)
+            found = {off: log.get(off) for off in offsets if off >= log.start_offset}
+            remote = [(off, log.segment_for(off)) for off in offsets if off < log.start_offset]
+        # offloaded records are read outside the partition lock
+        for off, seg in remote:
+            found[off] = self.tiered.read(seg, off, 1)[0][0]
+        records = [{"offset": off, "record": found[off]} for off in offsets]
+        return {"partition": partition, "key": key, "records": records}
+
+    def reads_remote(self, partition: int, offset: int) -> bool:
+        """Whether a consume from offset is served from the remote tier."""
+        return 0 <= partition < len(self.partitions) and offset < self.partitions[partition].start_offset
+
+    def get_offset(self, group_id: str, partition: int) -> Dict:
+        group = self.consumer_offsets.get(group_id, {})
+        return {"offset": group.get(int(partition), 0)}
+
+    def commit_offset(self, data: Dict) -> Dict:
+        group_id = data.get("group_id")
+        partition = int(data.get("partition"))
+        offset = int(data.get("offset"))
+        self.consumer_offsets.setdefault(group_id, {})[partition] = offset
+        return {"status": "ok"}
+
+    def log_length(self, partition: int) -> Dict:
+        self._valid_partition(partition)
+        return {"length": len(self.partitions[partition])}
+
+    def _route_table(self) -> Dict:
+        """Routes served to an InMemoryTransport: params (GET) or body (POST) -> response.
+        A client id travels as "client_id" in either."""
+        def client(payload: Dict) -> str:
+            return str(payload.pop("client_id", None) or "local")
+
+        return {
+            ("GET", "/health"): lambda p: self.health(),
+            ("GET", "/metadata"): lambda p: self.metadata(),
+            ("POST", "/publish"): lambda b: self.publish(b, str(b.get("client_id") or "local")),
+            ("POST", "/replicate"): self.replicate,
+            ("GET", "/consume"): lambda p: self.consume(client_id=client(p), **p),
+            ("GET", "/replica_fetch"): lambda p: self.replica_fetch(**p),
+            ("GET", "/high_watermark"): lambda p: self.get_high_watermark(**p),
+            ("GET", "/cluster/state"): lambda p: self.cluster.to_dict(),
+            ("POST", "/cluster/state"): self.receive_state,
+            ("POST", "/cluster/mutate"): self.cluster_mutate,
+            ("GET", "/cluster/load"): lambda p: self.local_load(),
+            ("GET", "/offsets_for_time"): lambda p: self.offsets_for_time(**p),
+            ("GET", "/lookup"): lambda p: self.lookup(**p),
+            ("GET", "/offset"): lambda p: self.get_offset(**p),
+            ("POST", "/commit_offset"): self.commit_offset,
+            ("GET", "/loglen"): lambda p: self.log_length(**p),
+        }
+
+    def handle(self, method: str, path: str, payload: Dict) -> Dict:
+        route = self._routes.get((method, path))
+        if route is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return route(payload)
+
+
+def create_app(broker: Broker) -> FastAPI:
+    """FastAPI routes for one broker; its background loops run while the app is up."""
+    app = FastAPI()
+    app.state.broker = broker
+    config = broker.config
+
+    def _require_admin():
+        if not config.admin:
+            raise HTTPException(status_code=404, detail="admin endpoints disabled (set BROKER_ADMIN=1)")
+
+    def _client_id(request: Request, data: Optional[Dict] = None) -> str:
+        cid = request.headers.get("x-client-id") or request.query_params.get("client_id")
+        if not cid and isinstance(data, dict):
+            cid = data.get("client_id")
+        if not cid:
+            cid = request.client.host if request.client else "unknown"
+        return str(cid)
+
+    async def _in_thread(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    @app.exception_handler(Throttled)
+    async def _throttled_response(request: Request, exc: Throttled):
+        return JSONResponse(status_code=429,
+                            content={"status": "throttled", "throttle_time_ms": round(exc.throttle_ms, 1)},
+                            headers=exc.headers)
+
+    @app.on_event("startup")
+    async def _startup_event():
+        broker.start()
+
+    @app.on_event("shutdown")
+    async def _shutdown_event():
+        broker.stop()
+
+    @app.get("/metadata")
+    async def metadata_endpoint():
+        return broker.metadata()
+
+    @app.get("/health")
+    async def health():
+        return broker.health()
+
+    @app.post("/publish")
+    async def publish(request: Request):
+        raw = await request.body()
+        data = json.loads(raw)
+        # blocks on the disk write (and any injected disk delay) and on the follower pushes
+        return await _in_thread(broker.publish, data, _client_id(request, data), len(raw))
+
+    @app.post("/replicate")
+    async def replicate(request: Request):
+        # may wait for an earlier push of the same partition (append_replica)
+        return await _in_thread(broker.replicate, await request.json())
+
+    @app.get("/consume")
+    async def consume(request: Request, partition: int, offset: int = 0,
+                      max_records: int = config.consume_max_records, max_bytes: int = config.consume_max_bytes):
+        args = (partition, offset, max_records, max_bytes, _client_id(request))
+        if broker.reads_remote(partition, offset):
+            # remote segment reads block on the object store
+            return await _in_thread(broker.consume, *args)
+        return broker.consume(*args)
+
+    @app.get("/replica_fetch")
+    async def replica_fetch(partition: int, offset: int, replica: str, max_bytes: int = config.replica_fetch_max_bytes):
+        return await _in_thread(broker.replica_fetch, partition, offset, replica, max_bytes)
+
+    @app.get("/high_watermark")
+    async def get_high_watermark(partition: int, replica: Optional[str] = None, end_offset: Optional[int] = None):
+        return broker.get_high_watermark(partition, replica, end_offset)
+
+    @app.get("/cluster/state")
+    async def cluster_state():
+        return broker.cluster.to_dict()
+
+    @app.post("/cluster/state")
+    async def cluster_state_push(request: Request):
+        return broker.receive_state(await request.json())
+
+    @app.post("/cluster/mutate")
+    async def cluster_mutate(request: Request):
+        return await _in_thread(broker.cluster_mutate, await request.json())
+
+    @app.post("/admin/partitions")
+    async def admin_add_partitions(request: Request):
+        """Raise the partition count to {"count": n}; new partitions get the default placement."""
+        _require_admin()
+        data = await request.json()
+        return await _in_thread(broker.submit_admin, {"op": "add_partitions", "count": int(data["count"])})
+
+    @app.post("/admin/reassign")
+    async def admin_reassign(request: Request):
+        """Move {"partition": p, "replicas": [urls]}. New replicas copy the log from the
+        leader in the background (REPLICA_FETCH_BYTES_PER_SEC), join the ISR, then
+        leadership moves to replicas[0] and replicas outside the list are dropped."""
+        _require_admin()
+        data = await request.json()
+        return await _in_thread(broker.submit_admin, {"op": "reassign", "partition": int(data["partition"]),
+                                                      "replicas": list(data["replicas"])})
+
+    @app.get("/cluster/load")
+    async def cluster_load():
+        return broker.local_load()
+
+    @app.get("/admin/load")
+    async def admin_load():
+        _require_admin()
+        return await _in_thread(broker.load_summary)
+
+    @app.post("/admin/rebalance")
+    async def admin_rebalance(request: Request):
+        """Move up to {"max_moves": n} replicas off the most loaded brokers, as reassignments
+        (see /admin/reassign). {"dry_run": true} only returns the plan."""
+        _require_admin()
+        data = await request.json()
+        return await _in_thread(broker.submit_admin, {"op": "rebalance_replicas",
+                                                      "max_moves": int(data.get("max_moves", 1)),
+                                                      "dry_run": bool(data.get("dry_run", False))})
+
+    @app.get("/offsets_for_time")
+    async def offsets_for_time(partition: int, timestamp: float):
+        return await _in_thread(broker.offsets_for_time, partition, timestamp)
+
+    @app.get("/lookup")
+    async def lookup(partition: int, key: str, n: int = 1):
+        return await _in_thread(broker.lookup, partition, key, n)
+
+    @app.get("/offset")
+    async def get_offset(group_id: str, partition: int):
+        return broker.get_offset(group_id, partition)
+
+    @app.post("/commit_offset")
+    async def commit_offset(request: Request):
+        return broker.commit_offset(await request.json())
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        """Prometheus text exposition of the broker's counters, histograms and gauges."""
+        return PlainTextResponse(broker.telemetry.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/admin/profile")
+    async def admin_profile(seconds: float = 5.0, interval_ms: float = 10.0, lines: bool = False):
+        """Sample all broker threads for `seconds` and return collapsed stacks (flamegraph.pl / speedscope input)."""
+        _require_admin()
+        if not 0 < seconds <= 60:
+            raise HTTPException(status_code=400, detail="seconds must be in (0, 60]")
+        sampler = StackSampler(interval_ms / 1000.0, include_lines=lines)
+        # sample from a worker thread so the event loop keeps serving (and shows up in the profile)
+        await _in_thread(sampler.run, seconds)
+        return PlainTextResponse(sampler.collapsed())
+
+    @app.get("/admin/slow_requests")
+    async def admin_slow_requests(limit: int = 50):
+        _require_admin()
+        return {"threshold_ms": config.slow_request_ms, "requests": broker.slow_requests.latest(limit)}
+
+    @app.get("/admin/faults")
+    async def admin_faults():
+        _require_admin()
+        return {"faults": broker.faults.snapshot()}
+
+    @app.post("/admin/faults")
+    async def admin_set_faults(request: Request):
+        """Inject faults, e.g. {"disk_delay_ms": 200, "duration_sec": 10} or
+        {"drop_replication": 1.0}; {"clear": true} removes them all (see broker/faults.py)."""
+        _require_admin()
+        data = await request.json()
+        if data.pop("clear", False):
+            broker.faults.clear()
+        duration = data.pop("duration_sec", None)
         try:
-            requests.post(f"{follower}/replicate", json={"partition": partition, "msg": data}, timeout=1.0)
-        except Exception as e:
-
-            print(f"[broker:{PORT}] replicate to {follower} failed: {e}")
-
-    return {"status": "ok", "offset": offset}
-
-@app.post("/replicate")
-async def replicate(request: Request):
-    body = await request.json()
-    partition = int(body.get("partition"))
-    msg = body.get("msg")
-    if partition < 0 or partition >= NUM_PARTITIONS:
-        raise HTTPException(status_code=400, detail="invalid partition")
-    offset = append_message(partition, msg)
-    return {"status": "ok", "offset": offset}
-
-@app.get("/consume")
-async def consume(partition: int, offset: int = 0):
-    if partition < 0 or partition >= NUM_PARTITIONS:
-        raise HTTPException(status_code=400, detail="invalid partition")
-    with locks[partition]:
-        msgs = partitions[partition][offset:]
-        next_off = len(partitions[partition])
-    return {"messages": msgs, "next_offset": next_off}
-
-@app.get("/offset")
-async def get_offset(group_id: str, partition: int):
-    group = consumer_offsets.get(group_id, {})
-    return {"offset": group.get(int(partition), 0)}
-
-@app.post("/commit_offset")
-async def commit_offset(request: Request):
-    data = await request.json()
-    group_id = data.get("group_id")
-    partition = int(data.get("partition"))
-    offset = int(data.get("offset"))
-    consumer_offsets.setdefault(group_id, {})[partition] = offset
-    return {"status": "ok"}
-
-@app.get("/loglen")
-async def log_length(partition: int):
-    if partition < 0 or partition >= NUM_PARTITIONS:
-        raise HTTPException(status_code=400, detail="invalid partition")
-    return {"length": len(partitions[partition])}
+            broker.faults.set(duration, **data)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"faults": broker.faults.snapshot()}
+
+    @app.get("/loglen")
+    async def log_length(partition: int):
+        return broker.log_length(partition)
+
+    return app
+
+
+def app_from_env() -> FastAPI:
+    """App factory for uvicorn (see run_broker.py): one broker configured from the environment."""
+    return create_app(Broker(BrokerConfig.from_env()))
+
+
+_env_app: Optional[FastAPI] = None
+
+
+def __getattr__(name: str):
+    # `uvicorn broker.broker:app` keeps working; the broker is only built when the app is asked for
+    global _env_app
+    if name == "app":
+        if _env_app is None:
+            _env_app = app_from_env()
+        return _env_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,195 @@
+# -------------------------
+# Cluster state: partitions, replicas, leaders, in-sync replicas
+# -------------------------
+"""
+The cluster state is one small JSON document versioned by `epoch`. Only the
+controller (the lowest-addressed live broker) mutates it; every mutation bumps
+the epoch, is persisted and is pushed to all members, which accept any state
+with a higher epoch than their own. Members also pull the controller's state
+periodically, so a missed push is repaired within a sync interval.
+
+Besides replicas and leaders the state tracks the in-sync replica set (ISR)
+reported by partition leaders, and in-flight reassignments: while a partition
+moves, its replica list is the union of the old and the target replicas; once
+every target replica is in sync the move completes (leadership moves to the
+first target replica and the replica list shrinks to the target).
+"""
+import json
+import os
+import threading
+from typing import Callable, Dict, List
+
+# (pid, members, current replicas by pid) -> replicas, preferred leader first
+Placement = Callable[[int, List[str], Dict[int, List[str]]], List[str]]
+
+
+def port_of(url: str) -> int:
+    return int(url.rsplit(":", 1)[-1])
+
+
+class ClusterState:
+    def __init__(self, path: str, members: List[str], num_partitions: int, placement: Placement):
+        self.path = path
+        self.placement = placement
+        self.lock = threading.RLock()
+        self.epoch = 0
+        self.members: List[str] = list(members)
+        self.replicas: Dict[int, List[str]] = {}
+        self.leaders: Dict[int, str] = {}
+        self.isr: Dict[int, List[str]] = {}
+        self.reassignments: Dict[int, Dict] = {}
+        if not self._load():
+            self._add_partitions(num_partitions)
+        for m in members:
+            if m not in self.members:
+                self.members.append(m)
+
+    # --- persistence / transport ---
+
+    @property
+    def num_partitions(self) -> int:
+        return len(self.replicas)
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "epoch": self.epoch,
+                "members": list(self.members),
+                "partitions": {str(p): list(r) for p, r in self.replicas.items()},
+                "leaders": {str(p): l for p, l in self.leaders.items()},
+                "isr": {str(p): list(r) for p, r in self.isr.items()},
+                "reassignments": {str(p): dict(r) for p, r in self.reassignments.items()},
+            }
+
+    def _set(self, doc: Dict):
+        self.epoch = int(doc["epoch"])
+        self.members = list(doc.get("members", self.members))
+        self.replicas = {int(p): list(r) for p, r in doc["partitions"].items()}
+        self.leaders = {int(p): l for p, l in doc["leaders"].items()}
+        self.isr = {int(p): list(r) for p, r in doc.get("isr", doc["partitions"]).items()}
+        self.reassignments = {int(p): dict(r) for p, r in doc.get("reassignments", {}).items()}
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, "r") as f:
+                self._set(json.load(f))
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def apply(self, doc: Dict) -> bool:
+        """Adopt a state received from the controller if it is newer. Returns True if adopted."""
+        with self.lock:
+            if int(doc.get("epoch", -1)) <= self.epoch:
+                return False
+            self._set(doc)
+            self.save()
+            return True
+
+    def metadata(self) -> Dict:
+        """The /metadata document (a superset of the original partitions/leaders/members)."""
+        doc = self.to_dict()
+        doc["num_partitions"] = len(doc["partitions"])
+        return doc
+
+    def controller_order(self) -> List[str]:
+        return sorted(self.members, key=port_of)
+
+    # --- mutations (controller only); each bumps the epoch and persists ---
+
+    def _commit(self):
+        self.epoch += 1
+        self.save()
+
+    def _add_partitions(self, count: int):
+        for pid in range(self.num_partitions, count):
+            replicas = self.placement(pid, self.members, self.replicas)
+            self.replicas[pid] = replicas
+            self.leaders[pid] = replicas[0]
+            self.isr[pid] = list(replicas)
+
+    def add_partitions(self, count: int) -> bool:
+        with self.lock:
+            if count <= self.num_partitions:
+                return False
+            self._add_partitions(count)
+            self._commit()
+            return True
+
+    def reassign(self, pid: int, target: List[str]):
+        """Start moving pid to the `target` replicas (first one becomes the leader)."""
+        with self.lock:
+            if pid not in self.replicas:
+                raise ValueError(f"unknown partition {pid}")
+            if not target or len(set(target)) != len(target):
+                raise ValueError("target replicas must be a non-empty list without duplicates")
+            for url in target:
+                if url not in self.members:
+                    self.members.append(url)
+            current = self.replicas[pid]
+            self.reassignments[pid] = {"target": list(target),
+                                       "adding": [u for u in target if u not in current],
+                                       "removing": [u for u in current if u not in target]}
+            self.replicas[pid] = current + [u for u in target if u not in current]
+            self._maybe_complete(pid)
+            self._commit()
+
+    def set_isr(self, pid: int, isr: List[str], leader: str) -> bool:
+        """ISR change reported by the partition's leader; ignored from anyone else."""
+        with self.lock:
+            if self.leaders.get(pid) != leader:
+                return False
+            isr = [u for u in self.replicas[pid] if u in isr or u == leader]
+            if isr == self.isr.get(pid):
+                return False
+            self.isr[pid] = isr
+            self._maybe_complete(pid)
+            self._commit()
+            return True
+
+    def set_leader(self, pid: int, leader: str) -> bool:
+        with self.lock:
+            if leader not in self.isr.get(pid, []) or self.leaders.get(pid) == leader:
+                return False
+            self.leaders[pid] = leader
+            self._commit()
+            return True
+
+    def rebalance(self, orders: Dict[int, List[str]], leaders: Dict[int, str]) -> bool:
+        """Reorder replica lists (preferred leader first) and move leaders, in one epoch.
+        Orders must be permutations of the current replicas, leaders in the ISR."""
+        with self.lock:
+            changed = False
+            for pid, order in orders.items():
+                if pid in self.replicas and sorted(order) == sorted(self.replicas[pid]) \
+                        and order != self.replicas[pid]:
+                    self.replicas[pid] = list(order)
+                    changed = True
+            for pid, leader in leaders.items():
+                if leader in self.isr.get(pid, []) and self.leaders.get(pid) != leader:
+                    self.leaders[pid] = leader
+                    changed = True
+            if changed:
+                self._commit()
+            return changed
+
+    def _maybe_complete(self, pid: int):
+        move = self.reassignments.get(pid)
+        if move is None:
+            return
+        target = move["target"]
+        isr = self.isr.get(pid, [])
+        if not all(u in isr for u in target):
+            return
+        self.leaders[pid] = target[0]
+        self.replicas[pid] = list(target)
+        self.isr[pid] = [u for u in target if u in isr]
+        del self.reassignments[pid]
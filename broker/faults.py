@@ -0,0 +1,80 @@
+# -------------------------
+# Injected faults for benchmark and recovery runs
+# -------------------------
+"""
+Faults a broker applies to itself while they are set through /admin/faults
+(see utils/fault_injector.py):
+
+- disk_delay_ms: every log append sleeps this long inside its disk write, with
+  the partition lock held, like a slow fsync would.
+- drop_replication: probability that replication traffic is dropped: pushes to
+  /replicate are refused with 503 and catch-up fetches are skipped, so the
+  broker falls out of the ISR.
+
+Each fault can be given a duration, after which it clears itself.
+"""
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+FAULTS = ("disk_delay_ms", "drop_replication")
+
+
+class FaultState:
+    def __init__(self):
+        self._values: Dict[str, float] = {}
+        self._until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, duration_sec: Optional[float] = None, **faults: float):
+        """Set (or with a value of 0, clear) the given faults."""
+        until = time.monotonic() + duration_sec if duration_sec else None
+        with self._lock:
+            for name, value in faults.items():
+                if name not in FAULTS:
+                    raise ValueError(f"unknown fault: {name}")
+                if not value:
+                    self._values.pop(name, None)
+                    self._until.pop(name, None)
+                    continue
+                self._values[name] = float(value)
+                if until is None:
+                    self._until.pop(name, None)
+                else:
+                    self._until[name] = until
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._until.clear()
+
+    def get(self, name: str) -> float:
+        if not self._values:
+            return 0.0  # fast path: nothing injected
+        with self._lock:
+            until = self._until.get(name)
+            if until is not None and time.monotonic() >= until:
+                self._values.pop(name, None)
+                del self._until[name]
+            return self._values.get(name, 0.0)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        out = {}
+        for name in FAULTS:
+            value = self.get(name)
+            if value:
+                until = self._until.get(name)
+                out[name] = {"value": value,
+                             "remaining_sec": None if until is None else round(until - now, 3)}
+        return out
+
+    def disk_delay(self):
+        ms = self.get("disk_delay_ms")
+        if ms:
+            time.sleep(ms / 1000.0)
+
+    def drop_replication(self) -> bool:
+        p = self.get("drop_replication")
+        return bool(p) and random.random() < p
@@ -0,0 +1,81 @@
+# -------------------------
+# Per-partition key index
+# -------------------------
+"""
+Latest offsets per record key, for point lookups without scanning a partition.
+
+In memory the index maps key -> the last `depth` offsets written for that key.
+When a segment is closed its share of the index is written next to it as
+`<base_offset:020d>.keyindex`: one JSON line `[key, [offsets...]]` per key,
+sorted by key. On startup closed segments are loaded from those files (so
+their records need not be re-read for the index) and only the active segment
+is rebuilt from its records.
+"""
+import json
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+KEYINDEX_SUFFIX = ".keyindex"
+
+
+def record_key(msg: Dict) -> Optional[str]:
+    key = msg.get("key")
+    return None if key is None else str(key)
+
+
+class KeyIndex:
+    def __init__(self, depth: int = 10):
+        self.depth = max(1, depth)
+        self.latest: Dict[str, Deque[int]] = {}
+        # offsets per key in the active segment; written out when it is closed
+        self._segment: Dict[str, List[int]] = {}
+
+    @staticmethod
+    def path_for(segment_path: str) -> str:
+        return segment_path.rsplit(".", 1)[0] + KEYINDEX_SUFFIX
+
+    def _remember(self, key: str, offsets: Iterable[int]):
+        d = self.latest.get(key)
+        if d is None:
+            d = self.latest[key] = deque(maxlen=self.depth)
+        d.extend(offsets)
+
+    def add(self, offset: int, msg: Dict):
+        key = record_key(msg)
+        if key is None:
+            return
+        self._remember(key, (offset,))
+        offs = self._segment.setdefault(key, [])
+        offs.append(offset)
+        if len(offs) > self.depth:
+            del offs[0]
+
+    def close_segment(self, segment_path: str):
+        """Persist the active segment's entries and start a new one."""
+        lines = [json.dumps([k, self._segment[k]]) + "\n" for k in sorted(self._segment)]
+        with open(self.path_for(segment_path), "w") as f:
+            f.write("".join(lines))
+        self._segment = {}
+
+    def load_segment(self, segment_path: str, base_offset: int, end_offset: int) -> bool:
+        """Merge a closed segment's index file. False if it is missing or out of range."""
+        try:
+            with open(self.path_for(segment_path), "r") as f:
+                entries: List[Tuple[str, List[int]]] = [tuple(json.loads(ln)) for ln in f if ln.strip()]
+        except (OSError, ValueError):
+            return False
+        if any(o < base_offset or o >= end_offset for _, offs in entries for o in offs):
+            return False
+        for key, offs in entries:
+            self._remember(key, offs)
+        return True
+
+    def lookup(self, key: str, n: int = 1) -> List[int]:
+        """Up to n latest offsets for key, newest first."""
+        d = self.latest.get(str(key))
+        if not d:
+            return []
+        return list(d)[::-1][:max(0, n)]
+
+    def __len__(self):
+        return len(self.latest)
@@ -0,0 +1,385 @@
+# -------------------------
+# Segmented partition log
+# -------------------------
+"""
+On-disk layout of one partition:
+
+    logs_<port>/partition_<pid>/<base_offset:020d>.jsonl      records, one JSON per line
+    logs_<port>/partition_<pid>/<base_offset:020d>.timeindex  "<max_ts> <offset>" per line
+
+A new segment is started once the active one reaches `segment_bytes`. The time
+index is sparse: after every `index_interval_bytes` of appended data it records
+the largest record timestamp seen so far and the offset it was seen at. Because
+the timestamp is a running maximum the index is sorted, so offset_for_time can
+binary search it and only has to scan one index interval of records.
+
+With `key_index_depth` > 0 a KeyIndex (broker/keyindex.py) tracks the latest
+offsets per record key and writes a `.keyindex` file for every closed segment.
+
+Records of local segments are also kept in memory (as before segmentation),
+starting at `start_offset`. Segments offloaded to a remote tier (see
+broker/tiered.py) leave a `<base_offset:020d>.remote` marker plus their index
+files behind; their records are read through `remote_reader` on demand.
+"""
+import json
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from broker.keyindex import KeyIndex
+
+SEGMENT_SUFFIX = ".jsonl"
+TIMEINDEX_SUFFIX = ".timeindex"
+REMOTE_SUFFIX = ".remote"
+
+
+def record_time(msg: Dict) -> Optional[float]:
+    """Event time of a record: timestamp, then client_ts, then ts (same order as the analytics job)."""
+    for field in ("timestamp", "client_ts", "ts"):
+        v = msg.get(field)
+        if v is not None and not isinstance(v, bool):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def _remove_files(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Segment:
+    def __init__(self, directory: str, base_offset: int):
+        self.base_offset = base_offset
+        self.path = os.path.join(directory, f"{base_offset:020d}{SEGMENT_SUFFIX}")
+        self.index_path = os.path.join(directory, f"{base_offset:020d}{TIMEINDEX_SUFFIX}")
+        self.marker_path = os.path.join(directory, f"{base_offset:020d}{REMOTE_SUFFIX}")
+        self.end_offset = base_offset  # exclusive
+        self.size = 0
+        self.closed = False
+        self.remote_object: Optional[str] = None  # set once the segment lives in the remote tier
+
+    @property
+    def remote(self) -> bool:
+        return self.remote_object is not None
+
+    def __repr__(self):
+        return f"Segment(base={self.base_offset}, end={self.end_offset}, size={self.size}, remote={self.remote})"
+
+
+def parse_lines(lines: Iterable[str]) -> Tuple[List[Dict], array]:
+    """Records of a segment file and the prefix sums of their line sizes. Torn lines are skipped."""
+    records: List[Dict] = []
+    sizes = array("q", [0])
+    for ln in lines:
+        if not ln.strip():
+            continue
+        try:
+            msg = json.loads(ln)
+        except Exception:
+            continue
+        records.append(msg)
+        sizes.append(sizes[-1] + len(ln))
+    return records, sizes
+
+
+def read_bounds(sizes: array, lo: int, max_records: Optional[int] = None,
+                max_bytes: Optional[int] = None) -> int:
+    """End index of a read starting at record index lo, given the size prefix sums of
+    its segment or log. At least one record is returned when any is available."""
+    n = len(sizes) - 1
+    hi = n if max_records is None else min(n, lo + max(0, max_records))
+    if max_bytes is not None and hi > lo:
+        hi = max(lo + 1, min(hi, bisect_right(sizes, sizes[lo] + max_bytes) - 1))
+    return hi
+
+
+class PartitionLog:
+    """Append-only log of one partition. Not synchronised: callers hold the partition lock."""
+
+    def __init__(self, directory: str, segment_bytes: int = 8 * 1024 * 1024,
+                 index_interval_bytes: int = 4096, legacy_file: Optional[str] = None,
+                 key_index_depth: int = 0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval_bytes = index_interval_bytes
+        self.key_index_depth = key_index_depth
+        self._reset()
+        # reads records of a remote segment; installed by the tiered storage manager
+        self.remote_reader: Optional[Callable[[Segment], List[Dict]]] = None
+        os.makedirs(directory, exist_ok=True)
+        if legacy_file and os.path.exists(legacy_file) and not self._segment_files():
+            # pre-segmentation log: it becomes the first segment as is
+            os.replace(legacy_file, Segment(directory, 0).path)
+        self._load()
+
+    # --- offsets ---
+
+    @property
+    def end_offset(self) -> int:
+        return self.start_offset + len(self.records)
+
+    def __len__(self) -> int:
+        return self.end_offset
+
+    @property
+    def first_offset(self) -> int:
+        """Earliest offset still available, locally or in the remote tier."""
+        return self.segments[0].base_offset
+
+    def segment_for(self, offset: int) -> Segment:
+        i = bisect_left([seg.end_offset for seg in self.segments], offset + 1)
+        return self.segments[min(i, len(self.segments) - 1)]
+
+    @property
+    def active(self) -> Segment:
+        return self.segments[-1]
+
+    # --- loading ---
+
+    def _reset(self):
+        self.start_offset = 0
+        self.records: List[Dict] = []
+        # prefix sums of serialized sizes: sizes[i] = bytes in [start_offset, start_offset + i)
+        self.sizes = array("q", [0])
+        self.segments: List[Segment] = []
+        # sparse time index over the whole partition, kept as two parallel lists for bisect
+        self.index_ts: List[float] = []
+        self.index_offsets: List[int] = []
+        self.max_ts: Optional[float] = None
+        self._unindexed_bytes = 0
+        self.key_index = KeyIndex(self.key_index_depth) if self.key_index_depth > 0 else None
+
+    def _segment_files(self) -> List[int]:
+        bases = set()
+        for name in os.listdir(self.directory):
+            for suffix in (SEGMENT_SUFFIX, REMOTE_SUFFIX):
+                if name.endswith(suffix):
+                    try:
+                        bases.add(int(name[:-len(suffix)]))
+                    except ValueError:
+                        continue
+        return sorted(bases)
+
+    def _load(self):
+        bases = self._segment_files()
+        if not bases:
+            self.segments.append(Segment(self.directory, 0))
+            return
+        self.start_offset = bases[0]
+        for i, base in enumerate(bases):
+            seg = Segment(self.directory, base)
+            if not os.path.exists(seg.path) and os.path.exists(seg.marker_path):
+                with open(seg.marker_path, "r") as f:
+                    marker = json.load(f)
+                seg.base_offset, seg.end_offset = int(marker["base"]), int(marker["end"])
+                seg.size, seg.remote_object, seg.closed = int(marker["size"]), marker["object"], True
+                self.start_offset = seg.end_offset
+                self.segments.append(seg)
+                # records are remote; indexes are used if present but cannot be rebuilt
+                self._load_time_index(seg)
+                if self.key_index is not None:
+                    self.key_index.load_segment(seg.path, seg.base_offset, seg.end_offset)
+                continue
+            # offsets follow the records actually read, even if a torn line was skipped
+            seg.base_offset = seg.end_offset = self.end_offset
+            with open(seg.path, "r") as f:
+                records, sizes = parse_lines(f)
+            base_bytes = self.sizes[-1]
+            self.records.extend(records)
+            self.sizes.extend(base_bytes + n for n in sizes[1:])
+            seg.size = sizes[-1]
+            seg.end_offset += len(records)
+            seg.closed = i < len(bases) - 1
+            self.segments.append(seg)
+            if not (seg.closed and self._load_time_index(seg)):
+                self._rebuild_time_index(seg)
+            if self.key_index is not None:
+                self._load_key_index(seg)
+
+    def _load_time_index(self, seg: Segment) -> bool:
+        """Read a closed segment's index file. False if it is missing or does not match the segment."""
+        try:
+            with open(seg.index_path, "r") as f:
+                entries = [ln.split() for ln in f if ln.strip()]
+            entries = [(float(ts), int(off)) for ts, off in entries]
+        except (OSError, ValueError):
+            return False
+        if entries and (entries[0][1] < seg.base_offset or entries[-1][1] != seg.end_offset - 1):
+            return False
+        for ts, off in entries:
+            self._add_index_entry(ts, off)
+        self._unindexed_bytes = 0
+        return True
+
+    def _rebuild_time_index(self, seg: Segment):
+        self._unindexed_bytes = 0
+        entries = []
+        for off in range(seg.base_offset, seg.end_offset):
+            i = off - self.start_offset
+            entries.extend(self._observe(self.records[i], self.sizes[i + 1] - self.sizes[i], off))
+        if seg.closed:
+            entries.extend(self._seal_index(seg))
+        with open(seg.index_path, "w") as f:
+            f.write("".join(entries))
+
+    def _load_key_index(self, seg: Segment):
+        if seg.closed and self.key_index.load_segment(seg.path, seg.base_offset, seg.end_offset):
+            return
+        for off in range(seg.base_offset, seg.end_offset):
+            self.key_index.add(off, self.records[off - self.start_offset])
+        if seg.closed:
+            self.key_index.close_segment(seg.path)
+
+    # --- appending ---
+
+    def _add_index_entry(self, ts: float, offset: int):
+        self.index_ts.append(ts)
+        self.index_offsets.append(offset)
+        self.max_ts = ts if self.max_ts is None else max(self.max_ts, ts)
+
+    def _observe(self, msg: Dict, nbytes: int, offset: int) -> List[str]:
+        """Track one appended record; returns the index line to persist, if any."""
+        ts = record_time(msg)
+        if ts is not None and (self.max_ts is None or ts > self.max_ts):
+            self.max_ts = ts
+        self._unindexed_bytes += nbytes
+        if self._unindexed_bytes >= self.index_interval_bytes and self.max_ts is not None:
+            self._add_index_entry(self.max_ts, offset)
+            self._unindexed_bytes = 0
+            return [f"{self.max_ts!r} {offset}\n"]
+        return []
+
+    def _seal_index(self, seg: Segment) -> List[str]:
+        """Index the last record of a segment so closed segments are fully covered."""
+        self._unindexed_bytes = 0
+        last = seg.end_offset - 1
+        if self.max_ts is not None and last >= seg.base_offset and \
+                (not self.index_offsets or self.index_offsets[-1] != last):
+            self._add_index_entry(self.max_ts, last)
+            return [f"{self.max_ts!r} {last}\n"]
+        return []
+
+    @staticmethod
+    def _write_index(seg: Segment, entries: List[str]):
+        if entries:
+            with open(seg.index_path, "a") as f:
+                f.write("".join(entries))
+
+    def _roll(self):
+        seg = self.active
+        self._write_index(seg, self._seal_index(seg))
+        if self.key_index is not None:
+            self.key_index.close_segment(seg.path)
+        seg.closed = True
+        self.segments.append(Segment(self.directory, self.end_offset))
+
+    def append(self, msgs: List[Dict], lines: List[str]):
+        """Append records with their serialized lines (newline-terminated) in one write."""
+        if not msgs:
+            return
+        if self.active.size >= self.segment_bytes and self.active.end_offset > self.active.base_offset:
+            self._roll()
+        seg = self.active
+        data = "".join(lines)
+        with open(seg.path, "a") as f:
+            f.write(data)
+        entries = []
+        for msg, line in zip(msgs, lines):
+            offset = self.end_offset
+            self.records.append(msg)
+            self.sizes.append(self.sizes[-1] + len(line))
+            entries.extend(self._observe(msg, len(line), offset))
+            if self.key_index is not None:
+                self.key_index.add(offset, msg)
+        self._write_index(seg, entries)
+        seg.size += len(data)
+        seg.end_offset = self.end_offset
+
+    def truncate(self, offset: int):
+        """Drop the local records from offset on (a replica discarding a tail its leader
+        does not have). Later segments are deleted, the one holding offset is rewritten
+        with the records before it, and the in-memory state and indexes are reloaded."""
+        if offset >= self.end_offset:
+            return
+        if offset < self.start_offset:
+            raise ValueError(f"cannot truncate to {offset}: offsets below {self.start_offset} are remote")
+        seg = self.segment_for(offset)
+        for later in self.segments[self.segments.index(seg) + 1:]:
+            _remove_files(later.path, later.index_path, KeyIndex.path_for(later.path))
+        keep = []
+        with open(seg.path, "r") as f:
+            for ln in f:
+                if len(keep) == offset - seg.base_offset:
+                    break
+                if parse_lines([ln])[0]:
+                    keep.append(ln if ln.endswith("\n") else ln + "\n")
+        tmp = seg.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("".join(keep))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, seg.path)
+        # both indexes of the segment are rebuilt from its records, as for an active segment
+        _remove_files(seg.index_path, KeyIndex.path_for(seg.path))
+        self._reset()
+        self._load()
+
+    # --- reading ---
+
+    def get(self, offset: int) -> Dict:
+        if offset < self.start_offset:
+            seg = self.segment_for(offset)
+            return self.remote_reader(seg)[offset - seg.base_offset]
+        return self.records[offset - self.start_offset]
+
+    def read(self, offset: int, max_records: Optional[int] = None,
+             max_bytes: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Local records from offset (clamped to the local log) and their serialized size in bytes."""
+        lo = min(max(offset - self.start_offset, 0), len(self.records))
+        hi = read_bounds(self.sizes, lo, max_records, max_bytes)
+        return self.records[lo:hi], self.sizes[hi] - self.sizes[lo]
+
+    # --- tiering ---
+
+    def evict(self, seg: Segment, remote_object: str):
+        """Drop the oldest local segment once it is stored remotely as `remote_object`."""
+        if seg.base_offset != self.start_offset or not seg.closed or seg.remote:
+            raise ValueError(f"only the oldest closed local segment can be evicted, not {seg}")
+        marker = {"base": seg.base_offset, "end": seg.end_offset, "size": seg.size, "object": remote_object}
+        tmp = seg.marker_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(marker, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, seg.marker_path)
+        seg.remote_object = remote_object
+        n = seg.end_offset - seg.base_offset
+        del self.records[:n]
+        dropped = self.sizes[n]
+        self.sizes = array("q", (x - dropped for x in self.sizes[n:]))
+        self.start_offset = seg.end_offset
+        os.remove(seg.path)
+
+    def time_scan_range(self, ts: float) -> Tuple[int, int]:
+        """[start, stop) offsets holding the first record whose event time is >= ts, if any:
+        from just after the last index entry before ts to the first index entry at or after it."""
+        i = bisect_left(self.index_ts, ts)
+        start = self.index_offsets[i - 1] + 1 if i > 0 else self.first_offset
+        stop = self.index_offsets[i] + 1 if i < len(self.index_offsets) else self.end_offset
+        return max(start, self.first_offset), stop
+
+    def offset_for_time(self, ts: float) -> Optional[Tuple[int, float]]:
+        """(offset, timestamp) of the first record whose event time is >= ts, or None if there is none."""
+        start, stop = self.time_scan_range(ts)
+        for off in range(start, stop):
+            t = record_time(self.get(off))
+            if t is not None and t >= ts:
+                return off, t
+        return None
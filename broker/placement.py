@@ -0,0 +1,166 @@
+# -------------------------
+# Replica / leader placement and rebalancing
+# -------------------------
+"""
+Pure planning functions used by the controller; they take the current
+assignment and return changes, and never touch the cluster state themselves.
+
+Every partition has a weight: 1 plus its client traffic (bytes in + out per
+second, measured on its leader) relative to the mean partition's traffic. An
+idle cluster is therefore balanced by partition counts, a busy one by traffic.
+A broker's replica load is the sum of the weights of the partitions it holds,
+its leader load the sum over the partitions it leads.
+
+The first replica of a partition is its preferred leader. Placement and
+`preferred_order` choose it so that leader load is even, and
+`leader_elections` moves leadership back to it whenever it is alive and in
+sync (or away from a dead leader to the next in-sync replica).
+"""
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class TrafficMeter:
+    """Per-partition rates (EWMA) derived from cumulative byte counters."""
+
+    def __init__(self, alpha: float = 0.3, min_interval: float = 1.0):
+        self.alpha = alpha
+        self.min_interval = min_interval
+        self._last: Dict = {}
+        self._at: Optional[float] = None
+        self._rates: Dict = {}
+
+    def sample(self, totals: Dict, now: Optional[float] = None) -> Dict:
+        """Feed the current counter totals; returns rates per key (units per second)."""
+        now = time.monotonic() if now is None else now
+        if self._at is not None and now - self._at < self.min_interval:
+            return dict(self._rates)
+        if self._at is not None:
+            dt = now - self._at
+            for key, total in totals.items():
+                rate = max(0.0, total - self._last.get(key, 0.0)) / dt
+                prev = self._rates.get(key)
+                self._rates[key] = rate if prev is None else prev + self.alpha * (rate - prev)
+        self._last = dict(totals)
+        self._at = now
+        return dict(self._rates)
+
+
+def partition_weights(pids: Iterable[int], traffic: Dict[int, float]) -> Dict[int, float]:
+    pids = list(pids)
+    busy = [traffic.get(p, 0.0) for p in pids]
+    mean = sum(busy) / len(busy) if busy else 0.0
+    if mean <= 0:
+        return {p: 1.0 for p in pids}
+    return {p: 1.0 + traffic.get(p, 0.0) / mean for p in pids}
+
+
+def _loads(replicas: Dict[int, List[str]], members: List[str], weights: Dict[int, float]):
+    replica_load = {m: 0.0 for m in members}
+    leader_load = {m: 0.0 for m in members}
+    for pid, rs in replicas.items():
+        w = weights.get(pid, 1.0)
+        for m in rs:
+            replica_load[m] = replica_load.get(m, 0.0) + w
+        if rs:
+            leader_load[rs[0]] = leader_load.get(rs[0], 0.0) + w
+    return replica_load, leader_load
+
+
+def place_partition(pid: int, members: List[str], replication_factor: int,
+                    current: Dict[int, List[str]], weights: Optional[Dict[int, float]] = None) -> List[str]:
+    """Replicas for a new partition: the least loaded brokers, preferred leader first."""
+    weights = weights or {}
+    n = len(members)
+    rf = min(max(1, replication_factor), n)
+    replica_load, leader_load = _loads(current, members, weights)
+    # ties rotate with pid so an empty cluster gets the classic staggered layout
+    rank = {m: (i - pid) % n for i, m in enumerate(members)}
+    chosen = sorted(members, key=lambda m: (replica_load[m], rank[m]))[:rf]
+    leader = min(chosen, key=lambda m: (leader_load[m], rank[m]))
+    return [leader] + sorted((m for m in chosen if m != leader), key=lambda m: rank[m])
+
+
+def preferred_order(replicas: Dict[int, List[str]], weights: Dict[int, float]) -> Dict[int, List[str]]:
+    """Reorder replica lists (no data moves) so preferred leaders carry even leader load.
+    Returns only the partitions whose order changes."""
+    leader_load: Dict[str, float] = {}
+    changes = {}
+    for pid in sorted(replicas, key=lambda p: (-weights.get(p, 1.0), p)):
+        rs = replicas[pid]
+        if not rs:
+            continue
+        best = min(rs, key=lambda m: (leader_load.get(m, 0.0), m != rs[0]))
+        leader_load[best] = leader_load.get(best, 0.0) + weights.get(pid, 1.0)
+        if best != rs[0]:
+            changes[pid] = [best] + [m for m in rs if m != best]
+    return changes
+
+
+def leader_imbalance(replicas: Dict[int, List[str]], members: List[str], weights: Dict[int, float]) -> float:
+    """(max - min) preferred-leader load over the mean; 0 means perfectly even."""
+    _, leader_load = _loads(replicas, members, weights)
+    loads = [leader_load[m] for m in members]
+    mean = sum(loads) / len(loads) if loads else 0.0
+    return (max(loads) - min(loads)) / mean if mean > 0 else 0.0
+
+
+def replica_moves(replicas: Dict[int, List[str]], members: List[str], weights: Dict[int, float],
+                  max_moves: int = 1) -> Dict[int, List[str]]:
+    """Greedy replica moves from the most to the least loaded broker, each of which
+    strictly narrows the gap between them. Returns target replica lists (to be
+    applied as reassignments); the moved replica keeps its position in the list."""
+    plan = {pid: list(rs) for pid, rs in replicas.items()}
+    changed = {}
+    for _ in range(max(0, max_moves)):
+        load, _ = _loads(plan, members, weights)
+        heavy = max(members, key=lambda m: load[m])
+        light = min(members, key=lambda m: load[m])
+        gap = load[heavy] - load[light]
+        candidates = [pid for pid, rs in plan.items()
+                      if heavy in rs and light not in rs and weights.get(pid, 1.0) < gap]
+        if not candidates:
+            break
+        pid = min(candidates, key=lambda p: abs(gap / 2 - weights.get(p, 1.0)))
+        plan[pid] = [light if m == heavy else m for m in plan[pid]]
+        changed[pid] = plan[pid]
+    return changed
+
+
+def leader_elections(replicas: Dict[int, List[str]], leaders: Dict[int, str], isr: Dict[int, List[str]],
+                     alive: Iterable[str], skip: Iterable[int] = ()) -> Dict[int, str]:
+    """New leaders: the first replica (in preferred order) that is alive and in sync,
+    when it differs from the current leader."""
+    alive = set(alive)
+    skip = set(skip)
+    out = {}
+    for pid, rs in replicas.items():
+        if pid in skip:
+            continue
+        in_sync = set(isr.get(pid, rs))
+        for m in rs:
+            if m in alive and m in in_sync:
+                if m != leaders.get(pid):
+                    out[pid] = m
+                break
+    return out
+
+
+def broker_load(replicas: Dict[int, List[str]], leaders: Dict[int, str], members: List[str],
+                traffic: Dict[int, float]) -> Dict[str, Dict]:
+    """Per-broker summary: partitions held and led, and the client traffic they carry."""
+    everyone = list(members) + sorted({m for rs in replicas.values() for m in rs} - set(members))
+    report = {m: {"replicas": 0, "leaders": 0, "preferred_leaders": 0,
+                  "leader_bytes_per_sec": 0.0, "replica_bytes_per_sec": 0.0} for m in everyone}
+    for pid, rs in replicas.items():
+        t = traffic.get(pid, 0.0)
+        for m in rs:
+            report[m]["replicas"] += 1
+            report[m]["replica_bytes_per_sec"] += t
+        if rs:
+            report[rs[0]]["preferred_leaders"] += 1
+        leader = leaders.get(pid)
+        if leader in report:
+            report[leader]["leaders"] += 1
+            report[leader]["leader_bytes_per_sec"] += t
+    return report
@@ -0,0 +1,96 @@
+# -------------------------
+# Idempotent producer state
+# -------------------------
+"""
+Sequence numbers seen per producer on one partition, for deduplicating
+retried publishes.
+
+A record is a duplicate only if its (producer_id, seq) is already in the log:
+sequences may arrive in any order (a producer pipelining requests, or several
+threads sharing one producer id), and a lower sequence number after a higher
+one is a new record. Per producer the seen sequences are kept as a short list
+of merged [lo, hi] ranges, so ordinary in-order publishing costs one range;
+the offsets of the last `window` records are kept as well, so a recent retry
+is answered with the offset of the original append.
+
+At most `max_producers` producers are tracked per partition (least recently
+seen are forgotten), and at most MAX_RANGES ranges per producer (the lowest,
+oldest sequences are forgotten first).
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+MAX_RANGES = 64
+
+
+class _Producer:
+    __slots__ = ("ranges", "recent")
+
+    def __init__(self):
+        self.ranges: List[List[int]] = []  # sorted, disjoint, non-adjacent [lo, hi]
+        self.recent: "OrderedDict[int, int]" = OrderedDict()  # seq -> offset, oldest first
+
+    def _slot(self, seq: int) -> int:
+        """Index of the first range starting after seq."""
+        ranges = self.ranges
+        if not ranges or ranges[-1][0] <= seq:
+            return len(ranges)
+        return bisect_right([r[0] for r in ranges], seq)
+
+    def seen(self, seq: int) -> bool:
+        i = self._slot(seq)
+        return i > 0 and self.ranges[i - 1][1] >= seq
+
+    def add(self, seq: int):
+        ranges = self.ranges
+        i = self._slot(seq)
+        if i > 0 and ranges[i - 1][1] >= seq:
+            return
+        left = i > 0 and ranges[i - 1][1] == seq - 1
+        right = i < len(ranges) and ranges[i][0] == seq + 1
+        if left and right:
+            ranges[i - 1][1] = ranges[i][1]
+            del ranges[i]
+        elif left:
+            ranges[i - 1][1] = seq
+        elif right:
+            ranges[i][0] = seq
+        else:
+            ranges.insert(i, [seq, seq])
+            if len(ranges) > MAX_RANGES:
+                del ranges[0]
+
+
+class ProducerState:
+    def __init__(self, window: int = 5, max_producers: int = 1000):
+        self.window = max(1, window)
+        self.max_producers = max(1, max_producers)
+        self._producers: "OrderedDict[str, _Producer]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._producers)
+
+    def check(self, producer_id: str, seq: int) -> Tuple[bool, Optional[int]]:
+        """(is_duplicate, original_offset); the offset is None when the record is
+        older than the window and its offset is no longer known."""
+        p = self._producers.get(producer_id)
+        if p is None:
+            return False, None
+        off = p.recent.get(seq)
+        if off is not None:
+            return True, off
+        return p.seen(seq), None
+
+    def record(self, producer_id: str, seq: int, offset: int):
+        p = self._producers.get(producer_id)
+        if p is None:
+            p = self._producers[producer_id] = _Producer()
+            if len(self._producers) > self.max_producers:
+                self._producers.popitem(last=False)
+        else:
+            self._producers.move_to_end(producer_id)
+        p.add(seq)
+        p.recent[seq] = offset
+        if len(p.recent) > self.window:
+            p.recent.popitem(last=False)
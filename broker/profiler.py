@@ -0,0 +1,92 @@
+# -------------------------
+# Sampling profiler and slow-request log
+# -------------------------
+"""
+Opt-in diagnostics for a running broker.
+
+StackSampler polls sys._current_frames() from a background thread and counts
+collapsed stacks ("thread;module:func;module:func N" per line), the input
+format of flamegraph.pl and speedscope. SlowRequestLog keeps the per-stage
+breakdown of requests whose total time exceeds a threshold.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+
+class StackSampler:
+    """Samples the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.01, include_lines: bool = False):
+        self.interval = max(0.001, interval)
+        self.include_lines = include_lines
+        self.samples: Counter = Counter()
+        self.taken = 0
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return f"{label}:{frame.f_lineno}" if self.include_lines else label
+
+    def sample_once(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.samples[";".join(reversed(stack))] += 1
+        self.taken += 1
+
+    def run(self, seconds: float) -> "StackSampler":
+        """Sample for `seconds` (blocking). Call from a worker thread, not the event loop."""
+        deadline = time.perf_counter() + seconds
+        next_t = time.perf_counter()
+        while next_t < deadline:
+            self.sample_once()
+            next_t += self.interval
+            delay = next_t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return self
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
+
+
+class SlowRequestLog:
+    """
+    Records requests slower than `threshold_sec` to an append-only JSONL file
+    and a bounded in-memory buffer. A threshold <= 0 disables the log.
+    """
+
+    def __init__(self, path: str, threshold_sec: float, keep: int = 200):
+        self.path = path
+        self.threshold_sec = threshold_sec
+        self.recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def maybe_record(self, endpoint: str, timer, **fields) -> Optional[Dict]:
+        total = timer.stages.get("total") or timer.elapsed()
+        if self.threshold_sec <= 0 or total < self.threshold_sec:
+            return None
+        entry = {"ts": time.time(), "endpoint": endpoint, "total_ms": round(total * 1000, 3),
+                 "stages_ms": {k: round(v * 1000, 3) for k, v in timer.stages.items()}}
+        entry.update(fields)
+        with self._lock:
+            self.recent.append(entry)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+    def latest(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            return list(self.recent)[-limit:]
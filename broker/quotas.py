@@ -0,0 +1,97 @@
+# -------------------------
+# Per-client quotas
+# -------------------------
+"""
+Token-bucket quotas per client id, in the style of Kafka client quotas.
+
+Every request is charged after the fact: the bucket may go into debt, and the
+time until it is back to zero is returned to the client as `throttle_time_ms`
+so a well-behaved client waits before its next request. A client that keeps
+sending while its debt exceeds `reject_after_ms` is refused with HTTP 429
+(and Retry-After) without doing the work, which bounds the load one client
+can put on a broker without letting requests pile up into timeouts.
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst` tokens. Not synchronised."""
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def charge(self, amount: float, now: float) -> float:
+        """Take amount tokens (possibly going negative); return seconds until the debt is paid."""
+        self._refill(now)
+        self.tokens -= amount
+        return self.debt(now)
+
+    def debt(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class QuotaManager:
+    """
+    Byte-rate quotas for "produce" and "consume" and a request-rate quota
+    shared by both, per client id. A rate of 0 disables that quota.
+    """
+
+    def __init__(self, produce_bytes_per_sec: float = 0, consume_bytes_per_sec: float = 0,
+                 requests_per_sec: float = 0, burst_sec: float = 1.0, reject_after_ms: float = 1000):
+        self.rates = {"produce": produce_bytes_per_sec, "consume": consume_bytes_per_sec,
+                      "requests": requests_per_sec}
+        self.burst_sec = burst_sec
+        self.reject_after_sec = reject_after_ms / 1000.0
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return any(r > 0 for r in self.rates.values())
+
+    def _bucket(self, client_id: str, kind: str, now: float) -> Optional[TokenBucket]:
+        rate = self.rates[kind]
+        if rate <= 0:
+            return None
+        b = self._buckets.get((client_id, kind))
+        if b is None:
+            b = self._buckets[(client_id, kind)] = TokenBucket(rate, rate * self.burst_sec, now)
+        return b
+
+    def check(self, client_id: str, kind: str) -> float:
+        """Milliseconds the client still owes for `kind` and its request rate; > 0 means throttled."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            debts = [b.debt(now) for b in (self._bucket(client_id, kind, now),
+                                           self._bucket(client_id, "requests", now)) if b is not None]
+        return max(debts, default=0.0) * 1000.0
+
+    def should_reject(self, throttle_ms: float) -> bool:
+        return throttle_ms > self.reject_after_sec * 1000.0
+
+    def record(self, client_id: str, kind: str, nbytes: int) -> float:
+        """Charge one request of nbytes; returns the throttle time in milliseconds."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            debts = []
+            b = self._bucket(client_id, kind, now)
+            if b is not None:
+                debts.append(b.charge(nbytes, now))
+            b = self._bucket(client_id, "requests", now)
+            if b is not None:
+                debts.append(b.charge(1, now))
+        return max(debts, default=0.0) * 1000.0
@@ -43,7 +43,9 @@ def main():
     os.environ["BROKER_PORT"] = str(port)
     os.environ["BROKER_CLUSTER"] = ",".join(cluster_ports)
 
-    uvicorn.run("broker.broker:app", host="0.0.0.0", port=port, reload=False)
+    # a broker behind a proxy (utils/netproxy.py) keeps its advertised port but listens elsewhere
+    listen_port = int(os.environ.get("BROKER_LISTEN_PORT", port))
+    uvicorn.run("broker.broker:app_from_env", factory=True, host="0.0.0.0", port=listen_port, reload=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,180 @@
+# -------------------------
+# Broker metrics in Prometheus text format
+# -------------------------
+"""
+Minimal Prometheus-style metrics for the broker: counters, fixed-bucket
+histograms and callback gauges, rendered by `/metrics` in the text exposition
+format. Recording is a dict lookup, a bisect and a couple of additions under
+a per-metric lock, cheap enough to leave on for every request.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# seconds; spans sub-millisecond lock waits up to replication timeouts
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        key = tuple(str(l) for l in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, v in sorted(items):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(v)}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, List] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        key = tuple(str(l) for l in labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self._series[key] = s
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for labels, s in sorted(items):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-2]):
+                cumulative += n
+                le = f'le="{_fmt_value(bound)}"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {_fmt_value(s[-2])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {s[-1]}")
+        return out
+
+
+class CallbackGauge:
+    """Gauge whose samples are computed when /metrics is scraped."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str],
+                 fn: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        self.name, self.help, self.labelnames, self.fn = name, help, tuple(labelnames), fn
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, v in self.fn():
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(v)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        m = Counter(name, help, labelnames)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(m)
+        return m
+
+    def gauge(self, name, help, labelnames, fn) -> CallbackGauge:
+        m = CallbackGauge(name, help, labelnames, fn)
+        self.metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """Times the stages of one request into a histogram labelled by stage.
+    The per-request breakdown is kept in `stages` for the slow-request log."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t)
+
+    def record(self, name: str, seconds: float):
+        self.histogram.observe(seconds, name)
+        self.note(name, seconds)
+
+    def note(self, name: str, seconds: float):
+        """Add to this request's breakdown without touching the histogram."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def finish(self):
+        self.record("total", self.elapsed())
+
+
+class _NullTimer:
+    @contextmanager
+    def stage(self, name: str):
+        yield
+
+    def record(self, name: str, seconds: float):
+        pass
+
+    def note(self, name: str, seconds: float):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_TIMER = _NullTimer()
@@ -0,0 +1,180 @@
+# -------------------------
+# Tiered storage: closed segments in a remote object store
+# -------------------------
+"""
+Closed segments are uploaded to a RemoteStore and then evicted from the
+broker's disk and memory (PartitionLog.evict), leaving a small `.remote`
+marker and the segment's index files locally. Reads of offloaded offsets go
+through a byte-bounded LRU cache of parsed segments.
+
+DirectoryObjectStore stands in for an object store (S3, GCS, ...) in tests and
+single-machine setups; anything implementing RemoteStore can replace it.
+"""
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from broker.keyindex import KeyIndex
+from broker.log import PartitionLog, Segment, parse_lines, read_bounds
+
+
+class RemoteStore:
+    """Minimal object-store interface: immutable named blobs."""
+
+    def put_file(self, name: str, path: str):
+        raise NotImplementedError
+
+    def get(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, name: str):
+        raise NotImplementedError
+
+
+class DirectoryObjectStore(RemoteStore):
+    """Objects are files under `root`; names may contain '/'."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"object name escapes the store: {name}")
+        return path
+
+    def put_file(self, name: str, path: str):
+        dest = self._path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + ".tmp"
+        shutil.copyfile(path, tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+
+    def get(self, name: str) -> bytes:
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def delete(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+class SegmentCache:
+    """LRU of parsed remote segments, bounded by their serialized size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[List[Dict], object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, name: str, records: List[Dict], sizes, nbytes: int):
+        with self._lock:
+            if name in self._entries or nbytes > self.max_bytes:
+                return
+            self._entries[name] = (records, sizes, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, _, n) = self._entries.popitem(last=False)
+                self.bytes -= n
+                self.evictions += 1
+
+
+class TieredStorage:
+    """
+    Offloads closed segments of PartitionLogs to `store` under `namespace`
+    (one namespace per broker, since every replica keeps its own copy), keeping
+    the newest `retain_local_segments` closed segments on local disk.
+    """
+
+    def __init__(self, store: RemoteStore, namespace: str, cache_bytes: int = 64 * 1024 * 1024,
+                 retain_local_segments: int = 1):
+        self.store = store
+        self.namespace = namespace
+        self.cache = SegmentCache(cache_bytes)
+        self.retain_local_segments = max(0, retain_local_segments)
+        self.offloaded = 0
+
+    def attach(self, log: PartitionLog):
+        log.remote_reader = lambda seg: self.read_segment(seg)[0]
+
+    def object_name(self, log: PartitionLog, seg: Segment) -> str:
+        return f"{self.namespace}/{os.path.basename(log.directory)}/{os.path.basename(seg.path)}"
+
+    def _candidates(self, log: PartitionLog) -> List[Segment]:
+        closed = [seg for seg in log.segments if seg.closed and not seg.remote]
+        return closed[:max(0, len(closed) - self.retain_local_segments)]
+
+    def offload(self, log: PartitionLog, lock: threading.Lock) -> int:
+        """Upload and evict eligible segments, oldest first. Returns how many were offloaded."""
+        with lock:
+            candidates = [(seg, seg.end_offset, seg.size) for seg in self._candidates(log)]
+        done = 0
+        for seg, end, size in candidates:
+            name = self.object_name(log, seg)
+            # closed segments are immutable, so the upload runs without the partition lock
+            uploaded = [name]
+            self.store.put_file(name, seg.path)
+            for path in (seg.index_path, KeyIndex.path_for(seg.path)):
+                if os.path.exists(path):
+                    uploaded.append(name.rsplit(".", 1)[0] + os.path.splitext(path)[1])
+                    self.store.put_file(uploaded[-1], path)
+            with lock:
+                # a truncate in the meantime reloads the log (new Segment objects) and may
+                # have rewritten this one: evict only the segment that was uploaded
+                current = next((s for s in log.segments if s.base_offset == seg.base_offset), None)
+                stale = (current is None or not current.closed or current.remote
+                         or (current.end_offset, current.size) != (end, size))
+                if not stale:
+                    log.evict(current, name)
+            if stale:
+                for obj in uploaded:
+                    self.store.delete(obj)
+                break
+            done += 1
+        self.offloaded += done
+        return done
+
+    def read_segment(self, seg: Segment):
+        """(records, size prefix sums) of a remote segment, through the LRU cache."""
+        cached = self.cache.get(seg.remote_object)
+        if cached is not None:
+            return cached
+        data = self.store.get(seg.remote_object).decode("utf-8")
+        records, sizes = parse_lines(data.splitlines(keepends=True))
+        self.cache.put(seg.remote_object, records, sizes, len(data))
+        return records, sizes
+
+    def read(self, seg: Segment, offset: int, max_records: Optional[int] = None,
+             max_bytes: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Records of a remote segment from offset, and their serialized size in bytes."""
+        records, sizes = self.read_segment(seg)
+        lo = min(max(offset - seg.base_offset, 0), len(records))
+        hi = read_bounds(sizes, lo, max_records, max_bytes)
+        return records[lo:hi], sizes[hi] - sizes[lo]
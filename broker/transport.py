@@ -0,0 +1,96 @@
+# -------------------------
+# Broker-to-broker calls over HTTP or in memory
+# -------------------------
+"""
+Everything a broker asks its peers (replicate pushes, catch-up fetches,
+high-water marks, cluster state, controller mutations, health and load) goes
+through a transport, addressed by the peer's base URL and the route path.
+
+- HttpTransport: requests against the peer's FastAPI app, one keep-alive
+  session per thread.
+- InMemoryTransport: calls the peer Broker object registered under that URL
+  directly (Broker.handle), for brokers living in the same process. Payloads
+  and responses are copied through JSON, so brokers never share record
+  objects and see exactly the types they would get over HTTP.
+
+Both raise TransportError for an unreachable peer and for error responses,
+with the HTTP status when there is one.
+"""
+import json
+import threading
+from typing import Dict, Optional
+
+import requests
+from fastapi import HTTPException
+
+
+class TransportError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpTransport:
+    def __init__(self):
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method: str, url: str, path: str, params: Optional[Dict] = None,
+                body: Optional[Dict] = None, timeout: float = 1.0) -> Dict:
+        try:
+            r = self._session().request(method, f"{url}{path}", params=params, json=body, timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        except requests.exceptions.HTTPError as e:
+            raise TransportError(str(e), e.response.status_code) from e
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise TransportError(str(e)) from e
+
+    def get(self, url: str, path: str, params: Optional[Dict] = None, timeout: float = 1.0) -> Dict:
+        return self.request("GET", url, path, params=params, timeout=timeout)
+
+    def post(self, url: str, path: str, body: Dict, timeout: float = 1.0) -> Dict:
+        return self.request("POST", url, path, body=body, timeout=timeout)
+
+
+def _copy(obj):
+    return json.loads(json.dumps(obj))
+
+
+class InMemoryTransport:
+    """Routes calls to brokers of this process; a URL without a registered
+    (running) broker behaves like a refused connection."""
+
+    def __init__(self):
+        self.brokers: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, broker):
+        with self._lock:
+            self.brokers[broker.base_url] = broker
+
+    def unregister(self, url: str):
+        with self._lock:
+            self.brokers.pop(url, None)
+
+    def request(self, method: str, url: str, path: str, params: Optional[Dict] = None,
+                body: Optional[Dict] = None, timeout: float = 1.0) -> Dict:
+        broker = self.brokers.get(url)
+        if broker is None:
+            raise TransportError(f"{url}: connection refused")
+        payload = _copy(body if method == "POST" else params or {})
+        try:
+            return _copy(broker.handle(method, path, payload))
+        except HTTPException as e:
+            raise TransportError(f"{e.status_code} {e.detail} for {url}{path}", e.status_code) from e
+
+    def get(self, url: str, path: str, params: Optional[Dict] = None, timeout: float = 1.0) -> Dict:
+        return self.request("GET", url, path, params=params, timeout=timeout)
+
+    def post(self, url: str, path: str, body: Dict, timeout: float = 1.0) -> Dict:
+        return self.request("POST", url, path, body=body, timeout=timeout)
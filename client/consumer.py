@@ -2,7 +2,14 @@
 # Author: Jeevan Reji (modified)
 # Date: 2025-08-28
 # -------------------------
-import requests, sys, time
+import requests, sys, time, os, random, uuid
+
+try:
+    from client.replica_selector import ReplicaSelector, read_replicas
+    from client.throttle import throttle_hint
+except ImportError:  # run as a script: python client/consumer.py
+    from replica_selector import ReplicaSelector, read_replicas
+    from throttle import throttle_hint
 
 BOOTSTRAP_BROKERS = [
     "http://localhost:8000",
@@ -10,6 +17,13 @@ BOOTSTRAP_BROKERS = [
     "http://localhost:8002",
 ]
 
+# Quotas are enforced per client id; the consumer waits out throttle hints.
+CLIENT_ID = os.environ.get("CLIENT_ID", f"consumer-{uuid.uuid4().hex[:8]}")
+BACKOFF_MAX_SEC = 5.0
+
+# reads go to the closest / least busy in-sync replica; offsets are committed to the leader
+selector = ReplicaSelector()
+
 def get_metadata():
     for b in BOOTSTRAP_BROKERS:
         try:
@@ -20,24 +34,44 @@ def get_metadata():
             continue
     raise RuntimeError("No brokers available to fetch metadata from")
 
-def consume(partition: int, group_id: str, poll_interval: float = 0.5):
+def offset_for_time(leader: str, partition: int, ts: float) -> int:
+    """First offset at or after event time ts (the log end if nothing is that recent)."""
+    r = requests.get(f"{leader}/offsets_for_time", params={"partition": partition, "timestamp": ts}, timeout=1.0)
+    r.raise_for_status()
+    return int(r.json()["offset"])
+
+def consume(partition: int, group_id: str, poll_interval: float = 0.5, start_time: float = None):
     md = get_metadata()
     offset = 0
     try:
-        # read committed offset if any
         leader_for_partition = md["leaders"][str(partition)]
-        r = requests.get(f"{leader_for_partition}/offset", params={"group_id": group_id, "partition": partition}, timeout=1.0)
-        if r.ok:
-            offset = int(r.json().get("offset", 0))
+        if start_time is not None:
+            # replay from a point in time instead of the committed offset
+            offset = offset_for_time(leader_for_partition, partition, start_time)
+        else:
+            # read committed offset if any
+            r = requests.get(f"{leader_for_partition}/offset", params={"group_id": group_id, "partition": partition}, timeout=1.0)
+            if r.ok:
+                offset = int(r.json().get("offset", 0))
     except Exception:
         offset = 0
 
     print(f"Starting consumer for partition {partition} from offset {offset}")
+    failures = 0
     while True:
+        wait = poll_interval
         try:
             md = get_metadata()
             leader = md["leaders"][str(partition)]
-            r = requests.get(f"{leader}/consume", params={"partition": partition, "offset": offset}, timeout=1.0)
+            replica = selector.choose(read_replicas(md, partition))
+            with selector.request(replica):
+                r = requests.get(f"{replica}/consume", params={"partition": partition, "offset": offset},
+                                 headers={"X-Client-Id": CLIENT_ID}, timeout=1.0)
+            if r.status_code == 429:
+                hint = throttle_hint(r) / 1000.0
+                print(f"[consumer] Throttled by {replica}, waiting {hint:.1f}s")
+                time.sleep(hint * random.uniform(1.0, 1.2))
+                continue
             r.raise_for_status()
             data = r.json()
             msgs = data.get("messages", [])
@@ -50,14 +84,24 @@ def consume(partition: int, group_id: str, poll_interval: float = 0.5):
             except Exception:
                 pass
             offset = next_offset
+            failures = 0
+            # a capped response with more behind it is followed up at once, unless the
+            # broker asked this client to wait (throttle_time_ms) before its next request
+            throttle = data.get("throttle_time_ms", 0) / 1000.0
+            pending = next_offset < data.get("end_offset", next_offset)
+            wait = throttle if pending else max(poll_interval, throttle)
         except Exception as e:
-            print(f"[consumer] Error: {e}. Retrying...")
-        time.sleep(poll_interval)
+            failures += 1
+            # back off with jitter so many consumers do not retry in lockstep
+            wait = min(BACKOFF_MAX_SEC, poll_interval * (2 ** failures)) * random.uniform(0.5, 1.0)
+            print(f"[consumer] Error: {e}. Retrying in {wait:.1f}s...")
+        time.sleep(wait)
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python consumer.py <partition> <group_id>")
+        print("Usage: python consumer.py <partition> <group_id> [start_time_epoch_sec]")
         sys.exit(1)
     partition = int(sys.argv[1])
     group_id = sys.argv[2]
-    consume(partition, group_id)
+    start_time = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    consume(partition, group_id, start_time=start_time)
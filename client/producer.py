@@ -2,7 +2,13 @@
 # Author: Jeevan Reji (modified)
 # Date: 2025-08-28
 # -------------------------
-import requests, sys, json, hashlib, time
+import requests, sys, json, hashlib, time, uuid, threading, random, os
+from collections import defaultdict
+
+try:
+    from client.throttle import throttle_hint
+except ImportError:  # run as a script: python client/producer.py
+    from throttle import throttle_hint
 
 BOOTSTRAP_BROKERS = [
     "http://localhost:8000",
@@ -11,6 +17,25 @@ BOOTSTRAP_BROKERS = [
     "http://localhost:8003",
 ]
 
+# Idempotence: every record carries this producer's id and a per-partition
+# sequence number. The sequence is assigned once per record, so retrying the
+# same payload against other replicas cannot append it twice.
+PRODUCER_ID = uuid.uuid4().hex
+_seq_lock = threading.Lock()
+_next_seq = defaultdict(int)
+
+# Quotas are enforced per client id; throttled requests are retried with backoff.
+CLIENT_ID = os.environ.get("CLIENT_ID", f"producer-{PRODUCER_ID[:8]}")
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SEC = 0.05
+BACKOFF_MAX_SEC = 2.0
+
+def next_sequence(partition: int) -> int:
+    with _seq_lock:
+        seq = _next_seq[partition]
+        _next_seq[partition] += 1
+        return seq
+
 def get_metadata():
     """Fetch cluster metadata from any available broker"""
     for b in BOOTSTRAP_BROKERS:
@@ -22,39 +47,50 @@ def get_metadata():
             continue
     raise RuntimeError("No available brokers to fetch metadata from")
 
+def backoff_delay(attempt: int, hint_ms: float = 0.0) -> float:
+    """Exponential backoff with jitter, never shorter than the broker's throttle hint."""
+    delay = max(hint_ms / 1000.0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)))
+    return delay * random.uniform(1.0, 1.5)
+
+def partition_for(key: str, num_partitions: int) -> int:
+    return int(hashlib.sha256(key.encode()).hexdigest(), 16) % num_partitions
+
 def produce(key: str, value: str):
-    partition = int(hashlib.sha256(key.encode()).hexdigest(), 16) % 3
     md = get_metadata()
+    partition = partition_for(key, md.get("num_partitions") or len(md["partitions"]))
     leader_url = md["leaders"][str(partition)]
+    replicas = md["partitions"][str(partition)]
 
-    payload = {"key": key, "value": value, "partition": partition, "ts": time.time()}
-    try:
-        r = requests.post(f"{leader_url}/publish", json=payload, timeout=1.0)
-        r.raise_for_status()
-        data = r.json()
-        if data.get("status") == "ok":
-            print("Produced to leader:", leader_url, "offset=", data.get("offset"))
-            return True
-        if data.get("status") == "redirect":
-            leader_url = data.get("leader")
-    except Exception:
-        pass
-
-
-    for url in md["partitions"][str(partition)]:
+    payload = {"key": key, "value": value, "partition": partition, "ts": time.time(),
+               "producer_id": PRODUCER_ID, "seq": next_sequence(partition)}
+    headers = {"X-Client-Id": CLIENT_ID}
+    # the leader first, then the other replicas; the same payload (producer_id, seq)
+    # is retried throughout, so a retry that reaches an earlier append is deduplicated
+    url = leader_url
+    for attempt in range(MAX_ATTEMPTS):
         try:
-            r = requests.post(f"{url}/publish", json=payload, timeout=1.0)
+            r = requests.post(f"{url}/publish", json=payload, headers=headers, timeout=1.0)
+            if r.status_code == 429:
+                delay = backoff_delay(attempt, throttle_hint(r))
+                print(f"Throttled by {url}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
             r.raise_for_status()
             data = r.json()
             if data.get("status") == "ok":
-                print("Produced to:", url, "offset=", data.get("offset"))
+                print("Produced to:", url, "offset=", data.get("offset"),
+                      "(duplicate)" if data.get("duplicate") else "")
+                # over quota: hold off before the next request, as the broker asked
+                if data.get("throttle_time_ms"):
+                    time.sleep(data["throttle_time_ms"] / 1000.0)
                 return True
-            if data.get("status") == "redirect":
-                leader_url = data.get("leader")
-
+            if data.get("status") == "redirect" and data.get("leader"):
+                url = data["leader"]
                 continue
         except Exception:
-            continue
+            pass
+        url = replicas[(replicas.index(url) + 1) % len(replicas)] if url in replicas else leader_url
+        time.sleep(backoff_delay(attempt))
 
     print("Failed to produce message: all replicas unreachable")
     return False
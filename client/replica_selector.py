@@ -0,0 +1,73 @@
+# -------------------------
+# Replica selection for reads
+# -------------------------
+"""
+Any in-sync replica serves /consume up to the partition's high-water mark, so
+readers can spread over the replicas instead of all hitting the leader.
+
+ReplicaSelector keeps, per broker, an EWMA of /consume latency and the number
+of requests this process has in flight to it, and picks the replica with the
+lowest latency x (in flight + 1): nearby brokers are preferred until they get
+busy. Replicas never tried yet go first, failures count as a slow response,
+and a small share of requests goes to a random replica so that estimates of
+brokers out of favour are refreshed. Safe to share between threads.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+def read_replicas(metadata: Dict, partition: int) -> List[str]:
+    """Replicas a consumer may read from: the in-sync replicas, leader first."""
+    pid = str(partition)
+    leader = metadata["leaders"][pid]
+    isr = metadata.get("isr", {}).get(pid) or metadata["partitions"].get(pid) or [leader]
+    return [leader] + [u for u in isr if u != leader]
+
+
+class ReplicaSelector:
+    def __init__(self, alpha: float = 0.3, failure_penalty_sec: float = 2.0, explore: float = 0.05):
+        self.alpha = alpha
+        self.failure_penalty_sec = failure_penalty_sec
+        self.explore = explore
+        self.latency: Dict[str, float] = {}
+        self.in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def choose(self, replicas: List[str]) -> str:
+        if len(replicas) == 1:
+            return replicas[0]
+        with self._lock:
+            untried = [u for u in replicas if u not in self.latency]
+            if untried:
+                return untried[0]
+            if random.random() < self.explore:
+                return random.choice(replicas)
+            return min(replicas, key=lambda u: self.latency[u] * (self.in_flight.get(u, 0) + 1))
+
+    def record(self, url: str, seconds: float):
+        with self._lock:
+            prev = self.latency.get(url)
+            self.latency[url] = seconds if prev is None else prev + self.alpha * (seconds - prev)
+
+    def failed(self, url: str):
+        self.record(url, self.failure_penalty_sec)
+
+    @contextmanager
+    def request(self, url: str):
+        """Wrap one request to url: counts it in flight and records its latency (or failure)."""
+        with self._lock:
+            self.in_flight[url] = self.in_flight.get(url, 0) + 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.failed(url)
+            raise
+        else:
+            self.record(url, time.perf_counter() - t0)
+        finally:
+            with self._lock:
+                self.in_flight[url] -= 1
@@ -0,0 +1,18 @@
+# -------------------------
+# Broker throttle hints
+# -------------------------
+"""
+Brokers enforce quotas per client id. A request over quota is answered with
+429 and a throttle_time_ms body (plus a Retry-After header rounded up to whole
+seconds); a request that was served but pushed the client over its quota
+carries throttle_time_ms in a normal 200 body. Clients wait that long before
+their next request to the broker.
+"""
+
+
+def throttle_hint(resp) -> float:
+    """Throttle time in ms from a 429 response (body, or the Retry-After header)."""
+    try:
+        return float(resp.json().get("throttle_time_ms", 0))
+    except ValueError:
+        return float(resp.headers.get("Retry-After", 1)) * 1000.0
@@ -9,6 +9,7 @@ import os, time, json, threading, requests
 from utils.metrics import Metrics
 from utils.load_generator import HttpLoadGenerator
 from utils.fault_injector import FaultInjector
+from client.replica_selector import ReplicaSelector, read_replicas
 
 HERE = os.path.dirname(__file__)
 METADATA = os.path.join(HERE, "broker", "metadata.json")
@@ -20,10 +21,9 @@ TARGET_RPS = float(os.environ.get("TARGET_RPS", 100))
 
 metrics = Metrics()
 
-def current_leader() -> str:
+def load_metadata() -> dict:
     with open(METADATA, "r") as f:
-        md = json.load(f)
-    return md["leaders"][str(PARTITION)]
+        return json.load(f)
 
 def get_offset(broker_url: str, group_id: str, partition: int) -> int:
     try:
@@ -55,17 +55,22 @@ def _loglen(broker_url: str, partition: int) -> int:
 
 def consumer_worker(stop_evt: threading.Event):
     offset = 0
+    # reads are spread over the in-sync replicas; offsets live on the leader
+    selector = ReplicaSelector()
     while not stop_evt.is_set():
-        leader = current_leader()
+        md = load_metadata()
+        leader = md["leaders"][str(PARTITION)]
         if offset == 0:
             offset = get_offset(leader, GROUP_ID, PARTITION)
             if START_FROM_TAIL and offset == 0:
                 offset = _loglen(leader, PARTITION)
+        replica = selector.choose(read_replicas(md, PARTITION))
         try:
-            resp = requests.get(f"{leader}/consume",
-                                params={"partition": PARTITION, "offset": offset},
-                                timeout=1.0)
-            resp.raise_for_status()
+            with selector.request(replica):
+                resp = requests.get(f"{replica}/consume",
+                                    params={"partition": PARTITION, "offset": offset},
+                                    timeout=1.0)
+                resp.raise_for_status()
             msgs = resp.json().get("messages", [])
             for m in msgs:
                 client_ts = m.get("client_ts") or m.get("timestamp")
@@ -150,7 +155,10 @@ def main():
           f"e2e_avg={None if s['consume']['latency']['avg'] is None else round(s['consume']['latency']['avg']*1000,1)} ms "
           f"p95={None if s['consume']['latency']['p95'] is None else round(s['consume']['latency']['p95']*1000,1)} ms")
 
-    print("\nTip: Fault schedule killed leader at ~10s and follower at ~20s, each for 5s downtime.")
+    print("\nFault timeline (seconds since start):")
+    for e in injector.events:
+        extra = {k: v for k, v in e.items() if k not in ("t", "fault", "port")}
+        print(f"  {e['t'] - t0:6.2f}s  {e['fault']:<10} {e['port']}  {extra if extra else ''}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,38 @@
+"""Benchmark results: storage, regression comparison and `python -m bench compare`."""
+from bench.__main__ import main
+from bench.results import baseline_path, compare, load_result, save_baseline, save_result
+
+
+def result(**metrics):
+    return {"scenario": "smoke", "started_at": 1700000000.0, "metrics": metrics}
+
+
+def test_compare_flags_regressions():
+    baseline = result(publish_rps=1000, publish_p99_ms=10.0, publish_p50_ms=2.0, note="x")
+    current = result(publish_rps=850, publish_p99_ms=11.0, publish_p50_ms=4.0, note="y", extra_rps=5)
+    rows = {r["metric"]: r for r in compare(current, baseline)}
+    assert set(rows) == {"publish_rps", "publish_p99_ms", "publish_p50_ms"}
+    assert rows["publish_rps"]["regression"] and abs(rows["publish_rps"]["change"] + 0.15) < 1e-9
+    assert not rows["publish_p99_ms"]["regression"]  # +10% is within the 20% tolerance
+    assert not rows["publish_p50_ms"]["regression"]  # only tail latency is checked
+    assert not any(r["regression"] for r in compare(current, baseline, throughput_tolerance=0.2))
+
+
+def test_save_and_load(tmp_path):
+    path = save_result(result(publish_rps=1.0), str(tmp_path / "runs"))
+    stored = load_result(path)
+    assert stored["metrics"] == {"publish_rps": 1.0} and "host" in stored and "git_commit" in stored
+    base = save_baseline(stored, str(tmp_path / "baseline"))
+    assert base == baseline_path("smoke", str(tmp_path / "baseline"))
+
+
+def test_compare_command(tmp_path, capsys):
+    runs, base_dir = tmp_path / "runs", tmp_path / "baseline"
+    current = save_result(result(publish_rps=800), str(runs))
+    missing = str(base_dir / "smoke.json")
+    assert main(["compare", current, missing]) == 2
+    assert "no baseline" in capsys.readouterr().out
+
+    base = save_baseline(result(publish_rps=1000), str(base_dir))
+    assert main(["compare", current, base]) == 1
+    assert main(["compare", current, base, "--throughput-tolerance", "0.25"]) == 0
@@ -0,0 +1,75 @@
+"""Checkpointer: full + delta chains restore the job they were written from."""
+import json
+
+from analytics.aggregations import Count, CountByKey
+from analytics.checkpoint import Checkpointer
+from analytics.stream_analytics import StreamJob
+from analytics.windows import SlidingWindow, WatermarkTracker
+
+
+def new_job():
+    return StreamJob(SlidingWindow(10, 5, [Count(), CountByKey()]), WatermarkTracker(allowed_lateness=1))
+
+
+def msgs(start, n):
+    return [{"key": f"k{i % 3}", "value": i, "timestamp": float(i)} for i in range(start, start + n)]
+
+
+def normalized(job):
+    return json.loads(json.dumps(job.state(), sort_keys=True))
+
+
+def run(path, batches, full_every=10):
+    job, ckpt = new_job(), Checkpointer(path, full_every=full_every)
+    offset = 0
+    for start, n in batches:
+        offset += n
+        job.process(0, msgs(start, n), offset)
+        job.advance()
+        ckpt.write(job)
+    return job, ckpt
+
+
+def test_full_and_delta_round_trip(tmp_path):
+    path = str(tmp_path / "ckpt.json")
+    job, ckpt = run(path, [(0, 8), (8, 8), (16, 8), (24, 8)])
+    assert len(ckpt._delta_files()) == 3
+
+    restored, fresh = new_job(), Checkpointer(path)
+    assert fresh.restore(restored)
+    assert fresh.seq == ckpt.seq
+    assert normalized(restored) == normalized(job)
+    assert restored.offsets == {0: 32}
+
+
+def test_full_snapshot_replaces_deltas(tmp_path):
+    path = str(tmp_path / "ckpt.json")
+    job, ckpt = run(path, [(0, 5), (5, 5), (10, 5)], full_every=2)
+    assert ckpt.base_seq == 3 and ckpt._delta_files() == []
+    restored = new_job()
+    assert Checkpointer(path).restore(restored)
+    assert normalized(restored) == normalized(job)
+
+
+def test_recovery_stops_at_corrupt_delta(tmp_path):
+    path = str(tmp_path / "ckpt.json")
+    job, ckpt = run(path, [(0, 8), (8, 8)])
+    expected = normalized(job)
+    job.process(0, msgs(16, 8), 24)
+    ckpt.write(job)
+    # the newest delta no longer matches its checksum
+    bad = ckpt._delta_files()[-1]
+    with open(bad) as f:
+        doc = json.load(f)
+    doc["payload"]["offsets"]["0"] = 999
+    with open(bad, "w") as f:
+        json.dump(doc, f)
+
+    restored, fresh = new_job(), Checkpointer(path)
+    assert fresh.restore(restored)
+    assert normalized(restored) == expected
+    assert bad not in fresh._delta_files()
+
+
+def test_no_checkpoint(tmp_path):
+    assert not Checkpointer(str(tmp_path / "missing.json")).restore(new_job())
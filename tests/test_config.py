@@ -0,0 +1,23 @@
+"""BrokerConfig.from_env: prefixed names for generic settings, typed values, defaults."""
+import pytest
+
+from broker.broker import BrokerConfig
+
+
+def test_from_env():
+    config = BrokerConfig.from_env({
+        "BROKER_PORT": "8100", "BROKER_CLUSTER": "8100,8101", "BROKER_HOST": "broker-a",
+        "BROKER_DATA_DIR": "/var/lib/pubg1", "NUM_PARTITIONS": "6", "QUOTA_BURST_SEC": "2.5",
+        "BROKER_ADMIN": "true",
+        # generic names of other programs are not picked up
+        "HOST": "elsewhere", "DATA_DIR": "/tmp/other",
+    })
+    assert (config.port, config.cluster_ports) == (8100, [8100, 8101])
+    assert config.base_url == "http://broker-a:8100" and config.log_dir == "/var/lib/pubg1"
+    assert config.num_partitions == 6 and config.quota_burst_sec == 2.5 and config.admin
+    assert config.replication_factor == BrokerConfig(port=1).replication_factor
+
+
+def test_from_env_needs_a_port():
+    with pytest.raises(RuntimeError):
+        BrokerConfig.from_env({"HOST": "localhost"})
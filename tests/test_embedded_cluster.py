@@ -0,0 +1,158 @@
+"""
+Replication, deduplication and tiering behaviour on an in-process cluster
+(bench.embedded.EmbeddedCluster, InMemoryTransport).
+"""
+import threading
+import time
+
+import pytest
+
+from bench.embedded import EmbeddedCluster
+
+FAST = {"cluster_sync_sec": 0.2, "rebalance_interval_sec": 0.2, "failover_after_sec": 0.5,
+        "replica_fetch_bytes_per_sec": 0}
+
+
+def wait_for(cond, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return cond()
+
+
+@pytest.fixture
+def make_cluster(tmp_path):
+    clusters = []
+
+    def make(ports, **kwargs):
+        cluster = EmbeddedCluster(ports=ports, data_dir=str(tmp_path), **kwargs)
+        clusters.append(cluster)
+        return cluster.start()
+
+    yield make
+    for cluster in clusters:
+        cluster.stop()
+
+
+def test_out_of_order_sequences_are_stored(make_cluster):
+    cluster = make_cluster((9201,), replication_factor=1, config=FAST)
+    first = cluster.publish(0, [{"key": "k", "value": 1, "producer_id": "p", "seq": 1}])
+    late = cluster.publish(0, [{"key": "k", "value": 0, "producer_id": "p", "seq": 0}])
+    assert first["offsets"] == [0] and late["offsets"] == [1]
+    assert first["duplicates"] == late["duplicates"] == 0
+
+    retry = cluster.publish(0, [{"key": "k", "value": 0, "producer_id": "p", "seq": 0},
+                                {"key": "k", "value": 2, "producer_id": "p", "seq": 2}])
+    assert retry["offsets"] == [1, 2] and retry["duplicates"] == 1
+    values = [m["value"] for m in cluster.consume(0, 0)["messages"]]
+    assert values == [1, 0, 2]
+
+
+def test_offsets_for_time_reaches_offloaded_segments(make_cluster, tmp_path):
+    config = {"log_segment_bytes": 400, "time_index_interval_bytes": 200, "key_index": True,
+              "tiered_storage_dir": str(tmp_path / "remote"), "tier_interval_sec": 3600}
+    cluster = make_cluster((9221,), replication_factor=1, config=config)
+    for i in range(40):  # segments roll between appends
+        cluster.publish(0, [{"key": f"k{i % 3}", "value": "x" * 20, "timestamp": 1000.0 + i}])
+    broker = cluster.brokers[9221]
+    log = broker.partitions[0]
+    assert broker.tiered.offload(log, broker.locks[0]) > 0
+    assert log.first_offset == 0 < log.start_offset
+
+    for ts, offset in ((0, 0), (1000.0, 0), (1003.0, 3), (1039.0, 39)):
+        assert broker.offsets_for_time(0, ts)["offset"] == offset
+        assert log.offset_for_time(ts)[0] == offset
+    assert broker.offsets_for_time(0, 2000.0) == {"partition": 0, "offset": 40, "timestamp": None, "found": False}
+
+    oldest = broker.lookup(0, "k0", 20)["records"][-1]
+    assert oldest["offset"] < log.start_offset and oldest["record"]["key"] == "k0"
+    assert cluster.consume(0, 0)["messages"][0]["timestamp"] == 1000.0
+
+
+def test_restarted_controller_adopts_newer_state_and_drops_unreplicated_tail(make_cluster):
+    ports = (9300, 9301, 9302)
+    cluster = make_cluster(ports, num_partitions=3, config=FAST)
+    controller = cluster.brokers[9300]
+    pid = next(p for p in range(3) if cluster.leader(p) == controller.base_url)
+    assert cluster.wait_in_sync(pid)
+    cluster.publish(pid, [{"key": "a", "value": i} for i in range(5)])
+
+    cluster.stop_broker(9300)
+    assert wait_for(lambda: cluster.brokers[9301].cluster.leaders[pid] != controller.base_url)
+    cluster.publish(pid, [{"key": "b", "value": i} for i in range(3)])
+    # a write the old leader took after it was cut off, never replicated
+    controller.append_messages(pid, [{"key": "orphan", "value": 0, "partition": pid}])
+
+    cluster.start_broker(9300)
+
+    def converged():
+        brokers = list(cluster.brokers.values())
+        return (len({b.cluster.epoch for b in brokers}) == 1
+                and len({tuple(sorted(b.cluster.leaders.items())) for b in brokers}) == 1
+                and len({repr(b.partitions[pid].records) for b in brokers}) == 1)
+
+    assert wait_for(converged, 15.0)
+    keys = [m["key"] for m in cluster.brokers[9300].partitions[pid].records]
+    assert keys == ["a"] * 5 + ["b"] * 3
+
+
+def test_follower_never_moves_consumer_back(make_cluster):
+    cluster = make_cluster((9211, 9212), replication_factor=2, config=FAST)
+    assert cluster.wait_in_sync(0)
+    cluster.publish(0, [{"key": "k", "value": i} for i in range(10)])
+    follower = next(b for b in cluster.brokers.values() if b.base_url != cluster.leader(0))
+    follower.stop()  # keep it serving, but with its HWM trailing the leader's
+    follower.high_watermark[0] = 4
+
+    ahead = cluster.consume(0, 7, url=follower.base_url)
+    assert ahead["messages"] == [] and ahead["next_offset"] == 7
+    behind = cluster.consume(0, 2, url=follower.base_url)
+    assert behind["next_offset"] == 4 and len(behind["messages"]) == 2
+
+
+def test_concurrent_publishes_keep_the_isr_full(make_cluster):
+    ports = (9231, 9232, 9233)
+    cluster = make_cluster(ports, config=FAST)
+    assert cluster.wait_in_sync(0)
+    leader = cluster.broker(cluster.leader(0))
+    replicas = set(leader.cluster.replicas[0])
+    shrunk = []
+    deadline = time.time() + 2.0
+
+    def publisher(n):
+        i = 0
+        while time.time() < deadline:
+            cluster.publish(0, [{"key": f"t{n}", "value": i}])
+            if leader.isr_view.get(0) != replicas:
+                shrunk.append(sorted(leader.isr_view.get(0, ())))
+            i += 1
+
+    threads = [threading.Thread(target=publisher, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not shrunk
+    end = leader.partitions[0].end_offset
+    assert end > 100 and leader.high_watermark[0] == end
+    assert all(cluster.brokers[p].partitions[0].records == leader.partitions[0].records for p in ports)
+
+
+def test_larger_num_partitions_on_restart_goes_through_the_controller(make_cluster):
+    ports = (9241, 9242)
+    cluster = make_cluster(ports, num_partitions=1, replication_factor=2, config=FAST)
+    epoch = cluster.brokers[9241].submit_admin({"op": "add_partitions", "count": 2})["epoch"]
+    cluster.stop()
+
+    cluster = make_cluster(ports, num_partitions=3, replication_factor=2, config=FAST)
+
+    def expanded():
+        states = [b.cluster for b in cluster.brokers.values()]
+        return (all(s.num_partitions == 3 for s in states) and len({s.epoch for s in states}) == 1
+                and states[0].epoch > epoch)
+
+    assert wait_for(expanded)
+    assert all(len(b.partitions) == 3 for b in cluster.brokers.values())
+    assert cluster.wait_in_sync(2)
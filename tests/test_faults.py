@@ -0,0 +1,76 @@
+"""Injected faults: FaultState, /admin/faults and the FaultInjector calls that set them."""
+import threading
+import time
+
+import pytest
+import requests
+
+from bench.embedded import EmbeddedCluster
+from broker.faults import FaultState
+from utils.fault_injector import FaultInjector
+
+FAST = {"cluster_sync_sec": 0.2, "rebalance_interval_sec": 0.2, "failover_after_sec": 0.5,
+        "replica_fetch_bytes_per_sec": 0, "admin": True}
+
+
+def test_fault_state_expires_and_clears():
+    faults = FaultState()
+    faults.set(0.2, disk_delay_ms=50, drop_replication=1.0)
+    assert faults.snapshot()["disk_delay_ms"]["value"] == 50
+    assert faults.drop_replication()
+    time.sleep(0.25)
+    assert faults.get("disk_delay_ms") == 0.0 and faults.snapshot() == {}
+    faults.set(drop_replication=0.5)
+    faults.set(drop_replication=0)
+    assert faults.snapshot() == {}
+    with pytest.raises(ValueError):
+        faults.set(cpu_burn=1)
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    with EmbeddedCluster(ports=(9261, 9262), replication_factor=2, data_dir=str(tmp_path),
+                         transport="http", config=FAST) as cluster:
+        assert cluster.wait_in_sync(0)
+        yield cluster
+
+
+def test_slow_disk_does_not_block_other_requests(cluster):
+    leader = cluster.leader(0)
+    port = int(leader.rsplit(":", 1)[-1])
+    injector = FaultInjector([9261, 9262])
+    injector.slow_disk(port, 400, duration=5)
+    faults = requests.get(f"{leader}/admin/faults", timeout=1).json()["faults"]
+    assert faults["disk_delay_ms"]["value"] == 400
+
+    done = []
+    publisher = threading.Thread(target=lambda: done.append(cluster.publish(0, [{"key": "k", "value": 1}])))
+    t0 = time.time()
+    publisher.start()
+    time.sleep(0.1)
+    # the append sleeps in a worker thread; the event loop keeps serving
+    requests.get(f"{leader}/health", timeout=1).raise_for_status()
+    assert time.time() - t0 < 0.3
+    publisher.join()
+    assert time.time() - t0 >= 0.4 and done[0]["status"] == "ok"
+
+    injector.clear_faults(port)
+    assert requests.get(f"{leader}/admin/faults", timeout=1).json() == {"faults": {}}
+    assert [e["fault"] for e in injector.events] == ["slow_disk", "clear_faults"]
+
+
+def test_dropped_replication_takes_follower_out_of_the_isr(cluster):
+    leader = cluster.broker(cluster.leader(0))
+    follower = next(url for url in cluster.urls if url != leader.base_url)
+    injector = FaultInjector([9261, 9262])
+    injector.drop_replication(int(follower.rsplit(":", 1)[-1]), 1.0)
+    cluster.publish(0, [{"key": "k", "value": 1}])
+    assert follower not in leader.isr_view[0]
+
+    injector.clear_faults(int(follower.rsplit(":", 1)[-1]))
+    assert cluster.wait_in_sync(0)
+
+
+def test_admin_faults_rejects_unknown_faults(cluster):
+    r = requests.post(f"{cluster.urls[0]}/admin/faults", json={"cpu_burn": 1}, timeout=1)
+    assert r.status_code == 400
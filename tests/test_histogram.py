@@ -0,0 +1,45 @@
+"""LatencyHistogram: percentiles within bucket precision, and merge/minus round trips."""
+import math
+import random
+
+from utils.histogram import LatencyHistogram
+
+
+def exact_percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * q / 100) - 1)]
+
+
+def test_percentiles_within_bucket_precision():
+    rnd = random.Random(7)
+    values = [rnd.lognormvariate(-6, 1.5) for _ in range(20000)]
+    h = LatencyHistogram()
+    for v in values:
+        h.record(v)
+    assert h.count == len(values)
+    assert h.max == max(values)
+    for q in (50, 90, 99, 99.9):
+        exact = exact_percentile(values, q)
+        assert abs(h.percentile(q) - exact) <= max(exact * 0.02, 2e-6)
+
+
+def test_merge_and_minus_round_trip():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    for i in range(1, 500):
+        a.record(i / 10000.0)
+        b.record(i / 1000.0)
+    merged = a.copy().merge(b)
+    assert merged.count == a.count + b.count
+    assert merged.max == b.max
+
+    since = merged.minus(a)
+    assert since.counts == b.counts
+    assert since.count == b.count
+    assert abs(since.total - b.total) < 1e-9
+    assert since.stats()["p50"] == b.stats()["p50"]
+
+
+def test_empty_histogram():
+    h = LatencyHistogram()
+    assert h.percentile(99) is None
+    assert set(h.stats().values()) == {None}
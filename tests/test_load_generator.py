@@ -0,0 +1,61 @@
+"""HttpLoadGenerator counts sent, failed and throttled publishes per message."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.load_generator import HttpLoadGenerator, RateProfile
+
+
+class StubBroker(BaseHTTPRequestHandler):
+    """Answers /publish with the next status from `replies`, then 200 for the rest."""
+    replies = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        status = self.replies.pop(0) if self.replies else 200
+        body = {"status": "ok"} if status == 200 else {"error": "refused", "throttle_time_ms": 0}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBroker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    md = tmp_path / "metadata.json"
+    md.write_text(json.dumps({"leaders": {"0": f"http://127.0.0.1:{server.server_port}"}}))
+    yield str(md)
+    server.shutdown()
+    StubBroker.replies = []
+
+
+def test_send_batch_counts_messages(broker):
+    StubBroker.replies = [200, 429, 500]
+    lg = HttpLoadGenerator(broker, 0)
+    assert lg.send_batch(5) >= 0
+    assert lg.send_batch(5) == -1.0
+    assert lg.send_batch(5) == -1.0
+    assert (lg.sent, lg.throttled, lg.errors) == (5, 5, 5)
+
+
+def test_run_records_each_message(broker):
+    StubBroker.replies = [500, 429]
+    lg = HttpLoadGenerator(broker, 0, workers=1, batch_size=4)
+    res = lg.run(RateProfile.constant(20, 0.5))
+    pub = lg.metrics.summary()["publish"]
+    # the first batch failed and the second was throttled; neither is an error twice
+    assert (res["errors"], res["throttled"]) == (4, 4)
+    assert res["sent"] == res["offered"] - 8
+    assert pub["errors"] == 4 and pub["count"] == res["sent"]
+    assert lg.service_metrics.summary()["publish"]["errors"] == 4
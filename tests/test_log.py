@@ -0,0 +1,48 @@
+"""PartitionLog: records, time index and key index survive a reopen and a truncation."""
+import json
+
+from broker.log import PartitionLog
+
+
+def append_each(log, msgs):
+    for m in msgs:
+        log.append([m], [json.dumps(m) + "\n"])
+
+
+def records(n, start=0):
+    return [{"key": f"k{i % 2}", "value": i, "timestamp": 100.0 + i} for i in range(start, start + n)]
+
+
+def test_reopen_round_trip(tmp_path):
+    log = PartitionLog(str(tmp_path), segment_bytes=200, index_interval_bytes=100, key_index_depth=5)
+    append_each(log, records(30))
+    assert len(log.segments) > 1
+
+    reopened = PartitionLog(str(tmp_path), segment_bytes=200, index_interval_bytes=100, key_index_depth=5)
+    assert reopened.records == log.records
+    assert reopened.end_offset == 30
+    assert [(s.base_offset, s.end_offset) for s in reopened.segments] == \
+           [(s.base_offset, s.end_offset) for s in log.segments]
+    assert reopened.index_offsets == log.index_offsets
+    assert reopened.offset_for_time(112.5) == (13, 113.0)
+    assert reopened.offset_for_time(500.0) is None
+    assert reopened.key_index.lookup("k1", 3) == [29, 27, 25]
+    msgs, nbytes = reopened.read(28)
+    assert [m["value"] for m in msgs] == [28, 29]
+    assert nbytes == sum(len(json.dumps(m)) + 1 for m in msgs)
+
+
+def test_truncate_round_trip(tmp_path):
+    log = PartitionLog(str(tmp_path), segment_bytes=200, index_interval_bytes=100, key_index_depth=5)
+    append_each(log, records(30))
+    log.truncate(11)
+    assert log.end_offset == 11
+    assert log.offset_for_time(111.0) is None
+    assert log.key_index.lookup("k1", 3) == [9, 7, 5]
+
+    append_each(log, records(2, start=50))
+    reopened = PartitionLog(str(tmp_path), segment_bytes=200, index_interval_bytes=100, key_index_depth=5)
+    assert reopened.records == log.records
+    assert [m["value"] for m in reopened.records[9:]] == [9, 10, 50, 51]
+    assert reopened.offset_for_time(150.0) == (11, 150.0)
+    assert reopened.key_index.lookup("k0", 2) == [11, 10]
@@ -0,0 +1,31 @@
+"""/lookup: latest records per key from the key index, on leader and follower."""
+import pytest
+
+from bench.embedded import EmbeddedCluster
+from broker.transport import TransportError
+
+FAST = {"cluster_sync_sec": 0.2, "rebalance_interval_sec": 0.2, "failover_after_sec": 0.5,
+        "replica_fetch_bytes_per_sec": 0}
+
+
+def test_lookup_newest_first(tmp_path):
+    config = dict(FAST, key_index=True, key_index_depth=3, log_segment_bytes=300)
+    with EmbeddedCluster(ports=(9291, 9292), replication_factor=2, data_dir=str(tmp_path),
+                         config=config) as cluster:
+        assert cluster.wait_in_sync(0)
+        for i in range(20):
+            cluster.publish(0, [{"key": f"user-{i % 4}", "value": i}])
+        for url in cluster.urls:
+            doc = cluster.transport.get(url, "/lookup", params={"partition": 0, "key": "user-1", "n": 5})
+            # at most key_index_depth records, across segment boundaries
+            assert [(r["offset"], r["record"]["value"]) for r in doc["records"]] == [(17, 17), (13, 13), (9, 9)]
+        assert cluster.transport.get(cluster.urls[0], "/lookup",
+                                     params={"partition": 0, "key": "nobody"})["records"] == []
+
+
+def test_lookup_needs_the_key_index(tmp_path):
+    with EmbeddedCluster(ports=(9293,), replication_factor=1, data_dir=str(tmp_path), config=FAST) as cluster:
+        cluster.publish(0, [{"key": "k", "value": 1}])
+        with pytest.raises(TransportError) as err:
+            cluster.transport.get(cluster.urls[0], "/lookup", params={"partition": 0, "key": "k"})
+        assert err.value.status == 400
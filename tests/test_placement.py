@@ -0,0 +1,75 @@
+"""Placement planning: new partitions, preferred leaders, replica moves and elections."""
+from collections import Counter
+
+from broker.placement import (TrafficMeter, leader_elections, leader_imbalance, partition_weights,
+                              place_partition, preferred_order, replica_moves)
+
+A, B, C = "http://a:1", "http://b:2", "http://c:3"
+MEMBERS = [A, B, C]
+
+
+def place_all(n, rf=2, members=MEMBERS):
+    replicas = {}
+    for pid in range(n):
+        replicas[pid] = place_partition(pid, members, rf, replicas)
+    return replicas
+
+
+def test_placement_spreads_replicas_and_leaders():
+    replicas = place_all(6)
+    assert all(len(set(rs)) == 2 for rs in replicas.values())
+    assert Counter(m for rs in replicas.values() for m in rs) == {A: 4, B: 4, C: 4}
+    assert Counter(rs[0] for rs in replicas.values()) == {A: 2, B: 2, C: 2}
+    assert leader_imbalance(replicas, MEMBERS, {}) == 0.0
+    # the replication factor is capped by the number of brokers
+    assert sorted(place_partition(0, MEMBERS, 5, {})) == sorted(MEMBERS)
+
+
+def test_placement_avoids_busy_brokers():
+    current = {0: [A, B], 1: [B, A]}
+    weights = partition_weights(current, {0: 1000.0, 1: 1000.0})
+    assert weights == {0: 2.0, 1: 2.0}
+    assert place_partition(2, MEMBERS, 1, current, weights) == [C]
+
+
+def test_preferred_order_evens_leader_load():
+    replicas = {pid: [A, B, C] for pid in range(3)}
+    changes = preferred_order(replicas, {})
+    assert set(changes) == {1, 2}
+    assert all(sorted(rs) == sorted(MEMBERS) for rs in changes.values())
+    replicas.update(changes)
+    assert leader_imbalance(replicas, MEMBERS, {}) == 0.0
+    assert preferred_order(replicas, {}) == {}
+
+
+def test_replica_moves_narrow_the_gap():
+    replicas = {pid: [A, B] for pid in range(4)}
+    assert replica_moves(replicas, MEMBERS, {}, max_moves=0) == {}
+    moves = replica_moves(replicas, MEMBERS, {}, max_moves=10)
+    replicas.update(moves)
+    load = Counter(m for rs in replicas.values() for m in rs)
+    assert max(load.values()) - min(load.values()) <= 1
+    # a moved replica keeps its position, so the preferred leader only changes when it moved
+    assert all(len(set(rs)) == 2 and C in rs for rs in moves.values())
+    assert replica_moves(replicas, MEMBERS, {}, max_moves=10) == {}
+
+
+def test_leader_elections():
+    replicas = {0: [A, B, C], 1: [B, C, A], 2: [C, A, B]}
+    leaders = {0: A, 1: C, 2: C}
+    isr = {0: [A, B, C], 1: [B, C, A], 2: [C, A, B]}
+    # partition 1 moves back to its preferred leader; nothing else changes
+    assert leader_elections(replicas, leaders, isr, MEMBERS) == {1: B}
+    # A is down: partition 0 fails over to the next in-sync replica
+    assert leader_elections(replicas, leaders, isr, [B, C]) == {0: B, 1: B}
+    # an out-of-sync replica is never elected, and skipped partitions are left alone
+    isr[0] = [A, C]
+    assert leader_elections(replicas, leaders, isr, [B, C], skip=[1]) == {0: C}
+
+
+def test_traffic_meter_rates():
+    meter = TrafficMeter(alpha=0.5, min_interval=1.0)
+    assert meter.sample({0: 100.0}, now=0.0) == {}
+    assert meter.sample({0: 300.0}, now=2.0) == {0: 100.0}
+    assert meter.sample({0: 900.0}, now=2.5) == {0: 100.0}  # too soon: unchanged
+    assert meter.sample({0: 900.0}, now=4.0) == {0: 200.0}  # EWMA of 100 and 300
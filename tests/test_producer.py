@@ -0,0 +1,16 @@
+"""The bundled producer spreads keys over every partition in the cluster metadata."""
+from bench.embedded import EmbeddedCluster
+from client import producer
+
+
+def test_keys_reach_every_partition(tmp_path, monkeypatch):
+    with EmbeddedCluster(ports=(9251,), num_partitions=5, replication_factor=1, data_dir=str(tmp_path),
+                         transport="http") as cluster:
+        monkeypatch.setattr(producer, "BOOTSTRAP_BROKERS", cluster.urls)
+        keys = [f"user-{i}" for i in range(40)]
+        for key in keys:
+            assert producer.produce(key, "v")
+        for pid in range(5):
+            stored = [m["key"] for m in cluster.consume(pid, 0)["messages"]]
+            assert stored == [k for k in keys if producer.partition_for(k, 5) == pid]
+            assert stored
@@ -0,0 +1,70 @@
+"""Diagnostics: the stack sampler, the slow-request log and their /admin endpoints."""
+import json
+import threading
+
+import requests
+
+from bench.embedded import EmbeddedCluster
+from broker.profiler import SlowRequestLog, StackSampler
+from broker.telemetry import Registry, StageTimer
+
+
+def spin_until(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_stack_sampler_sees_busy_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=spin_until, args=(stop,), name="spinner")
+    worker.start()
+    try:
+        sampler = StackSampler(interval=0.005).run(0.2)
+    finally:
+        stop.set()
+        worker.join()
+    assert sampler.taken > 10
+    spinning = [line for line in sampler.collapsed().splitlines() if line.startswith("spinner;")]
+    assert spinning and all("test_profiler.py:spin_until" in line for line in spinning)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in spinning) <= sampler.taken
+
+
+def test_slow_request_log(tmp_path):
+    path = str(tmp_path / "slow.jsonl")
+    log = SlowRequestLog(path, threshold_sec=0.05, keep=2)
+    hist = Registry().histogram("stages", "Stages", ["stage"])
+    fast = StageTimer(hist)
+    fast.finish()
+    assert log.maybe_record("/publish", fast) is None
+
+    for i in range(3):
+        slow = StageTimer(hist)
+        slow.record("disk_write", 0.06)
+        slow.stages["total"] = 0.07
+        entry = log.maybe_record("/publish", slow, partition=i)
+        assert entry["total_ms"] == 70.0 and entry["stages_ms"]["disk_write"] == 60.0
+    assert [e["partition"] for e in log.latest()] == [1, 2]
+    with open(path) as f:
+        assert [json.loads(line)["partition"] for line in f] == [0, 1, 2]
+    assert SlowRequestLog(path, 0).maybe_record("/publish", slow) is None
+
+
+def test_admin_endpoints(tmp_path):
+    config = {"admin": True, "slow_request_ms": 0.001}
+    with EmbeddedCluster(ports=(9281,), replication_factor=1, data_dir=str(tmp_path),
+                         transport="http", config=config) as cluster:
+        url = cluster.urls[0]
+        cluster.publish(0, [{"key": "k", "value": 1}])
+        slow = requests.get(f"{url}/admin/slow_requests", timeout=2).json()
+        assert slow["threshold_ms"] == 0.001
+        assert slow["requests"][-1]["endpoint"] == "/publish" and "total" in slow["requests"][-1]["stages_ms"]
+
+        profile = requests.get(f"{url}/admin/profile", params={"seconds": 0.2}, timeout=5)
+        assert profile.status_code == 200 and profile.text.strip()
+        assert requests.get(f"{url}/admin/profile", params={"seconds": 0}, timeout=2).status_code == 400
+
+
+def test_admin_endpoints_need_admin(tmp_path):
+    with EmbeddedCluster(ports=(9282,), replication_factor=1, data_dir=str(tmp_path),
+                         transport="http") as cluster:
+        assert requests.get(f"{cluster.urls[0]}/admin/slow_requests", timeout=2).status_code == 404
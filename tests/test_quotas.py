@@ -0,0 +1,85 @@
+"""Quotas: token-bucket debt, per-client throttling, and clients honouring the hints."""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from analytics import stream_analytics
+from broker.quotas import QuotaManager, TokenBucket
+from client.throttle import throttle_hint
+
+
+def test_token_bucket_debt():
+    b = TokenBucket(rate=100, burst=50, now=0.0)
+    assert b.charge(50, 0.0) == 0.0
+    assert b.charge(100, 0.0) == pytest.approx(1.0)  # 100 tokens short at 100/s
+    assert b.debt(0.5) == pytest.approx(0.5)
+    assert b.debt(2.0) == 0.0
+    assert b.tokens == 50  # refills up to the burst only
+
+
+def test_quota_manager_throttles_per_client():
+    q = QuotaManager(produce_bytes_per_sec=1000, burst_sec=1.0, reject_after_ms=500)
+    assert q.enabled and q.record("a", "consume", 10**6) == 0.0  # no consume quota
+    assert q.record("a", "produce", 1000) == 0.0
+    throttle = q.record("a", "produce", 1000)
+    assert 900 < throttle <= 1000
+    assert q.check("a", "produce") > 0 and q.check("b", "produce") == 0.0
+    assert q.should_reject(throttle) and not q.should_reject(400)
+    assert not QuotaManager().enabled and QuotaManager().record("a", "produce", 10**9) == 0.0
+
+
+def test_request_rate_quota_is_shared_by_kinds():
+    q = QuotaManager(requests_per_sec=2, burst_sec=1.0)
+    q.record("a", "produce", 1)
+    q.record("a", "consume", 1)
+    assert q.record("a", "consume", 1) > 0
+
+
+class Response:
+    def __init__(self, body, headers=None):
+        self.body, self.headers = body, headers or {}
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("no JSON body")
+        return self.body
+
+
+def test_throttle_hint_prefers_the_body():
+    assert throttle_hint(Response({"throttle_time_ms": 250.0}, {"Retry-After": "1"})) == 250.0
+    assert throttle_hint(Response(None, {"Retry-After": "2"})) == 2000.0
+
+
+class ThrottlingBroker(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = json.dumps({"messages": [{"key": "k", "value": 1, "timestamp": 1.0}],
+                           "next_offset": 1, "throttle_time_ms": 300}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_analytics_honours_throttle_time_on_success():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingBroker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    md = {"partitions": {"0": [url]}, "leaders": {"0": url}}
+    job = stream_analytics.build_job()
+    try:
+        with ThreadPoolExecutor(2) as pool:
+            assert stream_analytics.poll_once(job, md, pool) == 1
+            assert stream_analytics.throttled_until[0] > time.time()
+            # the partition is skipped until the hint has passed
+            assert stream_analytics.poll_once(job, md, pool) == 0
+    finally:
+        stream_analytics.throttled_until.clear()
+        server.shutdown()
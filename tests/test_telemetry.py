@@ -0,0 +1,55 @@
+"""/metrics: Prometheus text rendering of the broker's counters, histograms and gauges."""
+import requests
+
+from bench.embedded import EmbeddedCluster
+from broker.telemetry import Registry
+
+
+def samples(text):
+    """{"name{labels}": value} of the sample lines of a text exposition."""
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            out[name] = float(value)
+    return out
+
+
+def test_registry_rendering():
+    r = Registry()
+    c = r.counter("requests_total", "Requests", ["path"])
+    h = r.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    r.gauge("queue_depth", "Queued", [], lambda: [((), 3)])
+    c.inc(1, "/a")
+    c.inc(2, "/a")
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v, "total")
+    text = r.render()
+    assert "# TYPE requests_total counter" in text and "# TYPE latency_seconds histogram" in text
+    assert "# HELP queue_depth Queued" in text
+    assert samples(text) == {
+        'requests_total{path="/a"}': 3,
+        'latency_seconds_bucket{stage="total",le="0.1"}': 1,
+        'latency_seconds_bucket{stage="total",le="1.0"}': 2,
+        'latency_seconds_bucket{stage="total",le="+Inf"}': 3,
+        'latency_seconds_sum{stage="total"}': 5.55,
+        'latency_seconds_count{stage="total"}': 3,
+        "queue_depth": 3,
+    }
+
+
+def test_metrics_endpoint(tmp_path):
+    with EmbeddedCluster(ports=(9271,), replication_factor=1, data_dir=str(tmp_path),
+                         transport="http") as cluster:
+        cluster.publish(0, [{"key": "k", "value": i, "producer_id": "p", "seq": i} for i in range(3)])
+        cluster.publish(0, [{"key": "k", "value": 0, "producer_id": "p", "seq": 0}])
+        cluster.consume(0, 0)
+        resp = requests.get(f"{cluster.urls[0]}/metrics", timeout=2)
+    assert resp.headers["content-type"].startswith("text/plain")
+    m = samples(resp.text)
+    assert m['pubg1_messages_in_total{partition="0",source="publish"}'] == 3
+    assert m['pubg1_duplicates_total{partition="0"}'] == 1
+    assert m['pubg1_messages_out_total{partition="0"}'] == 3
+    assert m['pubg1_log_end_offset{partition="0"}'] == m['pubg1_high_watermark{partition="0"}'] == 3
+    assert m['pubg1_publish_stage_seconds_count{stage="total"}'] == 2
+    assert m['pubg1_under_replicated'] == 0
@@ -0,0 +1,54 @@
+"""TieredStorage: offloaded segments read back through the store, and stale segments are kept."""
+import json
+import threading
+
+from broker.log import PartitionLog
+from broker.tiered import DirectoryObjectStore, TieredStorage
+
+
+def new_log(path):
+    log = PartitionLog(str(path), segment_bytes=200, index_interval_bytes=100)
+    for i in range(30):
+        m = {"key": f"k{i % 2}", "value": i, "timestamp": 100.0 + i}
+        log.append([m], [json.dumps(m) + "\n"])
+    return log
+
+
+def test_offload_and_read_back(tmp_path):
+    log = new_log(tmp_path / "p0")
+    tiered = TieredStorage(DirectoryObjectStore(str(tmp_path / "remote")), "b1", retain_local_segments=1)
+    tiered.attach(log)
+    expected = [log.get(i) for i in range(30)]
+    n = tiered.offload(log, threading.Lock())
+    assert n == len(log.segments) - 2 > 0  # the newest closed segment and the active one stay local
+    assert log.start_offset > 0 == log.first_offset
+    assert [log.get(i) for i in range(30)] == expected
+    assert tiered.offload(log, threading.Lock()) == 0
+
+
+class TruncatingStore(DirectoryObjectStore):
+    """Truncates the log while the first segment is being uploaded, like a follower
+    dropping a tail its new leader does not have."""
+
+    def __init__(self, root, log, offset):
+        super().__init__(root)
+        self.log, self.offset = log, offset
+
+    def put_file(self, name, path):
+        super().put_file(name, path)
+        if self.offset is not None:
+            self.log.truncate(self.offset)
+            self.offset = None
+
+
+def test_offload_skips_a_segment_truncated_during_upload(tmp_path):
+    log = new_log(tmp_path / "p0")
+    first = log.segments[0]
+    store = TruncatingStore(str(tmp_path / "remote"), log, first.base_offset + 2)
+    tiered = TieredStorage(store, "b1", retain_local_segments=0)
+    tiered.attach(log)
+
+    assert tiered.offload(log, threading.Lock()) == 0
+    assert log.start_offset == 0 and log.end_offset == first.base_offset + 2
+    assert not any(s.remote for s in log.segments)
+    assert not store.exists(tiered.object_name(log, log.segments[0]))
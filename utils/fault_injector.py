@@ -2,55 +2,229 @@
 # Author: Jeevan Reji
 # Date: 2025-08-28
 # -------------------------
-import subprocess
-import time
 import os
 import signal
-import psutil   
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import psutil
+import requests
+
+from utils.netproxy import DelayProxy
+
 
 class FaultInjector:
     """
-    Directly kills brokers running on given ports (like Ctrl+C),
-    and restarts them using the same commands you’d run in terminal.
+    Kills, pauses, slows down and restarts brokers on localhost.
+
+    Brokers the injector starts are tracked by their process handle and are
+    ready as soon as /health answers; brokers started elsewhere are looked up
+    once by their listening port. With `proxy_port_offset`, brokers it starts
+    listen on port + offset behind a DelayProxy on their advertised port, which
+    `delay_network` uses. Passing a bench.cluster.LocalCluster makes it manage
+    that cluster's processes instead.
+
+    Disk and replication faults are set on the broker through /admin/faults, so
+    the broker must run with BROKER_ADMIN=1 (brokers started here always do).
+
+    Every fault is appended to `events` as {"t": epoch seconds, "fault": ...,
+    "port": ...}, ready to be stored next to benchmark results.
     """
 
-    def __init__(self, broker_ports):
-        self.broker_ports = broker_ports
+    def __init__(self, broker_ports: Sequence[int], cluster=None, proxy_port_offset: int = 0,
+                 cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                 ready_timeout: float = 15.0):
+        self.broker_ports = list(broker_ports)
+        self.cluster = cluster
+        self.proxy_port_offset = proxy_port_offset
+        self.cwd = cwd
+        self.extra_env = dict(env or {})
+        self.ready_timeout = ready_timeout
+        self.procs: Dict[int, subprocess.Popen] = cluster.procs if cluster is not None else {}
+        self.proxies: Dict[int, DelayProxy] = {}
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
 
-    def _find_pid_on_port(self, port):
-        """Return PID of process listening on the port, or None."""
-        for proc in psutil.process_iter(["pid"]):
-            try:
-                for conn in proc.connections(kind="inet"):
-                    if conn.laddr.port == port:
-                        return proc.pid
-            except (psutil.AccessDenied, psutil.NoSuchProcess):
-                continue
+    def _record(self, fault: str, port: int, **fields) -> Dict:
+        event = dict({"t": time.time(), "fault": fault, "port": port}, **fields)
+        with self._lock:
+            self.events.append(event)
+        details = " ".join(f"{k}={v}" for k, v in fields.items())
+        print(f"[FaultInjector] {fault} {port} {details}".rstrip())
+        return event
+
+    # --- processes ---
+
+    def pid_of(self, port: int) -> Optional[int]:
+        """PID of the broker on port: the tracked process, else whoever listens on it."""
+        proc = self.procs.get(port)
+        if proc is not None and proc.poll() is None:
+            return proc.pid
+        listen_port = port + self.proxy_port_offset if port in self.proxies else port
+        try:
+            # one system-wide socket table read instead of asking every process
+            conns = [(c.pid, c) for c in psutil.net_connections(kind="inet")]
+        except psutil.AccessDenied:
+            conns = []
+            for p in psutil.process_iter(["pid"]):
+                try:
+                    conns.extend((p.pid, c) for c in p.connections(kind="inet"))
+                except (psutil.AccessDenied, psutil.NoSuchProcess):
+                    continue
+        for pid, conn in conns:
+            if conn.laddr and conn.laddr.port == listen_port and conn.status == psutil.CONN_LISTEN:
+                return pid
         return None
 
-    def kill_broker(self, port):
-        pid = self._find_pid_on_port(port)
-        if pid:
-            print(f"[FaultInjector] Killing broker {port} (pid={pid})")
-            try:
-                os.kill(pid, signal.SIGTERM)   # graceful like Ctrl+C
-                time.sleep(1)
-            except Exception as e:
-                print(f"[FaultInjector] Error killing {port}: {e}")
-        else:
-            print(f"[FaultInjector] Broker {port} not found")
+    def url(self, port: int) -> str:
+        return f"http://localhost:{port}"
 
-    def restart_broker(self, port):
-        print(f"[FaultInjector] Restarting broker {port}")
+    def start_broker(self, port: int):
+        if self.cluster is not None:
+            self.cluster.start_broker(port)
+            return
         env = os.environ.copy()
+        env.update(self.extra_env)
         env["BROKER_PORT"] = str(port)
-        subprocess.Popen(
-            ["python", "-m", "broker.run_broker", str(port)],
-            env=env
-        )
-        time.sleep(2)  # let it boot
+        env["BROKER_ADMIN"] = "1"
+        if self.proxy_port_offset:
+            env["BROKER_LISTEN_PORT"] = str(port + self.proxy_port_offset)
+            if port not in self.proxies:
+                self.proxies[port] = DelayProxy(port, port + self.proxy_port_offset).start()
+        self.procs[port] = subprocess.Popen(
+            [sys.executable, "-m", "broker.run_broker", str(port)] + [str(p) for p in self.broker_ports],
+            cwd=self.cwd, env=env)
 
-    def kill_and_restart(self, port, downtime=5):
+    def wait_ready(self, port: int, timeout: Optional[float] = None) -> bool:
+        """Poll /health until the broker answers; False on timeout or if it exited."""
+        deadline = time.time() + (self.ready_timeout if timeout is None else timeout)
+        while time.time() < deadline:
+            proc = self.procs.get(port)
+            if proc is not None and proc.poll() is not None:
+                return False
+            try:
+                if requests.get(f"{self.url(port)}/health", timeout=0.5).ok:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.05)
+        return False
+
+    def kill_broker(self, port: int, sig: int = signal.SIGTERM, timeout: float = 5.0):
+        """Signal the broker (SIGTERM like Ctrl+C by default) and wait until it has exited."""
+        pid = self.pid_of(port)
+        if pid is None:
+            print(f"[FaultInjector] Broker {port} not found")
+            return
+        self._record("kill", port, pid=pid, signal=signal.Signals(sig).name)
+        proc = self.procs.pop(port, None)
+        try:
+            if proc is not None and proc.pid == pid:
+                proc.send_signal(sig)
+                try:
+                    proc.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            else:
+                p = psutil.Process(pid)
+                p.send_signal(sig)
+                try:
+                    p.wait(timeout)
+                except psutil.TimeoutExpired:
+                    p.kill()
+                    p.wait(timeout)
+        except (psutil.NoSuchProcess, ProcessLookupError):
+            pass
+        self._record("down", port)
+
+    def restart_broker(self, port: int) -> bool:
+        t0 = time.time()
+        self._record("restart", port)
+        self.start_broker(port)
+        ready = self.wait_ready(port)
+        if ready:
+            self._record("ready", port, startup_sec=round(time.time() - t0, 3))
+        else:
+            self._record("not_ready", port, waited_sec=round(time.time() - t0, 3))
+        return ready
+
+    def kill_and_restart(self, port: int, downtime: float = 5) -> bool:
         self.kill_broker(port)
         time.sleep(downtime)
-        self.restart_broker(port)
+        return self.restart_broker(port)
+
+    def pause_broker(self, port: int, duration: Optional[float] = None):
+        """SIGSTOP the broker: it keeps its sockets but stops answering. With a
+        duration, blocks and resumes it afterwards."""
+        pid = self.pid_of(port)
+        if pid is None:
+            print(f"[FaultInjector] Broker {port} not found")
+            return
+        os.kill(pid, signal.SIGSTOP)
+        self._record("pause", port, pid=pid, duration_sec=duration)
+        if duration is not None:
+            time.sleep(duration)
+            self.resume_broker(port)
+
+    def resume_broker(self, port: int):
+        pid = self.pid_of(port)
+        if pid is not None:
+            os.kill(pid, signal.SIGCONT)
+            self._record("resume", port, pid=pid)
+
+    # --- faults applied by the broker itself (broker/faults.py) ---
+
+    def _set_faults(self, port: int, body: Dict):
+        r = requests.post(f"{self.url(port)}/admin/faults", json=body, timeout=2.0)
+        if r.status_code == 404:
+            raise RuntimeError(f"broker {port} does not serve /admin/faults; start it with BROKER_ADMIN=1")
+        r.raise_for_status()
+
+    def slow_disk(self, port: int, delay_ms: float, duration: Optional[float] = None):
+        """Every log append on the broker takes delay_ms longer (cleared by the broker after duration)."""
+        self._set_faults(port, {"disk_delay_ms": delay_ms, "duration_sec": duration})
+        self._record("slow_disk", port, delay_ms=delay_ms, duration_sec=duration)
+
+    def drop_replication(self, port: int, probability: float = 1.0, duration: Optional[float] = None):
+        """The broker drops incoming replication pushes and skips catch-up fetches."""
+        self._set_faults(port, {"drop_replication": probability, "duration_sec": duration})
+        self._record("drop_replication", port, probability=probability, duration_sec=duration)
+
+    def clear_faults(self, port: int):
+        self._set_faults(port, {"clear": True})
+        self._record("clear_faults", port)
+
+    # --- network ---
+
+    def delay_network(self, port: int, delay_ms: float, jitter_ms: float = 0.0,
+                      duration: Optional[float] = None):
+        """Delay traffic to and from the broker by delay_ms each way (needs proxy_port_offset)."""
+        proxy = self.proxies.get(port)
+        if proxy is None:
+            raise RuntimeError(f"broker {port} is not behind a proxy; "
+                               f"start it through a FaultInjector with proxy_port_offset")
+        proxy.set_delay(delay_ms, jitter_ms)
+        self._record("network_delay", port, delay_ms=delay_ms, jitter_ms=jitter_ms, duration_sec=duration)
+        if duration is not None:
+            def reset():
+                proxy.set_delay(0.0)
+                self._record("network_delay_end", port)
+            timer = threading.Timer(duration, reset)
+            timer.daemon = True
+            timer.start()
+
+    def stop(self):
+        """Stop the brokers and proxies this injector started."""
+        if self.cluster is None:
+            for port in list(self.procs):
+                proc = self.procs.pop(port)
+                if proc.poll() is None:
+                    proc.terminate()
+                    proc.wait()
+        for proxy in self.proxies.values():
+            proxy.stop()
+        self.proxies.clear()
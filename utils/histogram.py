@@ -0,0 +1,123 @@
+"""
+Log-linear latency histogram (HDR-style) with constant memory.
+
+Values are recorded in integer microseconds. Below 128us every value has its
+own bucket; above that each power of two is split into 64 linear sub-buckets,
+so any recorded value is reported within ~1.6% of its true value. Up to an
+hour of latency fits in under 1800 counters.
+"""
+import math
+from typing import Dict, List, Optional
+
+SUB_BITS = 7
+SUB_COUNT = 1 << SUB_BITS          # 128 exact buckets at the bottom
+HALF = SUB_COUNT >> 1              # 64 sub-buckets per power of two above that
+MAX_US = 3600 * 1_000_000
+
+
+def _index(us: int) -> int:
+    if us < SUB_COUNT:
+        return us
+    shift = us.bit_length() - SUB_BITS
+    return shift * HALF + (us >> shift)
+
+
+def _value(idx: int) -> float:
+    """Midpoint (in microseconds) of the bucket at idx."""
+    if idx < SUB_COUNT:
+        return float(idx)
+    shift = idx // HALF - 1
+    mantissa = idx - shift * HALF
+    return float((mantissa << shift) + ((1 << shift) >> 1))
+
+
+N_BUCKETS = _index(MAX_US) + 1
+
+
+class LatencyHistogram:
+    """Counts of latencies (seconds) in log-linear buckets.
+
+    Not synchronised: record from one thread per histogram and merge at
+    report time (see utils.metrics.Metrics).
+    """
+
+    __slots__ = ("counts", "count", "total", "max", "errors")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1_000_000)
+        if us < 0:
+            us = 0
+        elif us > MAX_US:
+            us = MAX_US
+        self.counts[_index(us)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """Add other's counts into self and return self."""
+        c = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                c[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.errors += other.errors
+        return self
+
+    def copy(self) -> "LatencyHistogram":
+        return LatencyHistogram().merge(self)
+
+    def minus(self, earlier: "LatencyHistogram") -> "LatencyHistogram":
+        """Histogram of what was recorded since `earlier` (a past copy of this histogram).
+        The max is taken from the buckets, so it is approximate."""
+        out = LatencyHistogram()
+        out.counts = [a - b for a, b in zip(self.counts, earlier.counts)]
+        out.count = self.count - earlier.count
+        out.total = self.total - earlier.total
+        out.errors = self.errors - earlier.errors
+        top = self._top_index(out.counts)
+        out.max = 0.0 if top is None else _value(top) / 1_000_000
+        return out
+
+    @staticmethod
+    def _top_index(counts: List[int]) -> Optional[int]:
+        for i in range(len(counts) - 1, -1, -1):
+            if counts[i]:
+                return i
+        return None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency in seconds at quantile q (0-100)."""
+        if self.count <= 0:
+            return None
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n:
+                seen += n
+                if seen >= rank:
+                    return min(_value(i) / 1_000_000, self.max) if self.max else _value(i) / 1_000_000
+        return self.max
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        if self.count <= 0:
+            return {"avg": None, "p50": None, "p90": None, "p95": None, "p99": None, "p999": None, "max": None}
+        return {
+            "avg": self.total / self.count,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+        }
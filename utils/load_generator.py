@@ -1,61 +1,355 @@
-
 # -------------------------
 # Author: Jeevan Reji
 # Date: 2025-08-28
 # -------------------------
-import time, requests, json, threading, random
-from typing import Optional
+import time, requests, json, threading, random, uuid, bisect, itertools
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from client.throttle import throttle_hint
+from utils.metrics import Metrics
+
+BOOTSTRAP_BROKERS = [
+    "http://localhost:8000",
+    "http://localhost:8001",
+    "http://localhost:8002",
+    "http://localhost:8003",
+]
+
+class RateProfile:
+    """
+    Target publish rate (messages/sec) as a function of seconds since start.
+    """
+    def __init__(self, segments: List[Tuple[float, float, float]]):
+        # (duration, start_rps, end_rps); rate is linear within a segment
+        self.segments = segments
+        self.duration = sum(d for d, _, _ in segments)
+
+    @classmethod
+    def constant(cls, rps: float, duration: float) -> "RateProfile":
+        return cls([(duration, rps, rps)])
+
+    @classmethod
+    def ramp(cls, start_rps: float, end_rps: float, duration: float) -> "RateProfile":
+        return cls([(duration, start_rps, end_rps)])
+
+    @classmethod
+    def steps(cls, steps: Sequence[Tuple[float, float]]) -> "RateProfile":
+        """steps = [(duration, rps), ...]"""
+        return cls([(d, r, r) for d, r in steps])
+
+    def rate(self, t: float) -> float:
+        for d, r0, r1 in self.segments:
+            if t < d:
+                return r0 + (r1 - r0) * (t / d if d > 0 else 0.0)
+            t -= d
+        return 0.0
+
+class KeyPayloadSource:
+    """
+    Generates keys (uniform or zipf over num_keys) and values of a configurable size
+    ("fixed", "uniform" between payload_min/payload_max, or "exp" with mean payload_size).
+    """
+    def __init__(self, key_dist: str = "uniform", num_keys: int = 1000, zipf_s: float = 1.1,
+                 payload_dist: str = "fixed", payload_size: int = 32,
+                 payload_min: int = 8, payload_max: int = 256):
+        self.key_dist = key_dist
+        self.num_keys = num_keys
+        self.payload_dist = payload_dist
+        self.payload_size = payload_size
+        self.payload_min = payload_min
+        self.payload_max = payload_max
+        self._cum = None
+        if key_dist == "zipf":
+            weights = [1.0 / (i ** zipf_s) for i in range(1, num_keys + 1)]
+            self._cum = list(itertools.accumulate(weights))
+        elif key_dist != "uniform":
+            raise ValueError(f"unknown key distribution: {key_dist}")
+        self._filler = "x" * max(payload_max, payload_size * 20, 1)
+
+    def key(self, rnd: random.Random) -> str:
+        if self._cum is None:
+            return f"user-{rnd.randrange(self.num_keys)}"
+        i = bisect.bisect_left(self._cum, rnd.random() * self._cum[-1])
+        return f"user-{min(i, self.num_keys - 1)}"
+
+    def value(self, rnd: random.Random) -> str:
+        if self.payload_dist == "fixed":
+            n = self.payload_size
+        elif self.payload_dist == "uniform":
+            n = rnd.randint(self.payload_min, self.payload_max)
+        elif self.payload_dist == "exp":
+            n = int(rnd.expovariate(1.0 / max(1, self.payload_size)))
+        else:
+            raise ValueError(f"unknown payload distribution: {self.payload_dist}")
+        n = min(n, len(self._filler))
+        return self._filler[:n]
 
 class HttpLoadGenerator:
     """
-    Sends messages to the leader of a given partition at ~target_rps.
+    Publishes to the leader of a given partition following a RateProfile.
+
+    The schedule is open loop: every message has an intended send time derived
+    from the target rate, `workers` threads (each with its own keep-alive
+    session) pick up the next due slot, and latency is measured from the
+    intended send time rather than the actual one. When the broker falls
+    behind, queueing delay therefore shows up in the latency instead of
+    silently lowering the offered rate (coordinated omission). Raw service
+    time is recorded separately in `service_metrics`.
+
     Each message carries a client timestamp to measure end-to-end latency.
+    Metadata comes from `metadata_path` if given, otherwise from the brokers'
+    /metadata endpoint, and is cached until a publish fails or is redirected.
+
+    Broker quotas are honoured: a throttle_time_ms hint (or a 429) holds back
+    every worker until the hinted time (plus jitter) has passed. The wait counts
+    towards corrected latency. `sent`, `errors` and `throttled` count messages:
+    messages of a batch refused with a 429 are counted in `throttled` only, and
+    the metrics record one latency or one error per message as well.
     """
-    def __init__(self, metadata_path: str, partition: int, target_rps: float = 100.0):
+    def __init__(self, metadata_path: Optional[str], partition: int, target_rps: float = 100.0,
+                 workers: int = 8, batch_size: int = 1, source: Optional[KeyPayloadSource] = None,
+                 metrics: Optional[Metrics] = None, bootstrap: Sequence[str] = BOOTSTRAP_BROKERS,
+                 seed: Optional[int] = None):
         self.metadata_path = metadata_path
         self.partition = partition
         self.target_rps = target_rps
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.source = source or KeyPayloadSource()
+        self.metrics = metrics or Metrics()
+        self.service_metrics = Metrics()
+        self.bootstrap = list(bootstrap)
         self.running = False
         self.sent = 0
         self.errors = 0
+        self.throttled = 0
+        self.producer_id = uuid.uuid4().hex
+        self.client_id = f"loadgen-{self.producer_id[:8]}"
+        self._not_before = 0.0  # no request before this time (broker throttle hint)
+        self._producers = 0
+        # fixed seed -> the same key/payload sequence per worker on every run
+        self.seed = seed if seed is not None else self.producer_id
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._leader: Optional[str] = None
+
+    # --- metadata / connections ---
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            self._local.session = s
+        return s
 
     def _load_md(self):
-        with open(self.metadata_path, "r") as f:
-            return json.load(f)
+        if self.metadata_path:
+            with open(self.metadata_path, "r") as f:
+                return json.load(f)
+        for b in self.bootstrap:
+            try:
+                r = self._session().get(f"{b}/metadata", timeout=1.0)
+                r.raise_for_status()
+                return r.json()
+            except requests.exceptions.RequestException:
+                continue
+        raise RuntimeError("No brokers available to fetch metadata from")
 
     def leader_url(self) -> str:
-        md = self._load_md()
-        return md["leaders"][str(self.partition)]
+        leader = self._leader
+        if leader is None:
+            leader = self._load_md()["leaders"][str(self.partition)]
+            self._leader = leader
+        return leader
 
-    def send_once(self, key: Optional[str] = None, value: Optional[str] = None) -> float:
-        if key is None:
-            key = f"user-{random.randint(0, 999)}"
-        if value is None:
-            value = f"payload-{random.randint(0, 1_000_000)}"
-        payload = {
-            "key": key,
-            "value": value,
+    def _invalidate(self, leader: Optional[str] = None):
+        self._leader = leader
+
+    # --- sending ---
+
+    def _sequences(self, n: int) -> Tuple[str, int]:
+        """(producer_id, first seq) for n records. Every thread is its own idempotent
+        producer, numbering its records in the order it sends them."""
+        producer = getattr(self._local, "producer", None)
+        if producer is None:
+            with self._lock:
+                self._producers += 1
+                producer = self._local.producer = {"id": f"{self.producer_id}-{self._producers}", "next_seq": 0}
+        seq = producer["next_seq"]
+        producer["next_seq"] += n
+        return producer["id"], seq
+
+    def _message(self, rnd: random.Random, producer_id: str, seq: int, key: Optional[str] = None,
+                 value: Optional[str] = None) -> Dict:
+        return {
+            "key": key if key is not None else self.source.key(rnd),
+            "value": value if value is not None else self.source.value(rnd),
             "partition": self.partition,
-            "client_ts": time.time()
+            "client_ts": time.time(),
+            "producer_id": producer_id,
+            "seq": seq,
         }
-        leader = self.leader_url()
+
+    def _hold_off(self, throttle_ms: float):
+        until = time.time() + throttle_ms / 1000.0 * random.uniform(1.0, 1.2)
+        with self._lock:
+            self._not_before = max(self._not_before, until)
+
+    def _wait_if_throttled(self):
+        delay = self._not_before - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _post(self, payload: Dict) -> str:
+        """POST to the cached leader, following one redirect. Returns "ok", "throttled" (429) or "error"."""
+        for _ in range(2):
+            try:
+                leader = self.leader_url()
+                resp = self._session().post(f"{leader}/publish", json=payload, timeout=1.5,
+                                            headers={"X-Client-Id": self.client_id})
+                if resp.status_code == 429:
+                    self._hold_off(throttle_hint(resp))
+                    return "throttled"
+                resp.raise_for_status()
+                data = resp.json()
+            except (requests.exceptions.RequestException, RuntimeError, KeyError, ValueError):
+                self._invalidate()
+                return "error"
+            if data.get("status") == "redirect":
+                self._invalidate(data.get("leader"))
+                continue
+            if data.get("throttle_time_ms"):
+                self._hold_off(data["throttle_time_ms"])
+            return "ok" if data.get("status") == "ok" else "error"
+        return "error"
+
+    def _send(self, payload: Dict, n: int) -> Tuple[str, float]:
+        """Post n messages and count them under their outcome. Returns (outcome, service time)."""
         t0 = time.time()
-        try:
-            resp = requests.post(f"{leader}/publish", json=payload, timeout=1.5)
-            resp.raise_for_status()
-            self.sent += 1
-            return time.time() - t0
-        except requests.exceptions.RequestException:
-            self.errors += 1
-            return -1.0
+        outcome = self._post(payload)
+        dt = time.time() - t0
+        with self._lock:
+            if outcome == "ok":
+                self.sent += n
+            elif outcome == "throttled":
+                self.throttled += n
+            else:
+                self.errors += n
+        return outcome, dt
 
-    def run_for(self, duration_sec: float):
+    def _batch(self, n: int, rnd: random.Random) -> Dict:
+        producer_id, seq = self._sequences(n)
+        msgs = [self._message(rnd, producer_id, seq + i) for i in range(n)]
+        return msgs[0] if n == 1 else {"partition": self.partition, "messages": msgs}
+
+    def send_batch(self, n: int, rnd: Optional[random.Random] = None) -> float:
+        """Publish n messages in one request. Returns the service time, or -1.0 if they were not published."""
+        outcome, dt = self._send(self._batch(n, rnd or random), n)
+        return dt if outcome == "ok" else -1.0
+
+    def send_once(self, key: Optional[str] = None, value: Optional[str] = None) -> float:
+        outcome, dt = self._send(self._message(random, *self._sequences(1), key, value), 1)
+        return dt if outcome == "ok" else -1.0
+
+    # --- scheduling ---
+
+    def run(self, profile: RateProfile, on_slot: Optional[Callable[[float], None]] = None) -> Dict:
+        """
+        Run the profile to completion. Returns {"offered", "sent", "errors",
+        "throttled", "elapsed_sec", "achieved_rps"} for this run.
+        """
         self.running = True
-        deadline = time.time() + duration_sec
-        interval = 1.0 / self.target_rps if self.target_rps > 0 else 0.0
-        while time.time() < deadline and self.running:
-            dt = self.send_once()
-            if interval > 0:
-                to_sleep = max(0.0, interval)
-                time.sleep(to_sleep)
+        start = time.time()
+        deadline = start + profile.duration
+        sched = {"t": start}
+        sched_lock = threading.Lock()
+        sent0, errors0, throttled0 = self.sent, self.errors, self.throttled
+        offered = [0]
+
+        def next_slot() -> Optional[float]:
+            with sched_lock:
+                t = sched["t"]
+                while self.running and t < deadline:
+                    rate = profile.rate(t - start)
+                    if rate > 0:
+                        sched["t"] = t + self.batch_size / rate
+                        offered[0] += self.batch_size
+                        return t
+                    t += 0.01  # idle segment of the profile
+                sched["t"] = t
+                return None
+
+        def worker(wid: int):
+            rnd = random.Random(f"{self.seed}-{wid}")
+            while True:
+                slot = next_slot()
+                if slot is None:
+                    return
+                delay = slot - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self._wait_if_throttled()
+                outcome, dt = self._send(self._batch(self.batch_size, rnd), self.batch_size)
+                # one entry per message, like the counters; throttled messages are neither
+                if outcome == "ok":
+                    corrected = time.time() - slot
+                    for _ in range(self.batch_size):
+                        self.metrics.record_pub(corrected)
+                        self.service_metrics.record_pub(dt)
+                elif outcome == "error":
+                    for _ in range(self.batch_size):
+                        self.metrics.record_pub(-1.0)
+                        self.service_metrics.record_pub(-1.0)
+                if on_slot is not None:
+                    on_slot(slot)
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.running = False
+        elapsed = time.time() - start
+        sent = self.sent - sent0
+        return {
+            "offered": offered[0],
+            "sent": sent,
+            "errors": self.errors - errors0,
+            "throttled": self.throttled - throttled0,
+            "elapsed_sec": elapsed,
+            "achieved_rps": sent / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def run_for(self, duration_sec: float):
+        return self.run(RateProfile.constant(self.target_rps, duration_sec))
+
+    def stop(self):
         self.running = False
+
+    def find_saturation(self, rates: Sequence[float], step_sec: float = 10.0,
+                        p99_limit_sec: float = 0.5, min_ratio: float = 0.95) -> Dict:
+        """
+        Step through increasing target rates and report, per step, the achieved
+        rate and corrected latency. The saturation point is the first rate the
+        broker cannot sustain (achieved < min_ratio * target) or whose corrected
+        p99 exceeds p99_limit_sec.
+        """
+        steps = []
+        saturated_at = None
+        for rps in rates:
+            step_metrics = Metrics()
+            saved = self.metrics
+            self.metrics = step_metrics
+            try:
+                res = self.run(RateProfile.constant(rps, step_sec))
+            finally:
+                self.metrics = saved
+            lat = step_metrics.summary()["publish"]["latency"]
+            res.update({"target_rps": rps, "p50": lat["p50"], "p99": lat["p99"], "max": lat["max"]})
+            steps.append(res)
+            print(f"[LoadGen] target={rps:.0f}/s achieved={res['achieved_rps']:.1f}/s "
+                  f"p99={None if lat['p99'] is None else round(lat['p99'] * 1000, 1)} ms errors={res['errors']}")
+            too_slow = lat["p99"] is None or lat["p99"] > p99_limit_sec
+            if res["achieved_rps"] < min_ratio * rps or too_slow:
+                saturated_at = rps
+                break
+        return {"steps": steps, "saturated_at": saturated_at}
@@ -1,59 +1,110 @@
-
 # -------------------------
 # Author: Jeevan Reji
 # Date: 2025-08-28
 # -------------------------
-import threading, statistics, time
+import threading, time
+from typing import Dict, List, Optional
+from utils.histogram import LatencyHistogram
+
+class _Recorder:
+    """
+    One LatencyHistogram per recording thread, merged at report time.
+    Recording never takes a shared lock; the registry lock is only taken the
+    first time a thread records.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._histograms: List[LatencyHistogram] = []
+
+    def _mine(self) -> LatencyHistogram:
+        h = getattr(self._local, "hist", None)
+        if h is None:
+            h = LatencyHistogram()
+            with self._lock:
+                self._histograms.append(h)
+            self._local.hist = h
+        return h
+
+    def record(self, dt: float):
+        h = self._mine()
+        if dt >= 0:
+            h.record(dt)
+        else:
+            h.errors += 1
+
+    def merged(self) -> LatencyHistogram:
+        with self._lock:
+            hs = list(self._histograms)
+        out = LatencyHistogram()
+        for h in hs:
+            out.merge(h)
+        return out
 
 class Metrics:
     def __init__(self):
-        self.lock = threading.Lock()
-        self.pub_latencies = []     
-        self.consume_latencies = [] 
-        self.pub_errors = 0
-        self.consume_errors = 0
-        self.pub_count = 0
-        self.consume_count = 0
+        self.pub = _Recorder()
+        self.consume = _Recorder()
         self.t0 = time.time()
+        # interval snapshots for latency-over-time plots
+        self.intervals: List[Dict] = []
+        self._last_t = self.t0
+        self._last_pub = LatencyHistogram()
+        self._last_consume = LatencyHistogram()
+        self._interval_lock = threading.Lock()
+        self._stop_evt: Optional[threading.Event] = None
 
     def record_pub(self, dt: float):
-        with self.lock:
-            if dt >= 0:
-                self.pub_latencies.append(dt)
-                self.pub_count += 1
-            else:
-                self.pub_errors += 1
+        self.pub.record(dt)
 
     def record_consume(self, dt: float):
-        with self.lock:
-            if dt >= 0:
-                self.consume_latencies.append(dt)
-                self.consume_count += 1
-            else:
-                self.consume_errors += 1
-
-    def _stats(self, xs):
-        if not xs:
-            return {"avg": None, "p95": None}
-        xs_sorted = sorted(xs)
-        p95_idx = max(0, int(0.95 * (len(xs_sorted)-1)))
-        return {"avg": statistics.mean(xs_sorted), "p95": xs_sorted[p95_idx]}
+        self.consume.record(dt)
+
+    @staticmethod
+    def _section(h: LatencyHistogram, elapsed: float) -> Dict:
+        return {
+            "count": h.count,
+            "errors": h.errors,
+            "throughput": h.count / elapsed if elapsed > 0 else 0.0,
+            "latency": h.stats()
+        }
 
     def summary(self):
-        with self.lock:
-            elapsed = time.time() - self.t0
-            return {
-                "elapsed_sec": elapsed,
-                "publish": {
-                    "count": self.pub_count,
-                    "errors": self.pub_errors,
-                    "throughput": self.pub_count / elapsed if elapsed > 0 else 0.0,
-                    "latency": self._stats(self.pub_latencies)
-                },
-                "consume": {
-                    "count": self.consume_count,
-                    "errors": self.consume_errors,
-                    "throughput": self.consume_count / elapsed if elapsed > 0 else 0.0,
-                    "latency": self._stats(self.consume_latencies)
-                }
+        elapsed = time.time() - self.t0
+        return {
+            "elapsed_sec": elapsed,
+            "publish": self._section(self.pub.merged(), elapsed),
+            "consume": self._section(self.consume.merged(), elapsed)
+        }
+
+    def snapshot_interval(self) -> Dict:
+        """Stats for everything recorded since the previous snapshot; also appended to self.intervals."""
+        with self._interval_lock:
+            now = time.time()
+            pub, cons = self.pub.merged(), self.consume.merged()
+            elapsed = now - self._last_t
+            snap = {
+                "t_start": self._last_t - self.t0,
+                "t_end": now - self.t0,
+                "publish": self._section(pub.minus(self._last_pub), elapsed),
+                "consume": self._section(cons.minus(self._last_consume), elapsed)
             }
+            self._last_t, self._last_pub, self._last_consume = now, pub, cons
+            self.intervals.append(snap)
+            return snap
+
+    def start_intervals(self, period_sec: float = 1.0):
+        """Take an interval snapshot every period_sec on a background thread until stop_intervals()."""
+        self._stop_evt = threading.Event()
+        stop_evt = self._stop_evt
+
+        def loop():
+            while not stop_evt.wait(period_sec):
+                self.snapshot_interval()
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def stop_intervals(self):
+        if self._stop_evt is not None:
+            self._stop_evt.set()
+            self._stop_evt = None
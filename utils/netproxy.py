@@ -0,0 +1,119 @@
+# -------------------------
+# Local TCP proxy with adjustable delay
+# -------------------------
+"""
+DelayProxy listens on one local port and forwards every connection to a
+target port, holding each chunk of data for `delay_ms` (+ up to `jitter_ms`)
+in each direction. Delay and jitter can be changed while connections are
+open, which is how FaultInjector adds network latency in front of a broker
+without root or tc/netem. Data is never reordered within a connection.
+"""
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+CHUNK = 64 * 1024
+
+
+class DelayProxy:
+    def __init__(self, listen_port: int, target_port: int, delay_ms: float = 0.0,
+                 jitter_ms: float = 0.0, host: str = "127.0.0.1"):
+        self.listen_port = listen_port
+        self.target_port = target_port
+        self.host = host
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self._server = None
+        self._stopped = threading.Event()
+
+    def set_delay(self, delay_ms: float, jitter_ms: float = 0.0):
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.listen_port))
+        self._server.listen(128)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            try:
+                self._server.close()
+            except OSError:
+                pass
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection((self.host, self.target_port), timeout=5.0)
+                upstream.settimeout(None)
+            except OSError:
+                client.close()
+                continue
+            for s in (client, upstream):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pipe(client, upstream)
+            self._pipe(upstream, client)
+
+    def _pipe(self, src: socket.socket, dst: socket.socket):
+        """Two threads per direction: a reader stamping each chunk with its release
+        time, and a writer sending chunks once they are due."""
+        pending = deque()
+        ready = threading.Condition()
+
+        def reader():
+            last = 0.0
+            while True:
+                try:
+                    data = src.recv(CHUNK)
+                except OSError:
+                    data = b""
+                delay = (self.delay_ms + random.uniform(0, self.jitter_ms)) / 1000.0
+                # never release before the previous chunk: jitter must not reorder data
+                last = max(last, time.monotonic() + delay)
+                with ready:
+                    pending.append((last, data))
+                    ready.notify()
+                if not data:
+                    return
+
+        def writer():
+            while True:
+                with ready:
+                    while not pending:
+                        ready.wait()
+                    due, data = pending.popleft()
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if not data:
+                    break
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    break
+            for s in (dst, src):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                s.close()
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()